@@ -0,0 +1,349 @@
+"""
+Storage benchmarks.
+
+Populates synthetic "users" and "linking-sessions" collections at each of several
+sizes, then measures the latency and throughput of the storage operations
+(create, get, save, update, delete and list), both from a single thread and from
+several threads at once.
+
+Results are written as JSON; given a baseline file from an earlier run, they are
+also compared against it, and the run fails if any operation's throughput has
+regressed by more than the tolerance.
+
+Run from the "src" directory, e.g.
+
+    python -m benchmarks.storage_benchmark --sizes 10000,100000 --output results.json
+    python -m benchmarks.storage_benchmark --baseline results.json
+
+See docs/development.md.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from orcidlink.lib.db import FileStorage, now
+from orcidlink.lib.db_log import LogStorage
+from orcidlink.lib.db_sqlite import SQLiteStorage
+
+BACKENDS = ["file", "log", "sqlite"]
+
+COLLECTIONS = ["users", "linking-sessions"]
+
+# Operations measured individually; "list" is measured once per collection.
+OPERATIONS = ["create", "get", "save", "update", "delete"]
+
+
+def make_storage(backend: str, directory: str, codec: str):
+    if backend == "file":
+        return FileStorage(directory=directory, codecs={collection: codec for collection in COLLECTIONS})
+    elif backend == "log":
+        return LogStorage(directory=directory)
+    elif backend == "sqlite":
+        return SQLiteStorage(path=os.path.join(directory, "orcidlink.sqlite3"))
+    else:
+        raise ValueError(f"Unsupported storage backend: {backend}")
+
+
+#
+# Synthetic records, shaped like the real ones.
+#
+
+def make_record(collection: str, name: str):
+    created_at = int(time.time() * 1000)
+    if collection == "users":
+        return {
+            "created_at": created_at,
+            "expires_at": created_at + 631138518000,
+            "orcid_auth": {
+                "access_token": str(uuid.uuid4()),
+                "token_type": "bearer",
+                "refresh_token": str(uuid.uuid4()),
+                "expires_in": 631138518,
+                "scope": "/read-limited openid /activities/update",
+                "name": f"Name of {name}",
+                "orcid": f"0000-0000-{random.randint(1000, 9999)}-{random.randint(1000, 9999)}",
+                "id_token": "x" * 600
+            }
+        }
+    else:
+        return {
+            "session_id": name,
+            "username": f"user{random.randint(0, 1000000)}",
+            "created_at": created_at,
+            "expires_at": created_at + 600000
+        }
+
+
+def entity_name(collection: str, index: int):
+    if collection == "users":
+        return f"user{index}"
+    return f"session-{index}"
+
+
+def populate(storage, collection: str, size: int, threads: int):
+    """
+    Fills a collection with "size" records. FileStorage is populated by writing its
+    entity files and then its index once, as creating entities one by one rewrites the
+    whole index each time, which would dominate the run at the larger sizes.
+    """
+    names = [entity_name(collection, index) for index in range(size)]
+    if isinstance(storage, FileStorage):
+        codec_name = storage.get_codec(collection).name
+        created = now()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(
+                lambda item: storage.write_collection_entity(collection, item[0] + 1,
+                                                             make_record(collection, item[1])),
+                enumerate(names)
+            ))
+        storage.save_collection_index(collection, {
+            'last_id': size,
+            'entities': {
+                name: {
+                    'id': index + 1,
+                    'codec': codec_name,
+                    'metadata': {},
+                    'events': [{'event': 'created', 'at': created}]
+                }
+                for index, name in enumerate(names)
+            }
+        })
+    else:
+        for name in names:
+            storage.save(collection, name, make_record(collection, name))
+
+
+#
+# Measurement
+#
+
+def summarize(latencies: list, elapsed: float, errors: int):
+    latencies = sorted(latencies)
+
+    def percentile(fraction):
+        if len(latencies) == 0:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "ops_per_second": len(latencies) / elapsed if elapsed > 0 else None,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies) * 1000 if latencies else None,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": latencies[-1] * 1000 if latencies else None
+        }
+    }
+
+
+def run_operation(storage, collection: str, operation: str, names: list, threads: int):
+    """
+    Performs the operation once for each name, from "threads" threads, and returns a
+    summary of the latencies. Failed operations are counted, not timed.
+    """
+    latencies = []
+    errors = 0
+
+    def perform(name):
+        start = time.perf_counter()
+        try:
+            if operation == "get":
+                storage.get(collection, name)
+            elif operation == "create":
+                storage.create(collection, name, make_record(collection, name))
+            elif operation == "save":
+                storage.save(collection, name, make_record(collection, name))
+            elif operation == "update":
+                storage.update(collection, name, make_record(collection, name))
+            elif operation == "delete":
+                storage.delete(collection, name)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if threads == 1:
+        results = [perform(name) for name in names]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(perform, names))
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        if result is None:
+            errors += 1
+        else:
+            latencies.append(result)
+    return summarize(latencies, elapsed, errors)
+
+
+def benchmark_collection(storage, backend: str, collection: str, size: int, operations: int,
+                         thread_counts: list, run_id: str):
+    results = []
+
+    def add_result(operation, threads, summary):
+        result = {
+            "backend": backend,
+            "collection": collection,
+            "size": size,
+            "operation": operation,
+            "threads": threads,
+            **summary
+        }
+        results.append(result)
+        print(f"  {backend:6} {collection:16} {size:>8} {operation:6} threads={threads:<3} "
+              f"{result['ops_per_second'] or 0:>10.1f} ops/s  "
+              f"p95={result['latency_ms']['p95'] or 0:.2f}ms  errors={result['errors']}",
+              file=sys.stderr)
+
+    existing = [entity_name(collection, index) for index in range(size)]
+    for threads in thread_counts:
+        sample = random.sample(existing, min(operations, size))
+        # New entities are created, and then deleted, so that each measurement sees
+        # the collection at its nominal size.
+        new_names = [f"{entity_name(collection, size)}-{run_id}-{threads}-{index}" for index in range(operations)]
+        for operation in OPERATIONS:
+            names = new_names if operation in ("create", "delete") else sample
+            add_result(operation, threads, run_operation(storage, collection, operation, names, threads))
+
+    start = time.perf_counter()
+    storage.list(collection)
+    elapsed = time.perf_counter() - start
+    add_result("list", 1, summarize([elapsed], elapsed, 0))
+
+    return results
+
+
+def run_benchmarks(backends: list, sizes: list, operations: int, thread_counts: list, codec: str,
+                   directory: str = None):
+    results = []
+    run_id = uuid.uuid4().hex[:8]
+    for backend in backends:
+        for size in sizes:
+            data_dir = tempfile.mkdtemp(prefix=f"orcidlink-benchmark-{backend}-{size}-", dir=directory)
+            try:
+                storage = make_storage(backend, data_dir, codec)
+                for collection in COLLECTIONS:
+                    start = time.perf_counter()
+                    populate(storage, collection, size, max(thread_counts))
+                    print(f"populated {backend} {collection} with {size} records in "
+                          f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+                    results.extend(benchmark_collection(storage, backend, collection, size, operations,
+                                                        thread_counts, run_id))
+            finally:
+                shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+
+#
+# Baseline comparison
+#
+
+def result_key(result):
+    return result["backend"], result["collection"], result["size"], result["operation"], result["threads"]
+
+
+def compare(results: list, baseline: list, tolerance: float):
+    """
+    Returns the results whose throughput is lower than the baseline's by more than the
+    tolerance (a fraction), as (result, baseline result) pairs.
+    """
+    baseline_results = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get(result_key(result))
+        if baseline_result is None or not baseline_result["ops_per_second"] or \
+                result["ops_per_second"] is None:
+            continue
+        ratio = result["ops_per_second"] / baseline_result["ops_per_second"]
+        print(f"  {' '.join(str(part) for part in result_key(result)):60} {ratio:6.2f}x baseline",
+              file=sys.stderr)
+        if ratio < 1 - tolerance:
+            regressions.append((result, baseline_result))
+    return regressions
+
+
+def parse_list(value: str):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the storage backends")
+    parser.add_argument("--backends", default="file",
+                        help=f"comma separated backends to benchmark; any of {', '.join(BACKENDS)}")
+    parser.add_argument("--sizes", default="10000,100000",
+                        help="comma separated collection sizes; e.g. 10000,100000,1000000")
+    parser.add_argument("--operations", type=int, default=200,
+                        help="number of each operation to perform per measurement")
+    parser.add_argument("--threads", default="1,8",
+                        help="comma separated thread counts to measure with")
+    parser.add_argument("--codec", default="json",
+                        help="the FileStorage codec for both collections")
+    parser.add_argument("--directory", default=None,
+                        help="directory in which to create the temporary data directories")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON results to; stdout if omitted")
+    parser.add_argument("--baseline", default=None,
+                        help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="fraction by which throughput may fall below the baseline")
+    args = parser.parse_args(argv)
+
+    backends = parse_list(args.backends)
+    for backend in backends:
+        if backend not in BACKENDS:
+            parser.error(f"unsupported backend: {backend}")
+
+    results = run_benchmarks(backends,
+                             [int(size) for size in parse_list(args.sizes)],
+                             args.operations,
+                             [int(threads) for threads in parse_list(args.threads)],
+                             args.codec,
+                             args.directory)
+
+    report = {
+        "meta": {
+            "time": now(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "operations": args.operations,
+            "codec": args.codec
+        },
+        "results": results
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if len(regressions) > 0:
+            for result, baseline_result in regressions:
+                print(f"REGRESSION {' '.join(str(part) for part in result_key(result))}: "
+                      f"{result['ops_per_second']:.1f} ops/s, baseline {baseline_result['ops_per_second']:.1f} ops/s",
+                      file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
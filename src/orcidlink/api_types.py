@@ -15,9 +15,28 @@ from pydantic import BaseModel, Field
 #
 # API Typing
 #
+class CacheStats(BaseModel):
+    size: int = Field(...)
+    max_size: int = Field(...)
+    hits: int = Field(...)
+    misses: int = Field(...)
+    # For caches also bounded by the total size of their entries.
+    bytes: int | None = Field(default=None)
+    max_bytes: int | None = Field(default=None)
+
+
 class StatusResponse(BaseModel):
     status: str = Field(...)
     time: str = Field(...)
+    # Absent if the link record cache is disabled, or not yet used.
+    link_record_cache: CacheStats | None = Field(default=None)
+    # Absent if not yet used.
+    token_cache: CacheStats | None = Field(default=None)
+    # Absent if the shared token cache is disabled, or not yet used.
+    shared_token_cache: CacheStats | None = Field(default=None)
+    invalid_token_cache: CacheStats | None = Field(default=None)
+    # Absent if the ORCID API response cache is disabled, or not yet used.
+    orcid_response_cache: CacheStats | None = Field(default=None)
 
 
 class ServiceConfig(BaseModel):
@@ -31,6 +31,13 @@ class Config:
             raise ValueError(f"Config not found on path: {'.'.join(key_path)}")
         return value
 
+    def get_config_default(self, key_path: List[str], default_value: Any = None, reload: bool = False):
+        config = self.ensure_config(reload=reload)
+        value, found = get_prop(config, key_path)
+        if not found:
+            return default_value
+        return value
+
     def set_config(self, key_path: List[str], new_value: Any, reload: bool = False):
         config = self.ensure_config(reload=reload)
         existing_value, found = get_prop(config, key_path)
@@ -88,6 +95,11 @@ def get_config(key_path: List[str], reload: bool = False):
     return GLOBAL_CONFIG.get_config(key_path, reload=reload)
 
 
+def get_config_default(key_path: List[str], default_value: Any = None, reload: bool = False):
+    global GLOBAL_CONFIG
+    return GLOBAL_CONFIG.get_config_default(key_path, default_value, reload=reload)
+
+
 def set_config(key_path: List[str], new_value: Any, reload: bool = False):
     global GLOBAL_CONFIG
     return GLOBAL_CONFIG.set_config(key_path, new_value, reload=reload)
@@ -2,3 +2,10 @@ ORCID_SCOPES = "/read-limited /activities/update openid"
 
 # How long a linking session is valid for after creation; in seconds.
 LINKING_SESSION_TTL = 10 * 60
+
+# The field which identifies an entity within each storage collection; used by
+# storage backends which index records by a named field rather than a file name.
+STORAGE_COLLECTION_KEYS = {
+    "users": "username",
+    "linking-sessions": "session_id"
+}
@@ -1,9 +1,19 @@
+import bisect
 import datetime
+import fcntl
+import hashlib
 import json
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
 
 from orcidlink.lib import utils
+from orcidlink.lib.constants import STORAGE_COLLECTION_KEYS
 
 
 ################################
@@ -14,90 +24,506 @@ def now():
     return datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
 
 
-class FileStorage:
-    def __init__(self, directory="work/data"):
-        self.root_path = Path(os.path.join(utils.module_dir(), directory))
+#
+# Collection indexes are kept resident, keyed by index file path, so that they are
+# parsed once rather than on every storage call. Each entry records the stat
+# signature of the file it was loaded from or flushed to; if the file on disk no
+# longer matches (e.g. another worker process sharing the data directory wrote to
+# it), the index is reloaded.
+#
+index_cache = {}
+index_cache_lock = threading.RLock()
 
-    def get_collection_file_path(self, collection, name, add_extension=True, require_exists=True,
-                                 require_not_exists=False):
-        dir_path = Path(self.root_path, collection)
-        if not dir_path.exists():
-            dir_path.mkdir(parents=True, exist_ok=True)
-        if add_extension:
-            filename = f"{name}.json"
-        else:
-            filename = name
-        file_path = os.path.join(dir_path, filename)
-        if require_exists:
-            if not Path(file_path).exists():
-                raise Exception('File does not exist');
-        if require_not_exists:
-            if Path(file_path).exists():
-                raise Exception('File already exists');
-        return file_path
-
-    def get_collection_path(self, collection):
-        dir_path = Path(self.root_path, collection)
-        if not dir_path.exists():
-            dir_path.mkdir(parents=True, exist_ok=True)
-        return dir_path
+# The (id, name) of each entity of a resident index, in id order, for iteration; kept
+# with the index object it was made from, and discarded whenever that index is changed.
+index_sorted_entries = {}
 
-    def get_collection_index(self, collection):
-        file_path = self.get_collection_file_path(collection, 'index', require_exists=False)
-        if not Path(file_path).exists():
-            return {'last_id': 0, 'entities': {}}
 
-        with open(file_path, "r") as db_file:
-            return json.load(db_file)
+def index_file_signature(stat_result: os.stat_result):
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
 
-    def create_collection_index_entry(self, collection, name, metadata={}):
-        index = self.get_collection_index(collection)
-        index['last_id'] += 1
-        # TODO: add date created
-        index['entities'][name] = {
-            'id': index['last_id'],
-            'metadata': metadata,
-            'events': [
-                {
-                    'event': 'created',
-                    'at': now()
-                }
-            ]
-        }
 
-        self.save_collection_index(collection, index)
+#
+# Record codecs determine how a collection's entities and index are written to
+# disk. The codec used for each entity is noted in its index entry (entries
+# without one were written with "json"); an entity written with a codec other
+# than the collection's current one is rewritten with it the next time it is
+# saved, or by convert_codec().
+#
+class JSONCodec:
+    def __init__(self, name: str, **dumps_options):
+        self.name = name
+        self.dumps_options = dumps_options
 
-        return index['last_id']
+    def encode(self, value) -> str:
+        return json.dumps(value, **self.dumps_options)
 
-    def create_collection_index_event(self, collection, name, event_name):
-        index = self.get_collection_index(collection)
+    @staticmethod
+    def decode(text: str):
+        return json.loads(text)
 
-        entry = index['entities'][name]
-        entry['events'].append({
-            'event': event_name,
-            'at': now()
-        })
 
-        self.save_collection_index(collection, index)
+CODECS = {
+    # The original, human-readable, format.
+    "json": JSONCodec("json", indent=4),
+    # No insignificant whitespace; roughly half the size, and encoded without
+    # indentation so the C encoder is used.
+    "compact-json": JSONCodec("compact-json", separators=(',', ':'))
+}
 
-        return index['last_id']
+DEFAULT_CODEC = "json"
 
-    def save_collection_index(self, collection, index):
-        file_path = self.get_collection_file_path(collection, 'index', require_exists=False)
-        with open(file_path, "w") as db_file:
-            json.dump(index, db_file, indent=4)
 
-    def delete_collection_index_entry(self, collection, name):
-        index = self.get_collection_index(collection)
-        entry = index['entities'].get(name)
-        if entry is None:
-            return
+#
+# Entity file layouts determine where an entity's file is placed within its
+# collection's directory. Entity files are looked for in each layout, the
+# collection's own first, so that data written with one layout can be read with
+# another; they are moved to the collection's layout when next written, or by
+# migrate_layout().
+#
+def flat_entity_path(collection_path: Path, entity_id) -> Path:
+    return Path(collection_path, f"{entity_id}.json")
+
+
+def sharded_entity_path(collection_path: Path, entity_id) -> Path:
+    """
+    Spreads entity files across two levels of 256 directories, named by the leading
+    bytes of a hash of the entity id (e.g. "3f/a2/1234.json"), so that no directory
+    grows too large.
+    """
+    digest = hashlib.md5(str(entity_id).encode('utf-8')).hexdigest()
+    return Path(collection_path, digest[0:2], digest[2:4], f"{entity_id}.json")
+
 
-        del index['entities'][name]
+LAYOUTS = {
+    "flat": flat_entity_path,
+    "sharded": sharded_entity_path
+}
 
-        self.save_collection_index(collection, index)
+DEFAULT_LAYOUT = "flat"
 
+
+#
+# Files are never written in place. Each is written to a temporary file in the same
+# directory which is then renamed over it, so that a crash mid-write leaves either
+# the old or the new file, never a torn one. When writes are "durable", the
+# temporary file, and then the directory holding the renamed file, are fsync'd.
+#
+def fsync_directory(dir_path):
+    try:
+        dir_fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        # Not every platform allows a directory to be opened.
         return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def write_temp_file(file_path, text: str, durable: bool) -> str:
+    """
+    Writes the text to a new temporary file beside the given file, creating the
+    directory if need be, and returns its path. Directories are only created when a
+    write fails for the lack of one, rather than checked before every write.
+    """
+    dir_path = os.path.dirname(file_path)
+    temp_path = os.path.join(dir_path, f".{os.path.basename(file_path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        temp_file = open(temp_path, "w")
+    except FileNotFoundError:
+        os.makedirs(dir_path, exist_ok=True)
+        temp_file = open(temp_path, "w")
+    try:
+        with temp_file:
+            temp_file.write(text)
+            if durable:
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+    except BaseException:
+        remove_file(temp_path)
+        raise
+    return temp_path
+
+
+def remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def write_file(file_path, text: str, durable: bool = True, exclusive: bool = False):
+    """
+    Atomically replaces the file with one containing the text or, if "exclusive",
+    atomically creates it, raising FileExistsError if it already exists.
+    """
+    temp_path = write_temp_file(file_path, text, durable)
+    try:
+        if exclusive:
+            # Unlike a rename, a link fails rather than replace an existing file.
+            os.link(temp_path, file_path)
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, file_path)
+    except BaseException:
+        remove_file(temp_path)
+        raise
+    if durable:
+        fsync_directory(os.path.dirname(file_path))
+
+
+class IndexChange:
+    def __init__(self, apply):
+        self.apply = apply
+        self.done = False
+        self.error = None
+
+
+class IndexWriter:
+    """
+    Serializes the changes to one collection index file, within the process by a
+    lock, and across the worker processes sharing the data directory by an advisory
+    lock on the collection's "index.lock" file. The index is changed only while both
+    are held, after it has been reloaded if another process has written it, so that
+    no process's changes are lost to another's.
+
+    In group commit mode the changes requested by concurrent callers are applied,
+    and the index written, together. The first caller to arrive while no write is in
+    progress waits for the commit window to allow others to join it, and then
+    applies every pending change; each caller waits for its own change to be
+    written, and sees the error if the write fails.
+    """
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.pending = []
+        self.writing = False
+
+    @contextmanager
+    def file_lock(self):
+        try:
+            lock_file = open(self.lock_path, "a")
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            lock_file = open(self.lock_path, "a")
+        with lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def update(self, apply, write, window: float):
+        """
+        Applies the change, a function of the index, with "write", which applies a list
+        of changes and writes the index, possibly along with the changes of others.
+        """
+        change = IndexChange(apply)
+        with self.condition:
+            self.pending.append(change)
+            while self.writing and not change.done:
+                self.condition.wait()
+            if change.done:
+                if change.error is not None:
+                    raise change.error
+                return
+            self.writing = True
+
+        try:
+            time.sleep(window)
+            with self.condition:
+                changes = self.pending
+                self.pending = []
+            try:
+                write([change.apply for change in changes])
+            except Exception as error:
+                for change in changes:
+                    change.error = error
+                raise
+            finally:
+                for change in changes:
+                    change.done = True
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+index_writers = {}
+
+
+def get_index_writer(file_path) -> IndexWriter:
+    with index_cache_lock:
+        writer = index_writers.get(file_path)
+        if writer is None:
+            writer = IndexWriter(os.path.join(os.path.dirname(file_path), "index.lock"))
+            index_writers[file_path] = writer
+        return writer
+
+
+# Entities are read this many at a time, concurrently, when iterating over a collection.
+ITERATE_BATCH_SIZE = 100
+ITERATE_MAX_WORKERS = 8
+
+# Subdirectories of a collection are scanned this many at a time when checking its index.
+SCAN_MAX_WORKERS = 8
+
+
+def entity_file_id(file_name: str):
+    """
+    The entity id for an entity file name (e.g. "1234.json"), or None for any other
+    file, such as the index or a temporary file.
+    """
+    stem, extension = os.path.splitext(file_name)
+    if extension != '.json' or not stem.isdigit():
+        return None
+    return int(stem)
+
+
+def scan_entity_files(dir_path):
+    """
+    The (id, path) of each entity file in the directory and its subdirectories.
+    """
+    entity_files = []
+    for walk_path, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            entity_id = entity_file_id(file_name)
+            if entity_id is not None:
+                entity_files.append((entity_id, Path(walk_path, file_name)))
+    return entity_files
+
+
+class UnrecoverableIndexError(Exception):
+    """
+    A corrupt collection index which can not be rebuilt without losing entities; see
+    FileStorage.check_collection().
+    """
+
+
+class FileStorage:
+    def __init__(self, directory="work/data", codecs: dict = None, layout: str = DEFAULT_LAYOUT,
+                 durable: bool = True, group_commit_window: float = 0):
+        """
+        The "codecs" option maps collection names to the name of the codec for that
+        collection; collections not mentioned use the default codec.
+
+        The "layout" option names the entity file layout; see LAYOUTS.
+
+        The "durable" option determines whether files are fsync'd as they are written.
+
+        The "group_commit_window" option, in seconds, enables group commit of index
+        writes if greater than zero; see IndexWriter.
+        """
+        self.root_path = Path(os.path.join(utils.module_dir(), directory))
+        self.codecs = codecs or {}
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown storage layout: {layout}")
+        self.layout = layout
+        self.durable = durable
+        self.group_commit_window = group_commit_window
+
+    def get_codec(self, collection) -> JSONCodec:
+        codec_name = self.codecs.get(collection, DEFAULT_CODEC)
+        codec = CODECS.get(codec_name)
+        if codec is None:
+            raise ValueError(f"Unknown storage codec: {codec_name}")
+        return codec
+
+    def get_index_file_path(self, collection):
+        return os.path.join(self.root_path, collection, 'index.json')
+
+    def get_entity_file_paths(self, collection, entity_id):
+        """
+        The paths at which the entity's file may be found; the path for this storage's
+        layout first, followed by those for the other layouts.
+        """
+        collection_path = Path(self.root_path, collection)
+        paths = [LAYOUTS[self.layout](collection_path, entity_id)]
+        for layout, entity_path in LAYOUTS.items():
+            if layout != self.layout:
+                paths.append(entity_path(collection_path, entity_id))
+        return paths
+
+    def get_collection_index(self, collection):
+        """
+        The collection's index, as most recently changed in this process or, if the
+        index file has been written elsewhere since, as read from the file.
+
+        Changes are made to the index, and written, with update_collection_index().
+        """
+        file_path = self.get_index_file_path(collection)
+        with index_cache_lock:
+            try:
+                signature = index_file_signature(os.stat(file_path))
+            except FileNotFoundError:
+                signature = None
+
+            cached = index_cache.get(file_path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+
+            if signature is None:
+                index = {'last_id': 0, 'entities': {}}
+            else:
+                with open(file_path, "r") as db_file:
+                    index = self.get_codec(collection).decode(db_file.read())
+            index_cache[file_path] = (signature, index)
+            return index
+
+    def allocate_collection_index_id(self, collection):
+        """
+        Proposes an id for a new entity. It is only taken once its entity file has been
+        created; see create_collection_entity().
+        """
+        with index_cache_lock:
+            index = self.get_collection_index(collection)
+            index['last_id'] += 1
+            return index['last_id']
+
+    def create_collection_index_entry(self, collection, name, entity_id, metadata={}):
+        codec_name = self.get_codec(collection).name
+
+        def create_entry(index):
+            index['last_id'] = max(index['last_id'], entity_id)
+            # TODO: add date created
+            index['entities'][name] = {
+                'id': entity_id,
+                'codec': codec_name,
+                'metadata': metadata,
+                'events': [
+                    {
+                        'event': 'created',
+                        'at': now()
+                    }
+                ]
+            }
+
+        self.update_collection_index(collection, create_entry)
+
+        return entity_id
+
+    def create_collection_index_event(self, collection, name, event_name):
+        self.update_collection_index_entry(collection, name, event_name)
+
+    def update_collection_index_entry(self, collection, name, event_name=None):
+        """
+        Records that the entity has been written with the collection's current codec,
+        and the event, if any, in a single index write.
+        """
+        codec_name = self.get_codec(collection).name
+
+        def needs_update(index):
+            entry = index['entities'].get(name)
+            if entry is None:
+                return False
+            return event_name is not None or entry.get('codec', DEFAULT_CODEC) != codec_name
+
+        def update_entry(index):
+            if not needs_update(index):
+                return
+            entry = index['entities'][name]
+            entry['codec'] = codec_name
+            if event_name is not None:
+                entry['events'].append({
+                    'event': event_name,
+                    'at': now()
+                })
+
+        with index_cache_lock:
+            if not needs_update(self.get_collection_index(collection)):
+                return
+
+        self.update_collection_index(collection, update_entry)
+
+    def save_collection_index(self, collection, index):
+        """
+        Replaces the collection's index with the given one, and writes it.
+        """
+
+        def replace_index(current):
+            if current is not index:
+                current.clear()
+                current.update(index)
+
+        self.update_collection_index(collection, replace_index)
+
+    def update_collection_index(self, collection, change):
+        """
+        Applies the change, a function which modifies the index in place, to the
+        collection's index and writes it; in group commit mode, the write may be
+        shared with concurrent callers. See IndexWriter.
+        """
+        file_path = self.get_index_file_path(collection)
+        if self.group_commit_window > 0:
+            get_index_writer(file_path).update(change,
+                                               lambda changes: self.write_collection_index(collection, changes),
+                                               self.group_commit_window)
+        else:
+            self.write_collection_index(collection, [change])
+
+    @contextmanager
+    def collection_index_lock(self, collection):
+        """
+        Holds the collection's index lock, within this process and across processes;
+        see IndexWriter.
+        """
+        writer = get_index_writer(self.get_index_file_path(collection))
+        with writer.lock, writer.file_lock():
+            yield
+
+    def write_collection_index(self, collection, changes):
+        with self.collection_index_lock(collection):
+            self.write_locked_collection_index(collection, changes)
+
+    def write_locked_collection_index(self, collection, changes):
+        """
+        As write_collection_index(), for a caller which holds the collection's index lock.
+        """
+        file_path = self.get_index_file_path(collection)
+        index = None
+        temp_path = None
+        try:
+            with index_cache_lock:
+                # Reloaded if written by another process since it was last read.
+                index = self.get_collection_index(collection)
+                index_sorted_entries.pop(file_path, None)
+                for change in changes:
+                    change(index)
+                text = self.get_codec(collection).encode(index)
+
+            temp_path = write_temp_file(file_path, text, self.durable)
+            signature = index_file_signature(os.stat(temp_path))
+            # The index is replaced and its cache entry updated together, so that
+            # a concurrent reader doesn't mistake this process's write for another's.
+            with index_cache_lock:
+                os.replace(temp_path, file_path)
+                cached = index_cache.get(file_path)
+                if cached is not None and cached[1] is index:
+                    index_cache[file_path] = (signature, index)
+        except BaseException:
+            if temp_path is not None:
+                remove_file(temp_path)
+            # The changes were made to the cached index in place, but not written;
+            # it is dropped, to be reloaded from the file.
+            with index_cache_lock:
+                cached = index_cache.get(file_path)
+                if cached is not None and cached[1] is index:
+                    del index_cache[file_path]
+            raise
+        if self.durable:
+            fsync_directory(os.path.dirname(file_path))
+
+    def delete_collection_index_entry(self, collection, name):
+        with index_cache_lock:
+            if name not in self.get_collection_index(collection)['entities']:
+                return
+
+        self.update_collection_index(collection, lambda index: index['entities'].pop(name, None))
 
     def get_collection_index_id(self, collection, name):
         index = self.get_collection_index(collection)
@@ -107,22 +533,249 @@ class FileStorage:
         return entry['id']
 
     def get_collection_entity(self, collection, name):
-        entity_id = self.get_collection_index_id(collection, name)
-        if entity_id is None:
+        index = self.get_collection_index(collection)
+        entry = index['entities'].get(name)
+        if entry is None:
             return None
 
-        return self.get_collection_entity_by_id(collection, entity_id)
+        return self.get_collection_entity_by_id(collection, entry['id'])
+
+    def write_collection_entity(self, collection, entity_id, value, require_exists=False, require_not_exists=False):
+        file_path, *other_paths = self.get_entity_file_paths(collection, entity_id)
+        existing_paths = [path for path in [file_path, *other_paths] if path.exists()]
+        if require_exists and len(existing_paths) == 0:
+            raise Exception('File does not exist')
+        if require_not_exists and len(existing_paths) > 0:
+            raise FileExistsError('File already exists')
+
+        write_file(file_path, self.get_codec(collection).encode(value), self.durable,
+                   exclusive=require_not_exists)
+
+        # The entity has moved to this storage's layout. The old file may already have
+        # been moved by migrate_layout().
+        for path in existing_paths:
+            if path != file_path:
+                remove_file(path)
+
+    def create_collection_entity(self, collection, value):
+        """
+        Writes a new entity file, under a newly allocated id, which is returned.
+
+        Other processes sharing the data directory allocate ids too; as the file is
+        created exclusively, an id which has been taken by one of them, but which is
+        not yet in the index, is passed over.
+        """
+        while True:
+            entity_id = self.allocate_collection_index_id(collection)
+            try:
+                self.write_collection_entity(collection, entity_id, value, require_not_exists=True)
+                return entity_id
+            except FileExistsError:
+                continue
 
     def get_collection_entity_by_id(self, collection, entity_id):
         if entity_id is None:
             return None
 
-        file_path = self.get_collection_file_path(collection, entity_id, require_exists=False)
-        if not Path(file_path).exists():
-            # TODO: actually, this is an error.
-            return None
-        with open(file_path, "r") as db_file:
-            return json.load(db_file)
+        # A file moved between layouts by migrate_layout() while it is being looked for
+        # may be missed at both its old and new paths in one pass, but not in two.
+        for _ in range(2):
+            for file_path in self.get_entity_file_paths(collection, entity_id):
+                try:
+                    with open(file_path, "r") as db_file:
+                        return self.get_codec(collection).decode(db_file.read())
+                except FileNotFoundError:
+                    continue
+        # TODO: actually, this is an error.
+        return None
+
+    def migrate_layout(self, collection) -> int:
+        """
+        Moves the collection's entity files written with other layouts to this
+        storage's layout, in place; returns the number moved.
+
+        This is safe to run while the collection is in use:
+        - Each entity is moved with the collection's index locked, and only if it is
+          still in the index, so a concurrent delete can't leave its file behind.
+        - A file is moved by linking it at its new path and then removing the old
+          path. A link, unlike a rename, never replaces a file. If a writer has
+          already written the entity at its new path, that newer file is kept and the
+          old one just removed.
+        - Writers and readers allow for a file that moves while they use it. See
+          write_collection_entity() and get_collection_entity_by_id().
+        """
+        moved = 0
+        for name in list(self.get_collection_index(collection)['entities'].keys()):
+            with self.collection_index_lock(collection):
+                entry = self.get_collection_index(collection)['entities'].get(name)
+                if entry is None:
+                    continue
+                file_path, *other_paths = self.get_entity_file_paths(collection, entry['id'])
+                for path in other_paths:
+                    if not path.exists():
+                        continue
+                    file_path.parent.mkdir(parents=True, exist_ok=True)
+                    try:
+                        os.link(path, file_path)
+                    except FileExistsError:
+                        # Written at its new path by a writer since; that file is newer.
+                        pass
+                    except FileNotFoundError:
+                        # Moved, by a writer, meanwhile.
+                        continue
+                    remove_file(path)
+                    moved += 1
+        return moved
+
+    def convert_codec(self, collection):
+        """
+        Rewrites the collection's entities written with other codecs with this
+        storage's codec for the collection; returns the number rewritten.
+
+        An entity saved while it is being rewritten may lose that save, so this must
+        only be run while the collection is not in use.
+        """
+        codec_name = self.get_codec(collection).name
+        converted = 0
+        for name, entry in list(self.get_collection_index(collection)['entities'].items()):
+            if entry.get('codec', DEFAULT_CODEC) == codec_name:
+                continue
+            value = self.get_collection_entity_by_id(collection, entry['id'])
+            if value is None:
+                continue
+            self.write_collection_entity(collection, entry['id'], value)
+            self.update_collection_index_entry(collection, name)
+            converted += 1
+        return converted
+
+    def scan_collection_entity_ids(self, collection) -> set:
+        """
+        The ids of the entity files in the collection's directory, in any layout. The
+        subdirectories, of which the sharded layout has many, are scanned concurrently.
+
+        Files which are not where a layout would place them are ignored, as they would
+        not be found by get_collection_entity_by_id().
+        """
+        collection_path = Path(self.root_path, collection)
+        try:
+            dir_entries = list(os.scandir(collection_path))
+        except FileNotFoundError:
+            return set()
+
+        entity_files = []
+        subdir_paths = []
+        for dir_entry in dir_entries:
+            if dir_entry.is_dir():
+                subdir_paths.append(dir_entry.path)
+            else:
+                entity_id = entity_file_id(dir_entry.name)
+                if entity_id is not None:
+                    entity_files.append((entity_id, Path(dir_entry.path)))
+        with ThreadPoolExecutor(max_workers=SCAN_MAX_WORKERS) as executor:
+            for subdir_entity_files in executor.map(scan_entity_files, subdir_paths):
+                entity_files.extend(subdir_entity_files)
+
+        return {
+            entity_id for entity_id, path in entity_files
+            if path in self.get_entity_file_paths(collection, entity_id)
+        }
+
+    def check_collection(self, collection, rebuild=False) -> dict:
+        """
+        Compares the collection's index with its entity files, and returns a report of:
+
+        "entities": the number of index entries
+        "files": the number of entity files
+        "dangling": the index entries whose entity file is missing, as {name: id}
+        "orphans": the ids of entity files to which no index entry refers
+        "recovered": those orphans whose record includes the collection's key field
+            (see STORAGE_COLLECTION_KEYS), from which its entry can be restored, as
+            {name: id}
+        "corrupt": whether the index could not be read, in which case it is treated as
+            empty
+
+        If "rebuild", the index is then rewritten without the dangling entries and with
+        entries for the recovered orphans; a corrupt index is first set aside, as
+        "index.json.corrupt". Orphans which can not be recovered are left in place.
+        A corrupt index is not rebuilt if any entity can not be recovered (e.g. link
+        records, which do not record their username), as those entities would be lost
+        from the collection; UnrecoverableIndexError is raised instead.
+
+        The rebuild is made with the collection's index locked, against the index as it
+        then is, so is safe while the collection is in use.
+        """
+        corrupt = False
+        try:
+            index = self.get_collection_index(collection)
+        except ValueError:
+            corrupt = True
+            index = {'last_id': 0, 'entities': {}}
+
+        entity_ids = self.scan_collection_entity_ids(collection)
+        indexed_ids = {entry['id'] for entry in index['entities'].values()}
+        dangling = {
+            name: entry['id'] for name, entry in index['entities'].items()
+            if entry['id'] not in entity_ids
+        }
+        orphans = sorted(entity_ids - indexed_ids)
+
+        recovered = {}
+        key = STORAGE_COLLECTION_KEYS.get(collection)
+        if key is not None and len(orphans) > 0:
+            def read_orphan(entity_id):
+                try:
+                    return self.get_collection_entity_by_id(collection, entity_id)
+                except ValueError:
+                    return None
+
+            with ThreadPoolExecutor(max_workers=ITERATE_MAX_WORKERS) as executor:
+                # In id order, so that the most recent of several for a name is kept.
+                for entity_id, value in zip(orphans, executor.map(read_orphan, orphans)):
+                    if isinstance(value, dict) and isinstance(value.get(key), str) and \
+                            value[key] not in index['entities']:
+                        recovered[value[key]] = entity_id
+
+        if rebuild:
+            if corrupt and len(recovered) < len(orphans):
+                raise UnrecoverableIndexError(
+                    f'The index of "{collection}" can not be read, and {len(orphans) - len(recovered)} '
+                    f'of its {len(orphans)} entity files do not record their name, so can not be '
+                    f'restored to a rebuilt index')
+
+            def rebuild_index(current):
+                for name, entity_id in dangling.items():
+                    entry = current['entities'].get(name)
+                    if entry is not None and entry['id'] == entity_id and \
+                            not any(path.exists() for path in self.get_entity_file_paths(collection, entity_id)):
+                        del current['entities'][name]
+                for name, entity_id in recovered.items():
+                    if name not in current['entities']:
+                        current['entities'][name] = {
+                            'id': entity_id,
+                            'codec': DEFAULT_CODEC,
+                            'metadata': {},
+                            'events': [{'event': 'recovered', 'at': now()}]
+                        }
+                current['last_id'] = max([current['last_id'], *entity_ids])
+
+            with self.collection_index_lock(collection):
+                if corrupt:
+                    # Unless it has been rebuilt meanwhile.
+                    try:
+                        self.get_collection_index(collection)
+                    except ValueError:
+                        index_path = self.get_index_file_path(collection)
+                        os.replace(index_path, f"{index_path}.corrupt")
+                self.write_locked_collection_index(collection, [rebuild_index])
+
+        return {
+            'entities': len(index['entities']),
+            'files': len(entity_ids),
+            'dangling': dangling,
+            'orphans': orphans,
+            'recovered': recovered,
+            'corrupt': corrupt
+        }
 
     # Public data access methods
 
@@ -130,58 +783,112 @@ class FileStorage:
         return self.get_collection_entity(collection, name)
 
     def list(self, collection):
-        index = self.get_collection_index(collection)
-
-        entity_values = [value for entity_name, value in index['entities'].items()]
-
-        result = list(map(
-            lambda entity_value: self.get_collection_entity_by_id(collection, entity_value['id']),
-            entity_values
-        ))
-
-        return result
+        return [value for _, _, value in self.iterate(collection)]
+
+    def get_sorted_index_entries(self, collection) -> list:
+        """
+        The (id, name) of each of the collection's entities, in id order. The list is
+        kept until the index changes, so that paging through the collection doesn't
+        sort the whole index for every page.
+        """
+        file_path = self.get_index_file_path(collection)
+        with index_cache_lock:
+            index = self.get_collection_index(collection)
+            cached = index_sorted_entries.get(file_path)
+            if cached is not None and cached[0] is index:
+                return cached[1]
+            entries = sorted((entry['id'], name) for name, entry in index['entities'].items())
+            index_sorted_entries[file_path] = (index, entries)
+            return entries
+
+    def iterate(self, collection, after_id=None, limit=None, batch_size=ITERATE_BATCH_SIZE):
+        """
+        Generates (id, name, value) for the entities in a collection, in id order,
+        starting after the entity with id "after_id" and yielding at most "limit".
+
+        Entity files are read concurrently in batches of "batch_size", so only a
+        batch of values is held in memory at a time. Entities whose file is missing
+        are skipped.
+        """
+        entries = self.get_sorted_index_entries(collection)
+        start = 0 if after_id is None else bisect.bisect_right(entries, after_id, key=lambda entry: entry[0])
+        end = len(entries) if limit is None else start + limit
+        entries = entries[start:end]
+
+        with ThreadPoolExecutor(max_workers=ITERATE_MAX_WORKERS) as executor:
+            entries = iter(entries)
+            while True:
+                batch = list(islice(entries, batch_size))
+                if len(batch) == 0:
+                    return
+                values = executor.map(
+                    lambda entry: self.get_collection_entity_by_id(collection, entry[0]),
+                    batch
+                )
+                for (entity_id, name), value in zip(batch, values):
+                    if value is not None:
+                        yield entity_id, name, value
 
     def save(self, collection, name, value):
         entity_id = self.get_collection_index_id(collection, name)
-        file_path = self.get_collection_file_path(collection, str(entity_id), require_exists=False)
-        with open(file_path, "w") as db_file:
-            json.dump(value, db_file, indent=4)
-        self.create_collection_index_event(collection, name, 'updated')
+        if entity_id is None:
+            raise Exception('File does not exist')
+        self.write_collection_entity(collection, entity_id, value)
+        self.update_collection_index_entry(collection, name, 'updated')
+
+    def save_many(self, collection, items):
+        """
+        Saves each of the (name, value) items, creating those which do not exist, and
+        writes the index once, after all of the entities.
+        """
+        items = dict(items)
+        created = {}
+        for name, value in items.items():
+            entity_id = self.get_collection_index_id(collection, name)
+            if entity_id is None:
+                created[name] = self.create_collection_entity(collection, value)
+            else:
+                self.write_collection_entity(collection, entity_id, value)
+
+        codec_name = self.get_codec(collection).name
+
+        def save_entries(index):
+            for name in items.keys():
+                entry = index['entities'].get(name)
+                if name in created:
+                    index['last_id'] = max(index['last_id'], created[name])
+                    index['entities'][name] = {
+                        'id': created[name],
+                        'codec': codec_name,
+                        'metadata': {},
+                        'events': [{'event': 'created', 'at': now()}]
+                    }
+                elif entry is not None:
+                    entry['codec'] = codec_name
+                    entry['events'].append({'event': 'updated', 'at': now()})
+
+        self.update_collection_index(collection, save_entries)
 
-    # TODO: manipulate index, manipulate entity; then as a unit save index, save entity.
     def create(self, collection, name, value):
-        entity_id = self.create_collection_index_entry(collection, name)
-        file_path = self.get_collection_file_path(collection, str(entity_id), require_exists=False,
-                                                  require_not_exists=True)
-        with open(file_path, "w") as db_file:
-            json.dump(value, db_file, indent=4)
+        # The entity is written before the index entry which refers to it, so that a
+        # crash between the two leaves an unreferenced entity file rather than an entry
+        # without one.
+        entity_id = self.create_collection_entity(collection, value)
+        self.create_collection_index_entry(collection, name, entity_id)
 
     def update(self, collection, name, value):
         entity_id = self.get_collection_index_id(collection, name)
-        file_path = self.get_collection_file_path(collection, str(entity_id), require_exists=True)
-        with open(file_path, "w") as db_file:
-            json.dump(value, db_file, indent=4)
+        self.write_collection_entity(collection, entity_id, value, require_exists=True)
+        self.update_collection_index_entry(collection, name)
 
     def delete(self, collection, name):
         entity_id = self.get_collection_index_id(collection, name)
-        file_path = self.get_collection_file_path(collection, str(entity_id), require_exists=False)
-
         # Ignore delete request if does not exist; this ensures it is idemptotent.
-        if not Path(file_path).exists():
+        if entity_id is None:
             return
 
-        try:
-            os.remove(file_path)
-        except:
-            # We don't care if it fails, and we don't want to use exists first
-            # as it encourages a race condition.
-            # TODO: detect reason; if doesn't exist, ok; otherwise raise error
-            pass
-
-        try:
-            self.delete_collection_index_entry(collection, name)
-        except:
-            pass
-
-# class MongoFS:
-#
+        # The index entry is removed before the entity file, for the same reason that
+        # create() writes them in the opposite order.
+        self.delete_collection_index_entry(collection, name)
+        for file_path in self.get_entity_file_paths(collection, entity_id):
+            remove_file(file_path)
@@ -0,0 +1,323 @@
+import fcntl
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+
+from orcidlink.lib import utils
+
+################################
+# Log-structured Storage
+################################
+
+#
+# Each collection is a single append-only log of JSON lines. A line is either the
+# log header, which carries a generation id which changes each time the log is
+# compacted, a "put" of an entity's complete value, or a "delete" tombstone.
+#
+# Appended records are preceded by a newline, so that a record torn by a crash
+# mid-write is terminated by the next append and skipped, rather than swallowing
+# the record that follows it.
+#
+# The most recent record for each entity is located through an in-memory map of
+# entity name to the (offset, length) of that record in the log, so a write is a
+# single append and a read a single seek.
+#
+
+# Compaction is considered once the log holds at least this many bytes of
+# superseded records, and performed if they make up more than this fraction of it.
+COMPACTION_MIN_DEAD_BYTES = 1024 * 1024
+COMPACTION_DEAD_RATIO = 0.5
+
+# Entities are read this many at a time when iterating over a collection.
+ITERATE_BATCH_SIZE = 100
+
+
+def encode_record(record) -> bytes:
+    return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class CollectionLog:
+    """
+    The in-memory state of one collection's log, shared by all LogStorage instances
+    in the process.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock_path = path.with_name(f"{path.name}.lock")
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.generation = None
+        self.inode = None
+        self.position = 0
+        self.offsets = {}
+        self.dead_bytes = 0
+
+    @contextmanager
+    def file_lock(self, exclusive=False):
+        """
+        Advisory lock shared with other processes using the same log. Reads and
+        appends take a shared lock; creating or compacting the log takes an
+        exclusive one.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def refresh(self):
+        """
+        Brings the offset map up to date with the log on disk, reading only the records
+        appended since the last refresh, unless the log has been replaced (compacted).
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.reset()
+            return
+
+        if stat.st_ino != self.inode or stat.st_size < self.position:
+            self.reset()
+        elif stat.st_size == self.position:
+            return
+
+        with open(self.path, "rb") as log_file:
+            if self.position > 0 and self.read_generation(log_file) != self.generation:
+                self.reset()
+            self.inode = stat.st_ino
+            self.scan(log_file)
+
+    @staticmethod
+    def read_generation(log_file):
+        log_file.seek(0)
+        header = json.loads(log_file.readline())
+        return header.get('generation')
+
+    def scan(self, log_file):
+        log_file.seek(self.position)
+        for line in log_file:
+            if not line.endswith(b'\n'):
+                # A partially written record, from a write in progress or a crash;
+                # it will be picked up (or skipped) on a later scan.
+                break
+            length = len(line)
+            if line == b'\n':
+                self.position += length
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A record torn by a crash.
+                self.dead_bytes += length
+                self.position += length
+                continue
+            op = record['op']
+            if op == 'header':
+                self.generation = record['generation']
+            elif op == 'put':
+                previous = self.offsets.get(record['name'])
+                if previous is not None:
+                    self.dead_bytes += previous[1]
+                self.offsets[record['name']] = (self.position, length)
+            elif op == 'delete':
+                previous = self.offsets.pop(record['name'], None)
+                if previous is not None:
+                    self.dead_bytes += previous[1]
+                self.dead_bytes += length
+            self.position += length
+
+    def ensure_log(self):
+        if self.path.exists():
+            return
+        with self.file_lock(exclusive=True):
+            if self.path.exists():
+                return
+            self.write_log([])
+
+    def write_log(self, lines):
+        """
+        Atomically replaces the log with a new generation containing the given lines.
+        """
+        temp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(temp_path, "wb") as log_file:
+            log_file.write(encode_record({'op': 'header', 'generation': str(uuid.uuid4())}))
+            for line in lines:
+                log_file.write(line)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        os.replace(temp_path, self.path)
+
+    def read_value(self, name):
+        location = self.offsets.get(name)
+        if location is None:
+            return None
+        offset, length = location
+        with open(self.path, "rb") as log_file:
+            log_file.seek(offset)
+            return json.loads(log_file.read(length))['value']
+
+    def append(self, record, precondition=None):
+        """
+        Appends a record to the log. A precondition, if provided, is checked against the
+        up-to-date log while holding the log exclusively, so that it can't be invalidated
+        by another process before the record is written.
+        """
+        self.append_many([record], precondition)
+
+    def append_many(self, records, precondition=None):
+        self.ensure_log()
+        with self.file_lock(exclusive=precondition is not None):
+            if precondition is not None:
+                self.refresh()
+                precondition()
+            with open(self.path, "ab") as log_file:
+                log_file.write(b''.join(b'\n' + encode_record(record) for record in records))
+            self.refresh()
+
+    def should_compact(self):
+        return self.dead_bytes >= COMPACTION_MIN_DEAD_BYTES and \
+            self.dead_bytes > self.position * COMPACTION_DEAD_RATIO
+
+    def compact(self):
+        with self.file_lock(exclusive=True):
+            self.refresh()
+            if self.inode is None:
+                return
+            with open(self.path, "rb") as log_file:
+                lines = []
+                for offset, length in self.offsets.values():
+                    log_file.seek(offset)
+                    lines.append(log_file.read(length))
+            self.write_log(lines)
+            self.reset()
+            self.refresh()
+
+
+collection_logs = {}
+collection_logs_lock = threading.RLock()
+
+
+class LogStorage:
+    """
+    Implements the FileStorage api on top of an append-only record log per collection.
+    """
+
+    def __init__(self, directory="work/data"):
+        self.root_path = Path(os.path.join(utils.module_dir(), directory))
+
+    def get_collection_log(self, collection) -> CollectionLog:
+        path = Path(self.root_path, collection, "records.log")
+        with collection_logs_lock:
+            collection_log = collection_logs.get(path)
+            if collection_log is None:
+                collection_log = CollectionLog(path)
+                collection_logs[path] = collection_log
+            return collection_log
+
+    def write(self, collection_log: CollectionLog, record, precondition=None):
+        collection_log.append(record, precondition)
+        if collection_log.should_compact():
+            collection_log.compact()
+
+    # Public data access methods
+
+    def get(self, collection, name):
+        collection_log = self.get_collection_log(collection)
+        with collection_log.lock:
+            with collection_log.file_lock():
+                collection_log.refresh()
+                return collection_log.read_value(name)
+
+    def list(self, collection):
+        collection_log = self.get_collection_log(collection)
+        with collection_log.lock:
+            with collection_log.file_lock():
+                collection_log.refresh()
+                return [collection_log.read_value(name) for name in list(collection_log.offsets.keys())]
+
+    def iterate(self, collection, after_id=None, limit=None, batch_size=ITERATE_BATCH_SIZE):
+        """
+        Generates (id, name, value) for the entities in a collection; as records move
+        within the log when updated or compacted, the entity name serves as the id,
+        and entities are generated in name order.
+        """
+        collection_log = self.get_collection_log(collection)
+        with collection_log.lock:
+            with collection_log.file_lock():
+                collection_log.refresh()
+                names = sorted(name for name in collection_log.offsets.keys()
+                               if after_id is None or name > after_id)
+        if limit is not None:
+            names = names[:limit]
+
+        names = iter(names)
+        while True:
+            batch = list(islice(names, batch_size))
+            if len(batch) == 0:
+                return
+            with collection_log.lock:
+                with collection_log.file_lock():
+                    collection_log.refresh()
+                    values = [collection_log.read_value(name) for name in batch]
+            for name, value in zip(batch, values):
+                if value is not None:
+                    yield name, name, value
+
+    def save(self, collection, name, value):
+        collection_log = self.get_collection_log(collection)
+        with collection_log.lock:
+            self.write(collection_log, {'op': 'put', 'name': name, 'value': value})
+
+    def save_many(self, collection, items):
+        """
+        Saves each of the (name, value) items with a single append.
+        """
+        collection_log = self.get_collection_log(collection)
+        records = [{'op': 'put', 'name': name, 'value': value} for name, value in items]
+        with collection_log.lock:
+            collection_log.append_many(records)
+            if collection_log.should_compact():
+                collection_log.compact()
+
+    def create(self, collection, name, value):
+        collection_log = self.get_collection_log(collection)
+
+        def must_not_exist():
+            if name in collection_log.offsets:
+                raise Exception('Entity already exists')
+
+        with collection_log.lock:
+            self.write(collection_log, {'op': 'put', 'name': name, 'value': value}, must_not_exist)
+
+    def update(self, collection, name, value):
+        collection_log = self.get_collection_log(collection)
+
+        def must_exist():
+            if name not in collection_log.offsets:
+                raise Exception('Entity does not exist')
+
+        with collection_log.lock:
+            self.write(collection_log, {'op': 'put', 'name': name, 'value': value}, must_exist)
+
+    def delete(self, collection, name):
+        collection_log = self.get_collection_log(collection)
+        with collection_log.lock:
+            collection_log.refresh()
+            # Deleting a non-existent entity is not an error; this keeps delete idempotent.
+            if name not in collection_log.offsets:
+                return
+            self.write(collection_log, {'op': 'delete', 'name': name})
+
+    def compact(self, collection):
+        collection_log = self.get_collection_log(collection)
+        with collection_log.lock:
+            collection_log.compact()
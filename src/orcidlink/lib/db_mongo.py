@@ -0,0 +1,169 @@
+import datetime
+import threading
+
+from bson import ObjectId
+from orcidlink.lib.constants import STORAGE_COLLECTION_KEYS
+from pymongo import ASCENDING, MongoClient, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+################################
+# MongoDB Storage
+################################
+
+#
+# A MongoClient maintains its own connection pool and is safe to share across
+# threads, so one client is kept per connection url for the life of the process.
+#
+mongo_clients = {}
+mongo_clients_lock = threading.RLock()
+
+# Databases for which the collection indexes have been ensured by this process.
+indexed_databases = set()
+
+# Collections whose records carry an "expires_at" (epoch milliseconds) which
+# should be enforced by MongoDB itself, via a TTL index.
+EXPIRING_COLLECTIONS = {"linking-sessions"}
+
+
+def get_mongo_client(url: str, max_pool_size: int = 100, timeout: int = 60000) -> MongoClient:
+    with mongo_clients_lock:
+        client = mongo_clients.get(url)
+        if client is None:
+            client = MongoClient(url,
+                                 maxPoolSize=max_pool_size,
+                                 serverSelectionTimeoutMS=timeout,
+                                 connectTimeoutMS=timeout)
+            mongo_clients[url] = client
+        return client
+
+
+def expiration_date(value):
+    expires_at = value.get("expires_at")
+    if expires_at is None:
+        return None
+    return datetime.datetime.fromtimestamp(expires_at / 1000, tz=datetime.timezone.utc)
+
+
+class MongoStorage:
+    """
+    Implements the FileStorage api on top of MongoDB.
+
+    Each storage collection is a Mongo collection of documents of the form
+    {<key field>: name, "record": value}, where the key field is the collection's
+    entry in STORAGE_COLLECTION_KEYS (e.g. "username" for "users").
+    """
+
+    def __init__(self, url: str = None, database: str = None, max_pool_size: int = 100, timeout: int = 60000):
+        if url is None:
+            raise TypeError('the "url" named parameter is required')
+        if database is None:
+            raise TypeError('the "database" named parameter is required')
+
+        # The client connects in the background, so creating the storage does no i/o;
+        # the indexes are ensured by the first operation. See get_collection().
+        self.client = get_mongo_client(url, max_pool_size=max_pool_size, timeout=timeout)
+        self.url = url
+        self.database = database
+        self.db = self.client[database]
+
+    def ensure_indexes(self):
+        with mongo_clients_lock:
+            if (self.url, self.database) in indexed_databases:
+                return
+            for collection, key in STORAGE_COLLECTION_KEYS.items():
+                self.db[collection].create_index([(key, ASCENDING)], unique=True)
+                if collection in EXPIRING_COLLECTIONS:
+                    self.db[collection].create_index([("expire_at", ASCENDING)], expireAfterSeconds=0)
+            indexed_databases.add((self.url, self.database))
+
+    def get_collection(self, collection):
+        """
+        The Mongo collection for the storage collection, once the indexes have been
+        ensured.
+        """
+        self.ensure_indexes()
+        return self.db[collection]
+
+    @staticmethod
+    def collection_key(collection):
+        key = STORAGE_COLLECTION_KEYS.get(collection)
+        if key is None:
+            raise ValueError(f"Unknown storage collection: {collection}")
+        return key
+
+    def make_document(self, collection, name, value):
+        document = {
+            self.collection_key(collection): name,
+            "record": value
+        }
+        if collection in EXPIRING_COLLECTIONS:
+            document["expire_at"] = expiration_date(value)
+        return document
+
+    # Public data access methods
+
+    def get(self, collection, name):
+        document = self.get_collection(collection).find_one(
+            {self.collection_key(collection): name},
+            projection={"_id": False, "record": True}
+        )
+        if document is None:
+            return None
+        return document["record"]
+
+    def list(self, collection):
+        documents = self.get_collection(collection).find({}, projection={"_id": False, "record": True})
+        return [document["record"] for document in documents]
+
+    def iterate(self, collection, after_id=None, limit=None):
+        """
+        Generates (id, name, value) for the entities in a collection, in _id order; the
+        id is the string form of the document's ObjectId. Documents are streamed in
+        batches by the MongoDB cursor.
+        """
+        key = self.collection_key(collection)
+        query = {} if after_id is None else {"_id": {"$gt": ObjectId(after_id)}}
+        cursor = self.get_collection(collection).find(query, projection={key: True, "record": True}).sort("_id", ASCENDING)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        for document in cursor:
+            yield str(document["_id"]), document[key], document["record"]
+
+    def save(self, collection, name, value):
+        key = self.collection_key(collection)
+        self.get_collection(collection).replace_one(
+            {key: name},
+            self.make_document(collection, name, value),
+            upsert=True
+        )
+
+    def save_many(self, collection, items):
+        """
+        Saves each of the (name, value) items in a single bulk write.
+        """
+        key = self.collection_key(collection)
+        requests = [
+            ReplaceOne({key: name}, self.make_document(collection, name, value), upsert=True)
+            for name, value in items
+        ]
+        if len(requests) > 0:
+            self.get_collection(collection).bulk_write(requests, ordered=False)
+
+    def create(self, collection, name, value):
+        try:
+            self.get_collection(collection).insert_one(self.make_document(collection, name, value))
+        except DuplicateKeyError:
+            raise Exception('Entity already exists')
+
+    def update(self, collection, name, value):
+        key = self.collection_key(collection)
+        result = self.get_collection(collection).replace_one(
+            {key: name},
+            self.make_document(collection, name, value)
+        )
+        if result.matched_count == 0:
+            raise Exception('Entity does not exist')
+
+    def delete(self, collection, name):
+        # Deleting a non-existent entity is not an error; this keeps delete idempotent.
+        self.get_collection(collection).delete_one({self.collection_key(collection): name})
@@ -0,0 +1,246 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from orcidlink.lib import utils
+
+################################
+# SQLite Storage
+################################
+
+#
+# Each storage collection is a table keyed by the collection's natural key. Fields
+# of the record used for lookup or expiry are also stored in their own indexed
+# columns; the record itself is stored as JSON.
+#
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        expires_at INTEGER,
+        record TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS users_expires_at ON users (expires_at)",
+    """
+    CREATE TABLE IF NOT EXISTS linking_sessions (
+        session_id TEXT PRIMARY KEY,
+        username TEXT,
+        expires_at INTEGER,
+        record TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS linking_sessions_username ON linking_sessions (username)",
+    "CREATE INDEX IF NOT EXISTS linking_sessions_expires_at ON linking_sessions (expires_at)"
+]
+
+
+class CollectionStatements:
+    """
+    The SQL for operations on one collection's table.
+
+    The statement text is fixed per collection, so each connection's statement cache
+    reuses the prepared statements.
+    """
+
+    def __init__(self, table: str, key: str, columns: list):
+        self.columns = columns
+        all_columns = [key] + columns + ['record']
+        placeholders = ', '.join(['?'] * len(all_columns))
+        assignments = ', '.join([f"{column} = ?" for column in columns + ['record']])
+        upserts = ', '.join([f"{column} = excluded.{column}" for column in columns + ['record']])
+
+        self.get = f"SELECT record FROM {table} WHERE {key} = ?"
+        self.list = f"SELECT record FROM {table} ORDER BY rowid"
+        self.iterate = f"SELECT rowid, {key}, record FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?"
+        self.create = f"INSERT INTO {table} ({', '.join(all_columns)}) VALUES ({placeholders})"
+        self.save = f"{self.create} ON CONFLICT ({key}) DO UPDATE SET {upserts}"
+        self.update = f"UPDATE {table} SET {assignments} WHERE {key} = ?"
+        self.delete = f"DELETE FROM {table} WHERE {key} = ?"
+
+    def column_values(self, value):
+        return [value.get(column) for column in self.columns]
+
+
+COLLECTION_STATEMENTS = {
+    "users": CollectionStatements("users", "username", ["expires_at"]),
+    "linking-sessions": CollectionStatements("linking_sessions", "session_id", ["username", "expires_at"])
+}
+
+
+# Rows are fetched this many at a time when iterating over a collection.
+ITERATE_BATCH_SIZE = 100
+
+
+class ConnectionPool:
+    """
+    A small pool of connections to one database file.
+
+    Connections are created on demand, up to the pool size; once all are in use,
+    callers wait for one to be returned.
+    """
+
+    def __init__(self, path: str, size: int, timeout: float):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.connections = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.schema_ready = False
+
+    def connect(self) -> sqlite3.Connection:
+        # Autocommit; each statement is its own transaction unless one is begun explicitly.
+        connection = sqlite3.connect(self.path,
+                                     timeout=self.timeout,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        with self.lock:
+            if not self.schema_ready:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+                self.schema_ready = True
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            can_create = self.created < self.size
+            if can_create:
+                self.created += 1
+        if can_create:
+            try:
+                return self.connect()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        return self.connections.get(timeout=self.timeout)
+
+    def release(self, connection: sqlite3.Connection):
+        self.connections.put(connection)
+
+
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(path: str, size: int, timeout: float) -> ConnectionPool:
+    with connection_pools_lock:
+        pool = connection_pools.get(path)
+        if pool is None:
+            pool = ConnectionPool(path, size, timeout)
+            connection_pools[path] = pool
+        return pool
+
+
+class SQLiteStorage:
+    """
+    Implements the FileStorage api on top of an SQLite database in WAL mode, which
+    allows multiple worker processes on one host to share it concurrently.
+    """
+
+    def __init__(self, path="work/data/orcidlink.sqlite3", pool_size: int = 4, timeout: float = 60):
+        path = os.path.join(utils.module_dir(), path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.pool = get_connection_pool(path, pool_size, timeout)
+
+    @contextmanager
+    def connection(self):
+        connection = self.pool.acquire()
+        try:
+            yield connection
+        finally:
+            self.pool.release(connection)
+
+    @staticmethod
+    def statements(collection) -> CollectionStatements:
+        statements = COLLECTION_STATEMENTS.get(collection)
+        if statements is None:
+            raise ValueError(f"Unknown storage collection: {collection}")
+        return statements
+
+    # Public data access methods
+
+    def get(self, collection, name):
+        with self.connection() as connection:
+            row = connection.execute(self.statements(collection).get, (name,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def list(self, collection):
+        with self.connection() as connection:
+            rows = connection.execute(self.statements(collection).list).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def iterate(self, collection, after_id=None, limit=None, batch_size=ITERATE_BATCH_SIZE):
+        """
+        Generates (rowid, name, value) for the entities in a collection, in rowid order,
+        fetching a page of rows per query.
+        """
+        statements = self.statements(collection)
+        last_id = after_id if after_id is not None else 0
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = batch_size if remaining is None else min(batch_size, remaining)
+            with self.connection() as connection:
+                rows = connection.execute(statements.iterate, (last_id, page_size)).fetchall()
+            for rowid, name, record in rows:
+                yield rowid, name, json.loads(record)
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def save(self, collection, name, value):
+        statements = self.statements(collection)
+        with self.connection() as connection:
+            connection.execute(statements.save,
+                               [name] + statements.column_values(value) + [json.dumps(value)])
+
+    def save_many(self, collection, items):
+        """
+        Saves each of the (name, value) items in a single transaction.
+        """
+        statements = self.statements(collection)
+        rows = [[name] + statements.column_values(value) + [json.dumps(value)] for name, value in items]
+        with self.connection() as connection:
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(statements.save, rows)
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def create(self, collection, name, value):
+        statements = self.statements(collection)
+        with self.connection() as connection:
+            try:
+                connection.execute(statements.create,
+                                   [name] + statements.column_values(value) + [json.dumps(value)])
+            except sqlite3.IntegrityError:
+                raise Exception('Entity already exists')
+
+    def update(self, collection, name, value):
+        statements = self.statements(collection)
+        with self.connection() as connection:
+            cursor = connection.execute(statements.update,
+                                        statements.column_values(value) + [json.dumps(value), name])
+        if cursor.rowcount == 0:
+            raise Exception('Entity does not exist')
+
+    def delete(self, collection, name):
+        # Deleting a non-existent entity is not an error; this keeps delete idempotent.
+        with self.connection() as connection:
+            connection.execute(self.statements(collection).delete, (name,))
@@ -0,0 +1,62 @@
+import heapq
+import threading
+from typing import Hashable, List
+
+
+class ExpiryQueue:
+    """
+    Tracks the expiration time of a set of keys, ordered by expiration.
+
+    Expired keys are found by popping from the front of a heap rather than scanning
+    every key. Removing or re-adding a key leaves its old heap entry in place; such
+    stale entries are skipped when popped, and dropped when they come to outnumber
+    the live ones.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.expirations = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.expirations)
+
+    def add(self, key: Hashable, expires_at: int):
+        with self.lock:
+            if self.expirations.get(key) == expires_at:
+                return
+            self.expirations[key] = expires_at
+            heapq.heappush(self.heap, (expires_at, key))
+            self.prune()
+
+    def remove(self, key: Hashable):
+        with self.lock:
+            self.expirations.pop(key, None)
+
+    def is_expired(self, key: Hashable, now: int) -> bool:
+        expires_at = self.expirations.get(key)
+        return expires_at is not None and expires_at <= now
+
+    def pop_expired(self, now: int, limit: int) -> List[Hashable]:
+        """
+        Removes and returns up to "limit" keys which have expired as of "now",
+        earliest first.
+        """
+        expired = []
+        with self.lock:
+            while self.heap and len(expired) < limit and self.heap[0][0] <= now:
+                expires_at, key = heapq.heappop(self.heap)
+                if self.expirations.get(key) == expires_at:
+                    del self.expirations[key]
+                    expired.append(key)
+        return expired
+
+    def prune(self):
+        if len(self.heap) > 2 * len(self.expirations) + 100:
+            self.heap = [(expires_at, key) for key, expires_at in self.expirations.items()]
+            heapq.heapify(self.heap)
+
+    def clear(self):
+        with self.lock:
+            self.heap = []
+            self.expirations = {}
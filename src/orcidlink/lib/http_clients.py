@@ -0,0 +1,41 @@
+import asyncio
+import threading
+
+import httpx
+
+#
+# Shared, pooled, HTTP clients for calls to other services, one per name, so that
+# connections (and their TLS sessions) are kept alive and reused across requests
+# rather than opened for each call.
+#
+# An httpx.AsyncClient's connections belong to the event loop on which they were
+# opened, so a client is only shared by callers on the same loop; a caller on
+# another loop (e.g. of a test client) gets a new one. The clients are closed at
+# shutdown by close_http_clients().
+#
+http_clients = {}
+http_clients_lock = threading.Lock()
+
+
+def get_http_client(name: str, **client_options) -> httpx.AsyncClient:
+    """
+    The shared client of the given name, which is created, with the given httpx
+    client options, on first use.
+    """
+    loop = asyncio.get_running_loop()
+    with http_clients_lock:
+        entry = http_clients.get(name)
+        if entry is None or entry[0] is not loop or entry[1].is_closed:
+            entry = (loop, httpx.AsyncClient(**client_options))
+            http_clients[name] = entry
+        return entry[1]
+
+
+async def close_http_clients():
+    loop = asyncio.get_running_loop()
+    with http_clients_lock:
+        entries = list(http_clients.values())
+        http_clients.clear()
+    for client_loop, client in entries:
+        if client_loop is loop:
+            await client.aclose()
@@ -0,0 +1,36 @@
+from orcidlink.lib.ttl_cache import TTLCache
+from orcidlink.model_types import LinkRecord
+
+
+class LinkRecordCache(TTLCache):
+    """
+    A TTLCache of parsed link records, keyed by username.
+
+    As each worker process has its own cache, a link record changed by another worker
+    may be served stale for up to the cache lifetime; writes through this process
+    invalidate the entry at once.
+
+    To avoid caching a record read before, and stored after, a concurrent write of
+    it, an entry is only stored if no invalidation has occurred since the read began;
+    see "generation".
+    """
+
+    def __init__(self, max_size: int, lifetime: float):
+        super().__init__(max_size, lifetime)
+        self.generation = 0
+
+    def set(self, username: str, record: LinkRecord, generation: int):
+        with self.lock:
+            if generation != self.generation:
+                return
+            super().set(username, record)
+
+    def invalidate(self, username: str):
+        with self.lock:
+            self.generation += 1
+            self.delete(username)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            super().clear()
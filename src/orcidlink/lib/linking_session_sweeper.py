@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from contextlib import suppress
+
+from orcidlink.lib.config import get_config_default
+from orcidlink.lib.storage_model import StorageModel
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+sweeper_task = None
+
+
+async def sweep_linking_sessions(interval: float, batch_size: int):
+    """
+    Periodically deletes expired linking sessions, in batches of at most "batch_size",
+    so that abandoned sessions do not accumulate in storage.
+    """
+    model = None
+    expiry_loaded = False
+    while True:
+        try:
+            # Retried on each pass until they succeed, as the storage may not be
+            # available when the service starts. Setting up the storage may involve
+            # i/o (e.g. creating database indexes), so is done in the threadpool.
+            if model is None:
+                model = await run_in_threadpool(StorageModel)
+            if not expiry_loaded:
+                await run_in_threadpool(model.load_linking_session_expiry)
+                expiry_loaded = True
+            # Keep deleting while there are full batches, yielding to the event loop
+            # between batches.
+            while await run_in_threadpool(model.delete_expired_linking_sessions, batch_size) == batch_size:
+                pass
+        except Exception:
+            logger.exception("Error deleting expired linking sessions")
+        await asyncio.sleep(interval)
+
+
+def start_linking_session_sweeper():
+    global sweeper_task
+    if sweeper_task is not None:
+        return
+    sweeper_task = asyncio.create_task(sweep_linking_sessions(
+        interval=get_config_default(["linkingSessions", "sweepInterval"], 60),
+        batch_size=get_config_default(["linkingSessions", "sweepBatchSize"], 100)
+    ))
+
+
+async def stop_linking_session_sweeper():
+    global sweeper_task
+    if sweeper_task is None:
+        return
+    sweeper_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await sweeper_task
+    sweeper_task = None
@@ -1,8 +1,35 @@
-from fastapi import Header
-from orcidlink.lib.responses import ErrorResponse
+from fastapi import Depends, Header, Request
+from orcidlink.lib.responses import ErrorResponse, ensure_authorization
+from orcidlink.lib.storage_model import request_storage_model
+from orcidlink.service_clients.auth import get_request_token_info
+from orcidlink.service_clients.authclient2 import TokenInfo
 
 AUTHORIZATION_HEADER = Header(default=None, description="KBase auth token")
 
+# The storage model for the request; see RequestStorageModel.
+REQUEST_STORAGE = Depends(request_storage_model)
+
+
+async def request_token_info(request: Request, authorization: str | None = AUTHORIZATION_HEADER) -> TokenInfo:
+    """
+    FastAPI dependency providing the token info for the KBase auth token in the
+    "Authorization" header, which is required.
+    """
+    return await get_request_token_info(request, ensure_authorization(authorization))
+
+
+async def request_username(token_info: TokenInfo = Depends(request_token_info)) -> str:
+    """
+    FastAPI dependency providing the username for the request's KBase auth token.
+    """
+    return token_info.user
+
+
+# The token info and username for the request's KBase auth token; the token is
+# validated once per request however many dependencies or calls make use of it.
+REQUEST_TOKEN_INFO = Depends(request_token_info)
+REQUEST_USERNAME = Depends(request_username)
+
 AUTH_RESPONSES = {
     401: {"description": "KBase auth token absent"},
     403: {"description": "KBase auth token invalid"},
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+from orcidlink.lib import utils
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL,
+        value TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)"
+]
+
+# Expired entries are deleted, and the cache trimmed to its max size, after this many sets.
+PURGE_INTERVAL = 100
+
+
+class SharedCache:
+    """
+    A cache of JSON-able values in an SQLite database in WAL mode, shared by the worker
+    processes on one host, so that a value fetched by one worker is available to the
+    others.
+
+    Keys are stored as their SHA-256 hash, so that secrets such as tokens used as keys
+    are not written to disk. Entries expire at an absolute (wall clock) time, as they
+    are shared between processes.
+
+    The cache is an optimization; errors accessing the database are logged, and treated
+    as a miss.
+    """
+
+    def __init__(self, path: str, max_size: int, timeout: float = 1):
+        self.path = os.path.join(utils.module_dir(), path)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sets = 0
+        self.hits = 0
+        self.misses = 0
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads, so each thread has its own.
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def hash_key(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """
+        The value for the key, and its remaining lifetime in seconds; None if absent or
+        expired.
+        """
+        try:
+            row = self.connection().execute(
+                "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?",
+                (self.hash_key(key), time.time())
+            ).fetchone()
+        except (sqlite3.Error, OSError):
+            logger.exception("Error reading from the shared cache")
+            row = None
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        value, expires_at = row
+        return json.loads(value), expires_at - time.time()
+
+    def set(self, key: str, value: Any, lifetime: float):
+        with self.lock:
+            self.sets += 1
+            purge = self.sets % PURGE_INTERVAL == 0
+        try:
+            connection = self.connection()
+            connection.execute(
+                "INSERT INTO cache (key, expires_at, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at, value = excluded.value",
+                (self.hash_key(key), time.time() + lifetime, json.dumps(value))
+            )
+            if purge:
+                self.purge(connection)
+        except (sqlite3.Error, OSError):
+            logger.exception("Error writing to the shared cache")
+
+    def purge(self, connection: sqlite3.Connection):
+        connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        # Of the remainder, those expiring soonest are dropped to keep within the max size.
+        connection.execute(
+            "DELETE FROM cache WHERE key IN "
+            "(SELECT key FROM cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        )
+
+    def stats(self) -> dict:
+        try:
+            size = self.connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except (sqlite3.Error, OSError):
+            logger.exception("Error reading from the shared cache")
+            size = 0
+        with self.lock:
+            return {
+                "size": size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
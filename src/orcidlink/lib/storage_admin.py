@@ -0,0 +1,214 @@
+"""
+Storage maintenance commands, for use by operators; e.g.
+
+    python -m orcidlink.lib.storage_admin migrate-layout --layout sharded
+    python -m orcidlink.lib.storage_admin convert-codec --codec compact-json
+    python -m orcidlink.lib.storage_admin check-index --rebuild
+    python -m orcidlink.lib.storage_admin export-links --output links.ndjson
+    python -m orcidlink.lib.storage_admin import-links --input links.ndjson
+
+Run from the "src" directory. The export and import commands use the storage
+backend configured for the service, so need its configuration in place. See
+docs/deployment.md.
+"""
+import argparse
+import json
+import sys
+from typing import TextIO
+
+from orcidlink.lib.constants import STORAGE_COLLECTION_KEYS
+from orcidlink.lib.db import CODECS, FileStorage, LAYOUTS, UnrecoverableIndexError
+from orcidlink.lib.storage_model import StorageModel
+from orcidlink.model_types import LinkRecord
+
+IMPORT_BATCH_SIZE = 500
+
+
+def migrate_layout(args):
+    storage = FileStorage(directory=args.directory, layout=args.layout)
+    for collection in args.collections or STORAGE_COLLECTION_KEYS.keys():
+        moved = storage.migrate_layout(collection)
+        print(f"{collection}: moved {moved} entity files to the {args.layout} layout")
+    return 0
+
+
+def convert_codec(args):
+    collections = args.collections or list(STORAGE_COLLECTION_KEYS.keys())
+    storage = FileStorage(directory=args.directory, codecs={collection: args.codec for collection in collections})
+    for collection in collections:
+        converted = storage.convert_codec(collection)
+        print(f"{collection}: rewrote {converted} entity files with the {args.codec} codec")
+    return 0
+
+
+def check_index(args):
+    """
+    Reports the problems found in each collection's index; returns 1 if there are any
+    which have not been fixed by rebuilding it.
+    """
+    storage = FileStorage(directory=args.directory)
+    status = 0
+    for collection in args.collections or STORAGE_COLLECTION_KEYS.keys():
+        try:
+            report = storage.check_collection(collection, rebuild=args.rebuild)
+        except UnrecoverableIndexError as ex:
+            print(f"{collection}: {ex}; not rebuilt")
+            status = 1
+            continue
+        print(f"{collection}: {report['entities']} index entries, {report['files']} entity files, "
+              f"{len(report['dangling'])} dangling entries, {len(report['orphans'])} orphaned files, "
+              f"{len(report['recovered'])} recoverable")
+        if report['corrupt']:
+            print("  the index could not be read")
+        for name, entity_id in report['dangling'].items():
+            print(f"  dangling: {name} (id {entity_id})")
+        recovered_ids = set(report['recovered'].values())
+        for entity_id in report['orphans']:
+            if entity_id not in recovered_ids:
+                print(f"  orphaned: id {entity_id}")
+        for name, entity_id in report['recovered'].items():
+            print(f"  recoverable: {name} (id {entity_id})")
+
+        problems = report['corrupt'] or len(report['dangling']) > 0 or len(report['orphans']) > 0
+        if args.rebuild:
+            if problems:
+                print("  rebuilt the index")
+            # Orphans which could not be recovered remain.
+            if len(report['orphans']) > len(report['recovered']):
+                status = 1
+        elif problems:
+            status = 1
+    return status
+
+
+#
+# Link records are exported as NDJSON; one JSON object per line, of the form
+# {"username": <username>, "record": <link record>}.
+#
+
+def export_user_records(model: StorageModel, output: TextIO) -> int:
+    """
+    Writes every link record to "output", one at a time; returns the number written.
+    """
+    count = 0
+    for _, username, record in model.iterate_user_records():
+        output.write(json.dumps({"username": username, "record": record.dict()}, separators=(',', ':')))
+        output.write("\n")
+        count += 1
+    return count
+
+
+def import_user_records(model: StorageModel, input_file: TextIO, batch_size: int = IMPORT_BATCH_SIZE) -> int:
+    """
+    Saves the link records read from "input_file", replacing any existing records for
+    the same users, "batch_size" at a time; returns the number saved.
+
+    Each record is validated before it is saved; an invalid line raises ValueError,
+    after the batches before it have been saved.
+    """
+    count = 0
+    batch = []
+    for line_number, line in enumerate(input_file, start=1):
+        if line.strip() == "":
+            continue
+        try:
+            item = json.loads(line)
+            username = item["username"]
+            record = LinkRecord.parse_obj(item["record"]).dict()
+        except Exception as ex:
+            raise ValueError(f"Invalid link record on line {line_number}: {ex}")
+        batch.append((username, record))
+        if len(batch) >= batch_size:
+            model.save_user_records(batch)
+            count += len(batch)
+            batch = []
+    if len(batch) > 0:
+        model.save_user_records(batch)
+        count += len(batch)
+    return count
+
+
+def export_links(args):
+    model = StorageModel()
+    if args.output is None:
+        count = export_user_records(model, sys.stdout)
+    else:
+        with open(args.output, "w") as output:
+            count = export_user_records(model, output)
+    print(f"exported {count} link records", file=sys.stderr)
+    return 0
+
+
+def import_links(args):
+    model = StorageModel()
+    try:
+        if args.input is None:
+            count = import_user_records(model, sys.stdin, args.batch_size)
+        else:
+            with open(args.input, "r") as input_file:
+                count = import_user_records(model, input_file, args.batch_size)
+    except ValueError as ex:
+        print(str(ex), file=sys.stderr)
+        return 1
+    print(f"imported {count} link records", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="storage_admin", description="ORCIDLink storage maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_layout_parser = subparsers.add_parser(
+        "migrate-layout",
+        help="move the entity files of a file storage data directory to another layout, in place")
+    migrate_layout_parser.add_argument("--layout", required=True, choices=list(LAYOUTS.keys()))
+    migrate_layout_parser.add_argument("--directory", default="work/data",
+                                       help="the data directory, relative to the module directory")
+    migrate_layout_parser.add_argument("collections", nargs="*",
+                                       help="the collections to migrate; all if omitted")
+    migrate_layout_parser.set_defaults(handler=migrate_layout)
+
+    convert_codec_parser = subparsers.add_parser(
+        "convert-codec",
+        help="rewrite the entity files of a file storage data directory with another codec; "
+             "only while the service is stopped")
+    convert_codec_parser.add_argument("--codec", required=True, choices=list(CODECS.keys()))
+    convert_codec_parser.add_argument("--directory", default="work/data",
+                                      help="the data directory, relative to the module directory")
+    convert_codec_parser.add_argument("collections", nargs="*",
+                                      help="the collections to convert; all if omitted")
+    convert_codec_parser.set_defaults(handler=convert_codec)
+
+    check_index_parser = subparsers.add_parser(
+        "check-index",
+        help="check the indexes of a file storage data directory against the entity files, and optionally rebuild them")
+    check_index_parser.add_argument("--rebuild", action="store_true",
+                                    help="rewrite each index without dangling entries, restoring recoverable ones")
+    check_index_parser.add_argument("--directory", default="work/data",
+                                    help="the data directory, relative to the module directory")
+    check_index_parser.add_argument("collections", nargs="*",
+                                    help="the collections to check; all if omitted")
+    check_index_parser.set_defaults(handler=check_index)
+
+    export_links_parser = subparsers.add_parser(
+        "export-links",
+        help="export all link records as NDJSON")
+    export_links_parser.add_argument("--output", default=None,
+                                     help="the file to write; stdout if omitted")
+    export_links_parser.set_defaults(handler=export_links)
+
+    import_links_parser = subparsers.add_parser(
+        "import-links",
+        help="import link records exported by export-links, replacing existing records for the same users")
+    import_links_parser.add_argument("--input", default=None,
+                                     help="the file to read; stdin if omitted")
+    import_links_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                                     help="the number of records to save at a time")
+    import_links_parser.set_defaults(handler=import_links)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,144 @@
-from typing import Optional
+from itertools import islice
+from typing import AsyncIterator, Iterator, Optional, Tuple
 
+from orcidlink.lib.config import get_config, get_config_default
 from orcidlink.lib.db import FileStorage
+from orcidlink.lib.db_log import LogStorage
+from orcidlink.lib.db_mongo import MongoStorage
+from orcidlink.lib.db_sqlite import SQLiteStorage
+from orcidlink.lib.expiry_queue import ExpiryQueue
+from orcidlink.lib.link_record_cache import LinkRecordCache
+from orcidlink.lib.utils import current_time_millis
 from orcidlink.model_types import LinkRecord
+from starlette.concurrency import run_in_threadpool
+
+
+def make_storage():
+    """
+    Creates the storage backend selected by the "storage.backend" config key.
+
+    The file backend is used if the storage config is absent.
+    """
+    backend = get_config_default(["storage", "backend"], "file")
+    if backend == "file":
+        return FileStorage(codecs=get_config_default(["storage", "file", "codecs"], {}),
+                           layout=get_config_default(["storage", "file", "layout"], "flat"),
+                           durable=get_config_default(["storage", "file", "fsync"], True),
+                           group_commit_window=get_config_default(["storage", "file", "groupCommitWindow"], 0) / 1000)
+    elif backend == "log":
+        return LogStorage()
+    elif backend == "sqlite":
+        return SQLiteStorage(
+            path=get_config_default(["storage", "sqlite", "path"], "work/data/orcidlink.sqlite3"),
+            pool_size=get_config_default(["storage", "sqlite", "poolSize"], 4),
+            timeout=get_config(["kbase", "defaults", "serviceRequestTimeout"]) / 1000
+        )
+    elif backend == "mongo":
+        return MongoStorage(
+            url=get_config(["storage", "mongo", "url"]),
+            database=get_config(["storage", "mongo", "database"]),
+            max_pool_size=get_config_default(["storage", "mongo", "maxPoolSize"], 100),
+            timeout=get_config(["kbase", "defaults", "serviceRequestTimeout"])
+        )
+    else:
+        raise ValueError(f"Unsupported storage backend: {backend}")
+
+
+linking_session_expiry = ExpiryQueue()
+
+link_record_cache = None
+
+
+def get_link_record_cache() -> Optional[LinkRecordCache]:
+    """
+    Returns the process-wide cache of link records, or None if it is disabled, as it
+    is unless "storage.linkRecordCache.maxSize" is configured.
+    """
+    global link_record_cache
+    if link_record_cache is None:
+        max_size = get_config_default(["storage", "linkRecordCache", "maxSize"], 0)
+        if max_size == 0:
+            return None
+        link_record_cache = LinkRecordCache(
+            max_size=max_size,
+            lifetime=get_config_default(["storage", "linkRecordCache", "lifetime"], 30)
+        )
+    return link_record_cache
+
+
+def get_link_record_cache_stats() -> Optional[dict]:
+    """
+    The link record cache hit/miss counters, for monitoring; None if the cache has not
+    been used by this process.
+    """
+    if link_record_cache is None:
+        return None
+    return link_record_cache.stats()
 
 
 class StorageModel:
 
-    def __init__(self):
-        self.db = FileStorage()
+    def __init__(self, db=None):
+        self.db = db if db is not None else make_storage()
+        self.link_record_cache = get_link_record_cache()
 
     ##
     # Operations on the user record.
     # The user record is the primary linking document, providing a linkage between
     # a username and an ORCID Id.
     #
+    # Parsed user records are kept in the link record cache, if enabled, and
+    # invalidated when written through this model.
+    #
     def get_user_record(self, username: str) -> Optional[LinkRecord]:
+        cache = self.link_record_cache
+        if cache is not None:
+            link_record = cache.get(username)
+            if link_record is not None:
+                return link_record
+            generation = cache.generation
+
         record = self.db.get('users', username)
         if record is None:
             return None
-        return LinkRecord.parse_obj(record)
+        link_record = LinkRecord.parse_obj(record)
+
+        if cache is not None:
+            cache.set(username, link_record, generation)
+        return link_record
+
+    def invalidate_user_record(self, username):
+        if self.link_record_cache is not None:
+            self.link_record_cache.invalidate(username)
 
     def save_user_record(self, username, record):
         self.db.save('users', username, record)
+        self.invalidate_user_record(username)
 
     def create_user_record(self, username, record):
         self.db.create('users', username, record)
+        self.invalidate_user_record(username)
+
+    def save_user_records(self, items):
+        """
+        Saves each of the (username, record) items as a single batch.
+        """
+        self.db.save_many('users', items)
+        for username, _ in items:
+            self.invalidate_user_record(username)
 
     def remove_user_record(self, username):
         self.db.delete('users', username)
+        self.invalidate_user_record(username)
+
+    def iterate_user_records(self, after_id=None, limit: int = None) -> Iterator[Tuple[object, str, LinkRecord]]:
+        """
+        Generates (id, username, record) for the stored user records, without loading
+        them all at once. The id is opaque, but may be given as "after_id" to resume
+        iteration after that record.
+        """
+        for entity_id, username, record in self.db.iterate('users', after_id=after_id, limit=limit):
+            yield entity_id, username, LinkRecord.parse_obj(record)
 
     ################################
     # OAuth state persistence
@@ -35,15 +146,217 @@ class StorageModel:
 
     # Linking session
     # TODO: operate with the linking session record model, not raw dict.
+    #
+    # The expiration of each linking session seen by this process is tracked in
+    # linking_session_expiry, so that a session known to have expired is rejected
+    # without a storage lookup, and expired sessions can be removed in expiration
+    # order by the sweeper.
 
     def create_linking_session(self, session_id, linking_record):
-        return self.db.create('linking-sessions', session_id, linking_record)
+        result = self.db.create('linking-sessions', session_id, linking_record)
+        linking_session_expiry.add(session_id, linking_record['expires_at'])
+        return result
 
     def delete_linking_session(self, session_id):
+        linking_session_expiry.remove(session_id)
         return self.db.delete('linking-sessions', session_id)
 
     def get_linking_session(self, session_id):
-        return self.db.get('linking-sessions', session_id)
+        now = current_time_millis()
+        if linking_session_expiry.is_expired(session_id, now):
+            return None
+
+        session_record = self.db.get('linking-sessions', session_id)
+        if session_record is None:
+            return None
+
+        # The session may have been created by another worker process.
+        linking_session_expiry.add(session_id, session_record['expires_at'])
+        if session_record['expires_at'] <= now:
+            return None
+
+        return session_record
 
     def update_linking_session(self, session_id, session_record):
         return self.db.update('linking-sessions', session_id, session_record)
+
+    def load_linking_session_expiry(self):
+        """
+        Tracks the expiration of all stored linking sessions, including those left
+        behind by a previous run of the service.
+        """
+        for _, session_id, session_record in self.db.iterate('linking-sessions'):
+            linking_session_expiry.add(session_id, session_record['expires_at'])
+
+    def delete_expired_linking_sessions(self, limit: int) -> int:
+        """
+        Deletes up to "limit" expired linking sessions, earliest expiring first; returns
+        the number deleted.
+        """
+        expired_session_ids = linking_session_expiry.pop_expired(current_time_millis(), limit)
+        for session_id in expired_session_ids:
+            self.db.delete('linking-sessions', session_id)
+        return len(expired_session_ids)
+
+
+class AsyncStorageModel:
+    """
+    The awaitable counterpart of StorageModel, for use in async route handlers.
+
+    Storage backends perform blocking i/o, so each operation is run in the
+    threadpool rather than on the event loop.
+    """
+
+    def __init__(self, model: StorageModel = None):
+        self.model = model if model is not None else StorageModel()
+
+    @property
+    def sync_model(self) -> StorageModel:
+        """
+        The StorageModel whose operations this runs in the threadpool; for callers
+        which run several of them together there, such as RequestStorageModel.
+        """
+        return self.model
+
+    ##
+    # Operations on the user record.
+    #
+    async def get_user_record(self, username: str) -> Optional[LinkRecord]:
+        return await run_in_threadpool(self.model.get_user_record, username)
+
+    async def save_user_record(self, username, record):
+        return await run_in_threadpool(self.model.save_user_record, username, record)
+
+    async def create_user_record(self, username, record):
+        return await run_in_threadpool(self.model.create_user_record, username, record)
+
+    async def remove_user_record(self, username):
+        return await run_in_threadpool(self.model.remove_user_record, username)
+
+    async def iterate_user_records(self, after_id=None, limit: int = None,
+                                   batch_size: int = 100) -> AsyncIterator[Tuple[object, str, LinkRecord]]:
+        """
+        Async iteration over StorageModel.iterate_user_records; each batch of records
+        is pulled from storage in the threadpool.
+        """
+        records = self.model.iterate_user_records(after_id=after_id, limit=limit)
+        while True:
+            batch = await run_in_threadpool(lambda: list(islice(records, batch_size)))
+            if len(batch) == 0:
+                return
+            for item in batch:
+                yield item
+
+    ################################
+    # OAuth state persistence
+    ################################
+
+    async def create_linking_session(self, session_id, linking_record):
+        return await run_in_threadpool(self.model.create_linking_session, session_id, linking_record)
+
+    async def delete_linking_session(self, session_id):
+        return await run_in_threadpool(self.model.delete_linking_session, session_id)
+
+    async def get_linking_session(self, session_id):
+        return await run_in_threadpool(self.model.get_linking_session, session_id)
+
+    async def update_linking_session(self, session_id, session_record):
+        return await run_in_threadpool(self.model.update_linking_session, session_id, session_record)
+
+
+class RequestStorageModel:
+    """
+    A unit of work over AsyncStorageModel for the life of a single request.
+
+    Records read through it are remembered, so that repeated lookups of the same user
+    or linking session within the request are served without going back to storage;
+    writes are applied to the remembered records immediately, but only queued for
+    storage, and are performed together, in order, by commit().
+
+    The storage model is not created until first used, so that requests which fail
+    before reaching storage (e.g. failing validation) don't set up storage at all.
+    """
+
+    def __init__(self, model: AsyncStorageModel = None):
+        self._model = model
+        self.user_records = {}
+        self.linking_sessions = {}
+        self.pending_writes = []
+
+    @property
+    def model(self) -> AsyncStorageModel:
+        if self._model is None:
+            self._model = AsyncStorageModel()
+        return self._model
+
+    def queue_write(self, method, *args):
+        self.pending_writes.append((method, args))
+
+    async def commit(self):
+        """
+        Performs the queued writes, in the order they were made, in a single trip to
+        the threadpool.
+        """
+        if len(self.pending_writes) == 0:
+            return
+        pending_writes = self.pending_writes
+        self.pending_writes = []
+
+        def write_all():
+            for method, args in pending_writes:
+                method(*args)
+
+        await run_in_threadpool(write_all)
+
+    ##
+    # Operations on the user record.
+    #
+    async def get_user_record(self, username: str) -> Optional[LinkRecord]:
+        if username not in self.user_records:
+            self.user_records[username] = await self.model.get_user_record(username)
+        return self.user_records[username]
+
+    async def save_user_record(self, username, record):
+        self.user_records[username] = LinkRecord.parse_obj(record)
+        self.queue_write(self.model.sync_model.save_user_record, username, record)
+
+    async def create_user_record(self, username, record):
+        self.user_records[username] = LinkRecord.parse_obj(record)
+        self.queue_write(self.model.sync_model.create_user_record, username, record)
+
+    async def remove_user_record(self, username):
+        self.user_records[username] = None
+        self.queue_write(self.model.sync_model.remove_user_record, username)
+
+    ################################
+    # OAuth state persistence
+    ################################
+
+    async def create_linking_session(self, session_id, linking_record):
+        self.linking_sessions[session_id] = linking_record
+        self.queue_write(self.model.sync_model.create_linking_session, session_id, linking_record)
+
+    async def delete_linking_session(self, session_id):
+        self.linking_sessions[session_id] = None
+        self.queue_write(self.model.sync_model.delete_linking_session, session_id)
+
+    async def get_linking_session(self, session_id):
+        if session_id not in self.linking_sessions:
+            self.linking_sessions[session_id] = await self.model.get_linking_session(session_id)
+        return self.linking_sessions[session_id]
+
+    async def update_linking_session(self, session_id, session_record):
+        self.linking_sessions[session_id] = session_record
+        self.queue_write(self.model.sync_model.update_linking_session, session_id, session_record)
+
+
+async def request_storage_model():
+    """
+    FastAPI dependency providing the request's RequestStorageModel.
+
+    Route handlers should commit their writes before returning their response; any
+    left uncommitted when the request completes successfully are committed here.
+    """
+    storage = RequestStorageModel()
+    yield storage
+    await storage.commit()
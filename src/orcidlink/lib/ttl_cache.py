@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    A bounded, least-recently-used cache whose entries expire "lifetime" seconds after
+    they are added, unless given a lifetime of their own.
+
+    The cache holds at most "max_size" entries and, if "max_bytes" is given, entries
+    whose sizes, as measured by "size_of", total at most "max_bytes"; a value larger
+    than that is not cached.
+
+    Note that cache3's SafeCache is not used as it does not enforce its max_size.
+    """
+
+    def __init__(self, max_size: int, lifetime: float, max_bytes: int = None,
+                 size_of: Callable[[Any], int] = None):
+        if max_bytes is not None and size_of is None:
+            raise TypeError('the "size_of" parameter is required with "max_bytes"')
+        self.max_size = max_size
+        self.lifetime = lifetime
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        # Each entry is (expires at, value, size in bytes).
+        self.entries = OrderedDict()
+        self.bytes = 0
+        # Reentrant, so that subclasses may hold it around the methods here.
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, count_miss: bool = True, count_hit: bool = True) -> Optional[Any]:
+        """
+        The key's value, or None if it is not cached. A lookup expected to miss, such
+        as a check that a key is not present, may be left out of the "misses" counter;
+        a caller which only knows later whether the value is of use may count the
+        lookup itself, with count().
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self.remove_entry(key)
+                entry = None
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            if count_hit:
+                self.hits += 1
+            return entry[1]
+
+    def count(self, hit: bool):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def set(self, key: Hashable, value: Any, lifetime: float = None):
+        if lifetime is None:
+            lifetime = self.lifetime
+        size = self.size_of(value) if self.max_bytes is not None else 0
+        with self.lock:
+            if self.max_size <= 0:
+                return
+            self.remove_entry(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (time.monotonic() + lifetime, value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_size or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self.remove_entry(next(iter(self.entries)))
+
+    def remove_entry(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def delete(self, key: Hashable):
+        with self.lock:
+            self.remove_entry(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+            if self.max_bytes is not None:
+                stats["bytes"] = self.bytes
+                stats["max_bytes"] = self.max_bytes
+            return stats
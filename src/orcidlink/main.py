@@ -10,16 +10,26 @@ from fastapi.responses import RedirectResponse
 from orcidlink.api_types import InfoResponse, StatusResponse
 from orcidlink.lib.config import (ensure_config, get_config, get_service_path,
                                   get_service_url)
+from orcidlink.lib.http_clients import close_http_clients
+from orcidlink.lib.linking_session_sweeper import (start_linking_session_sweeper,
+                                                   stop_linking_session_sweeper)
 from orcidlink.lib.responses import (ErrorException, error_response,
                                      exception_error_response, ui_error_response)
-from orcidlink.lib.storage_model import StorageModel
+from orcidlink.lib.route_utils import REQUEST_STORAGE
+from orcidlink.lib.storage_model import RequestStorageModel, get_link_record_cache_stats
 from orcidlink.lib.utils import get_kbase_config
 from orcidlink.routers import link, linking_sessions, orcid, works
 from orcidlink.routers.linking_sessions import get_linking_session_record
+from orcidlink.service_clients.ORCIDClient import get_response_cache_stats
+from orcidlink.service_clients.auth import get_request_token_info
 from orcidlink.service_clients.authclient2 import (KBaseAuthException, KBaseAuthInvalidToken,
-                                                   KBaseAuthMissingToken)
+                                                   KBaseAuthMissingToken, get_invalid_token_cache_stats,
+                                                   get_shared_token_cache_stats, get_token_cache_stats)
 from starlette import status
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 #
 # Set up FastAPI top level app with associated metadata for documentation purposes.
@@ -81,6 +91,53 @@ app.include_router(works.router)
 app.include_router(orcid.router)
 
 
+#
+# The time taken to authenticate the request, if it was, is reported in a "Server-Timing"
+# header, so that it may be seen in browser developer tools and proxy logs.
+#
+# A plain ASGI middleware, which adds the header as the response starts, rather than one
+# based on BaseHTTPMiddleware (@app.middleware), which passes every response through an
+# extra task and stream.
+#
+class ServerTimingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # The request state (request.state) is kept in the scope.
+        state = scope.setdefault("state", {})
+
+        async def send_with_server_timing(message: Message):
+            if message["type"] == "http.response.start":
+                auth_duration = state.get("auth_duration")
+                if auth_duration is not None:
+                    MutableHeaders(scope=message).append("Server-Timing", f"auth;dur={auth_duration * 1000:.1f}")
+            await send(message)
+
+        await self.app(scope, receive, send_with_server_timing)
+
+
+app.add_middleware(ServerTimingMiddleware)
+
+
+#
+# Background tasks which run for the lifetime of the service.
+#
+@app.on_event("startup")
+async def startup():
+    start_linking_session_sweeper()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_linking_session_sweeper()
+    await close_http_clients()
+
+
 #
 # Custom exception handlers.
 # Exceptions caught by FastAPI result in a variety of error responses, using
@@ -218,7 +275,13 @@ async def get_status():
     The intention of this endpoint is as a lightweight way to call to ping the
     service, e.g. for health check, latency tests, etc.
     """
-    return StatusResponse(status="ok", time=datetime.now(timezone.utc).isoformat())
+    return StatusResponse(status="ok",
+                          time=datetime.now(timezone.utc).isoformat(),
+                          link_record_cache=get_link_record_cache_stats(),
+                          token_cache=get_token_cache_stats(),
+                          shared_token_cache=await run_in_threadpool(get_shared_token_cache_stats),
+                          invalid_token_cache=get_invalid_token_cache_stats(),
+                          orcid_response_cache=get_response_cache_stats())
 
 
 @app.get("/info", response_model=InfoResponse, tags=["misc"])
@@ -284,7 +347,8 @@ async def continue_linking_session(
 
         code: str | None = None,
         state: str | None = None,
-        error: str | None = None
+        error: str | None = None,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
     """
     The redirect endpoint for the ORCID OAuth flow we use for linking.
@@ -332,7 +396,8 @@ async def continue_linking_session(
 
     session_id = unpacked_state.get("session_id")
 
-    session_record = get_linking_session_record(session_id, authorization)
+    username = (await get_request_token_info(request, authorization)).user
+    session_record = await get_linking_session_record(session_id, username, storage)
 
     #
     # Exchange the temporary token from ORCID for the authorized token.
@@ -365,8 +430,8 @@ async def continue_linking_session(
     # Note that this is approximate, as it uses our time, not the
     # ORCID server time.
     session_record["orcid_auth"] = orcid_auth
-    model = StorageModel()
-    model.update_linking_session(session_id, session_record)
+    await storage.update_linking_session(session_id, session_record)
+    await storage.commit()
 
     #
     # Redirect back to the orcidlink interface, with some
@@ -1,12 +1,10 @@
 from fastapi import APIRouter, Response
-from orcidlink.lib.responses import (ensure_authorization, error_response,
-                                     success_response_no_data)
-from orcidlink.lib.route_utils import AUTHORIZATION_HEADER, AUTH_RESPONSES, STD_RESPONSES
-from orcidlink.lib.storage_model import StorageModel
+from orcidlink.lib.responses import error_response, success_response_no_data
+from orcidlink.lib.route_utils import AUTH_RESPONSES, REQUEST_STORAGE, REQUEST_USERNAME, STD_RESPONSES
+from orcidlink.lib.storage_model import RequestStorageModel
 from orcidlink.model_types import (LinkRecordPublic, ORCIDAuthPublic)
 from orcidlink.routers.works import get_link_record
 from orcidlink.service_clients.ORCIDClient import orcid_oauth
-from orcidlink.service_clients.auth import get_username
 
 router = APIRouter(prefix="/link", responses={404: {"description": "Not found"}})
 
@@ -26,15 +24,14 @@ router = APIRouter(prefix="/link", responses={404: {"description": "Not found"}}
     }
 )
 async def delete_link(
-        authorization: str | None = AUTHORIZATION_HEADER
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
     """
     Removes the link for the user associated with the KBase auth token passed in the "Authorization" header
     """
 
-    authorization = ensure_authorization(authorization)
-    username = get_username(authorization)
-    link_record = get_link_record(username)
+    link_record = await get_link_record(username, storage)
 
     if link_record is None:
         # idempotent, so don't throw error
@@ -43,10 +40,9 @@ async def delete_link(
     # TODO: handle error? or propagate?
     orcid_oauth(link_record.orcid_auth.access_token).revoke_token()
 
-    model = StorageModel()
-
     # TODO: handle error? or propagate?
-    model.remove_user_record(username)
+    await storage.remove_user_record(username)
+    await storage.commit()
 
     return success_response_no_data()
 
@@ -63,15 +59,13 @@ async def delete_link(
     }
 )
 async def link(
-        authorization: str | None = AUTHORIZATION_HEADER
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ) -> LinkRecordPublic:
     """
     Return the link for the user associated with the KBase auth token passed in the "Authorization" header
     """
-    authorization = ensure_authorization(authorization)
-    username = get_username(authorization)
-
-    link_record = get_link_record(username)
+    link_record = await get_link_record(username, storage)
 
     if link_record is None:
         return error_response("notFound", "Not Linked", "No link record was found for this user", status_code=404)
@@ -99,13 +93,12 @@ async def link(
     }
 )
 async def is_linked(
-        authorization: str | None = AUTHORIZATION_HEADER
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ) -> bool:
     """
     Determine if the user associated with the KBase auth token in the "Authorization" header has a 
     link to an ORCID account.
     """
-    authorization = ensure_authorization(authorization)
-    username = get_username(authorization)
-    link_record = get_link_record(username)
+    link_record = await get_link_record(username, storage)
     return link_record is not None
@@ -2,17 +2,17 @@ import json
 import uuid
 from urllib.parse import urlencode
 
-from fastapi import APIRouter, Cookie, HTTPException, Query, responses
+from fastapi import APIRouter, Cookie, HTTPException, Query, Request, responses
 from orcidlink.lib.config import get_config, get_service_url
 from orcidlink.lib.constants import LINKING_SESSION_TTL, ORCID_SCOPES
-from orcidlink.lib.responses import ensure_authorization, success_response_no_data
-from orcidlink.lib.route_utils import AUTHORIZATION_HEADER, AUTH_RESPONSES, STD_RESPONSES
-from orcidlink.lib.storage_model import StorageModel
+from orcidlink.lib.responses import success_response_no_data
+from orcidlink.lib.route_utils import AUTH_RESPONSES, REQUEST_STORAGE, REQUEST_USERNAME, STD_RESPONSES
+from orcidlink.lib.storage_model import RequestStorageModel
 from orcidlink.lib.utils import current_time_millis
 from orcidlink.model_types import LinkingSessionComplete, LinkingSessionInitial, LinkingSessionStarted, ORCIDAuthPublic, \
     SimpleSuccess
 from orcidlink.service_clients.ORCIDClient import AuthorizeParams
-from orcidlink.service_clients.auth import get_username
+from orcidlink.service_clients.auth import get_request_token_info
 from pydantic import BaseModel, Field
 
 router = APIRouter(
@@ -24,12 +24,8 @@ router = APIRouter(
 ##
 # Convenience functions
 #
-def get_linking_session_record(session_id: str, authorization: str):
-    username = get_username(authorization)
-
-    model = StorageModel()
-
-    session_record = model.get_linking_session(session_id)
+async def get_linking_session_record(session_id: str, username: str, storage: RequestStorageModel):
+    session_record = await storage.get_linking_session(session_id)
 
     if session_record is None:
         raise HTTPException(404, 'Linking session not found')
@@ -69,16 +65,13 @@ class CreateLinkingSessionResult(BaseModel):
     },
     tags=["link"])
 async def create_linking_session(
-        authorization: str | None = AUTHORIZATION_HEADER
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
     """
     Creates a new "linking session"; resulting in a linking session created in the database, and the id for it
     returned for usage in an interactive linking session.
     """
-    authorization = ensure_authorization(authorization)
-
-    username = get_username(authorization)
-
     created_at = current_time_millis()
     # Expiration of the linking session, currently hardwired in the constants file.
     expires_at = created_at + LINKING_SESSION_TTL * 1000
@@ -89,8 +82,8 @@ async def create_linking_session(
         "created_at": created_at,
         "expires_at": expires_at
     }
-    model = StorageModel()
-    model.create_linking_session(session_id, linking_record)
+    await storage.create_linking_session(session_id, linking_record)
+    await storage.commit()
     return CreateLinkingSessionResult(session_id=session_id)
 
 
@@ -114,12 +107,13 @@ async def create_linking_session(
     tags=["link"]
 )
 async def start_linking_session(
+        request: Request,
         session_id: str = SESSION_ID_FIELD,
         return_link: str | None = RETURN_LINK_QUERY,
         skip_prompt: str | None = SKIP_PROMPT_QUERY,
         kbase_session: str = Cookie(default=None, description="KBase auth token taken from a cookie"),
         kbase_session_backup: str = Cookie(default=None, description="KBase auth token taken from a cookie"),
-
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
     """
     Starts a "linking session", an interactive OAuth flow the end result of which is an access_token stored at
@@ -134,10 +128,9 @@ async def start_linking_session(
     else:
         authorization = kbase_session
 
-    username = get_username(authorization)
+    username = (await get_request_token_info(request, authorization)).user
 
-    model = StorageModel()
-    session_record = model.get_linking_session(session_id)
+    session_record = await storage.get_linking_session(session_id)
 
     if session_record is None:
         raise HTTPException(404, "Linking session not found")
@@ -156,7 +149,8 @@ async def start_linking_session(
     # TODO: enhance session record to record the status - so that we can prevent
     # starting a session twice!
 
-    model.update_linking_session(session_id, session_record)
+    await storage.update_linking_session(session_id, session_record)
+    await storage.commit()
 
     # TODO: get from config; in fact, all constants probably should be!
 
@@ -200,22 +194,19 @@ async def start_linking_session(
 )
 async def finish_linking_session(
         session_id: str = SESSION_ID_FIELD,
-        authorization: str | None = AUTHORIZATION_HEADER
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
     """
     The final stage of the interactive linking session; called when the user confirms the creation
     of the link, after OAuth flow has finished.
     """
-    ensure_authorization(authorization)
-
-    session_record = get_linking_session_record(session_id, authorization)
+    session_record = await get_linking_session_record(session_id, username, storage)
 
-    username = get_username(authorization)
     created_at = current_time_millis()
     expires_at = created_at + session_record["orcid_auth"]["expires_in"] * 1000
 
-    model = StorageModel()
-    model.create_user_record(
+    await storage.create_user_record(
         username,
         {
             "orcid_auth": session_record["orcid_auth"],
@@ -224,7 +215,8 @@ async def finish_linking_session(
         },
     )
 
-    model.delete_linking_session(session_id)
+    await storage.delete_linking_session(session_id)
+    await storage.commit()
     return SimpleSuccess(ok="true")
 
 
@@ -245,11 +237,10 @@ async def finish_linking_session(
 )
 async def get_linking_sessions(
         session_id: str = SESSION_ID_FIELD,
-        authorization: str = AUTHORIZATION_HEADER
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
-    ensure_authorization(authorization)
-
-    session_record = get_linking_session_record(session_id, authorization)
+    session_record = await get_linking_session_record(session_id, username, storage)
 
     print('HMM', session_record)
 
@@ -297,12 +288,11 @@ async def get_linking_sessions(
     tags=["link"])
 async def delete_linking_session(
         session_id: str = SESSION_ID_FIELD,
-        authorization: str | None = AUTHORIZATION_HEADER
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
-    ensure_authorization(authorization)
-
-    session_record = get_linking_session_record(session_id, authorization)
+    session_record = await get_linking_session_record(session_id, username, storage)
 
-    model = StorageModel()
-    model.delete_linking_session(session_record['session_id'])
+    await storage.delete_linking_session(session_record['session_id'])
+    await storage.commit()
     return success_response_no_data()
@@ -1,12 +1,11 @@
 from fastapi import APIRouter
-from orcidlink.lib.responses import ensure_authorization, error_response
-from orcidlink.lib.route_utils import AUTHORIZATION_HEADER, AUTH_RESPONSES, STD_RESPONSES
-from orcidlink.lib.storage_model import StorageModel
+from orcidlink.lib.responses import error_response
+from orcidlink.lib.route_utils import AUTH_RESPONSES, REQUEST_STORAGE, REQUEST_USERNAME, STD_RESPONSES
+from orcidlink.lib.storage_model import RequestStorageModel
 from orcidlink.lib.transform import raw_work_to_work
 from orcidlink.lib.utils import get_int_prop, get_raw_prop, get_string_prop
 from orcidlink.model_types import ORCIDProfile
-from orcidlink.service_clients.ORCIDClient import orcid_api
-from orcidlink.service_clients.auth import get_username
+from orcidlink.service_clients.ORCIDClient import fetch_concurrently, orcid_api
 
 ################################
 # API
@@ -122,21 +121,18 @@ def orcid_profile_to_normalized(orcid_id: str, profile_json, email_json) -> ORCI
     }
 )
 async def get_profile(
-        authorization: str | None = AUTHORIZATION_HEADER
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
     """
     Get the ORCID profile for the user associated with the current auth token.
 
     Returns a 404 Not Found if the user is not linked
     """
-    authorization = ensure_authorization(authorization)
-    username = get_username(authorization)
-
     #
     # Fetch the user's ORCID Link record from KBase.
     #
-    model = StorageModel()
-    user_link_record = model.get_user_record(username)
+    user_link_record = await storage.get_user_record(username)
     if user_link_record is None:
         return error_response("notfound", "Not Found", "User link record not found", status_code=404)
 
@@ -149,7 +145,8 @@ async def get_profile(
     #
 
     # TODO: what if the profile is not found?
-    profile_json = orcid_api(access_token).get_profile(orcid_id)
-    email_json = orcid_api(access_token).get_email(orcid_id)
+    # The profile and email are fetched at the same time.
+    api = orcid_api(access_token)
+    profile_json, email_json = await fetch_concurrently(api.get_profile(orcid_id), api.get_email(orcid_id))
 
     return orcid_profile_to_normalized(orcid_id, profile_json, email_json)
@@ -2,16 +2,15 @@ import json
 from typing import List
 
 import httpx
-from fastapi import APIRouter, HTTPException, Header, Path
-from orcidlink.lib.config import get_config
-from orcidlink.lib.responses import (ErrorException, ErrorResponse, ensure_authorization,
-                                     error_response, make_error_exception)
-from orcidlink.lib.storage_model import StorageModel
+from fastapi import APIRouter, HTTPException, Path, Request
+from orcidlink.lib.responses import (ErrorException, ErrorResponse, error_response,
+                                     make_error_exception)
+from orcidlink.lib.route_utils import AUTHORIZATION_HEADER, REQUEST_STORAGE, REQUEST_USERNAME, request_token_info
+from orcidlink.lib.storage_model import RequestStorageModel
 from orcidlink.lib.transform import parse_date, raw_work_to_work
 from orcidlink.lib.utils import get_raw_prop, get_string_prop
 from orcidlink.model_types import ExternalId, LinkRecord, ORCIDWork, SimpleSuccess
-from orcidlink.service_clients.ORCIDClient import orcid_api, orcid_api_url
-from orcidlink.service_clients.auth import get_username
+from orcidlink.service_clients.ORCIDClient import orcid_api
 from pydantic import BaseModel, Field
 
 router = APIRouter(
@@ -43,15 +42,8 @@ class NewWork(BaseModel):
 # Utils
 #
 
-def get_orcid_auth(kbase_token: str) -> LinkRecord:
-    username = get_username(kbase_token)
-    return get_link_record(username)
-
-
-def get_link_record(username: str) -> LinkRecord:
-    model = StorageModel()
-    user_record = model.get_user_record(username)
-    return user_record
+async def get_link_record(username: str, storage: RequestStorageModel) -> LinkRecord:
+    return await storage.get_user_record(username)
 
 
 #
@@ -75,13 +67,12 @@ def get_link_record(username: str) -> LinkRecord:
 )
 async def get_work(
         put_code: str = Path(description="The ORCID `put code` for the work record to fetch"),
-        authorization: str | None = Header(default=None, description="Kbase auth token")):
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE):
     """
     Fetch the work record, identified by `put_code`, for the user associated with the KBase auth token provided in the `Authorization` header
     """
-    authorization = ensure_authorization(authorization)
-
-    user_record = get_orcid_auth(authorization)
+    user_record = await get_link_record(username, storage)
 
     if user_record is None:
         return error_response("notFound", "Not Found", "User link record not found", status_code=404)
@@ -90,7 +81,7 @@ async def get_work(
     orcid_id = user_record.orcid_auth.orcid
 
     try:
-        raw_work = orcid_api(token).get_work(orcid_id, put_code)
+        raw_work = await orcid_api(token).get_work(orcid_id, put_code)
         hmm = raw_work_to_work(raw_work['bulk'][0]['work'])
         return hmm
     except ErrorException as errx:
@@ -115,14 +106,13 @@ async def get_work(
     }
 )
 async def get_works(
-        authorization: str | None = Header(default=None, description="Kbase auth token")
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
     """
     Fetch all of the "work" records from a user's ORCID account if their KBase account is linked.
     """
-    authorization = ensure_authorization(authorization)
-
-    link_record = get_orcid_auth(authorization)
+    link_record = await get_link_record(username, storage)
 
     if link_record is None:
         return error_response("notFound", "Not Linked", "No link record was found for this user", status_code=404)
@@ -130,7 +120,7 @@ async def get_works(
     token = link_record.orcid_auth.access_token
     orcid_id = link_record.orcid_auth.orcid
 
-    full_result = orcid_api(token).get_works(orcid_id)
+    full_result = await orcid_api(token).get_works(orcid_id)
     result = []
     for group in full_result['group']:
         result.append(raw_work_to_work(group['work-summary'][0]))
@@ -149,15 +139,18 @@ async def get_works(
         422: {"description": "Either input or output data does not comply with the API schema", "model": ErrorResponse}
     })
 async def save_work(
+        request: Request,
         work_update: WorkUpdate,
-        authorization: str | None = Header(default=None, description="Kbase auth token")
+        authorization: str | None = AUTHORIZATION_HEADER,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
     """
     Update a work record; the `work_update` contains the `put code`.
     """
-    authorization = ensure_authorization(authorization)
-
-    link_record = get_orcid_auth(authorization)
+    # Authenticated here, rather than by dependency, so that an invalid request body is
+    # reported before a missing or invalid token.
+    username = (await request_token_info(request, authorization)).user
+    link_record = await get_link_record(username, storage)
 
     if link_record is None:
         return error_response("notFound", "User link record not found", "No link record was found for this user",
@@ -176,7 +169,7 @@ async def save_work(
     #
     # First, get the work record.
     #
-    response = orcid_api(token).get_work(orcid_id, put_code)
+    response = await orcid_api(token).get_work(orcid_id, put_code)
     work_record = response['bulk'][0]['work']
 
     #
@@ -233,7 +226,7 @@ async def save_work(
                     }
                 )
 
-    raw_work_record = orcid_api(token).save_work(orcid_id, put_code, work_record)
+    raw_work_record = await orcid_api(token).save_work(orcid_id, put_code, work_record)
 
     return raw_work_to_work(raw_work_record)
 
@@ -241,31 +234,29 @@ async def save_work(
 @router.delete("/{put_code}", response_model=SimpleSuccess, tags=["works"])
 async def delete_work(
         put_code: str,
-        authorization: str | None = Header(default=None, description="Kbase auth token")
+        username: str = REQUEST_USERNAME,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
-    authorization = ensure_authorization(authorization)
-
-    user_record = get_orcid_auth(authorization)
+    user_record = await get_link_record(username, storage)
 
     token = user_record.orcid_auth.access_token
     orcid_id = user_record.orcid_auth.orcid
 
-    header = {
-        "Accept": "application/vnd.orcid+json",
-        "Authorization": f"Bearer {token}",
-    }
-    url = orcid_api_url(f"{orcid_id}/work/{put_code}")
-
-    response = httpx.delete(url, headers=header)
+    # TODO: handle error? or propagate?
+    await orcid_api(token).delete_work(orcid_id, put_code)
     return {"ok": True}
 
 
 @router.post("", response_model=ORCIDWork, tags=["works"])
 async def create_work(
+        request: Request,
         new_work: NewWork,
-        authorization: str | None = Header(default=None)
+        authorization: str | None = AUTHORIZATION_HEADER,
+        storage: RequestStorageModel = REQUEST_STORAGE
 ):
-    link_record = get_orcid_auth(authorization)
+    # As for save_work, authenticated after the request body is validated.
+    username = (await request_token_info(request, authorization)).user
+    link_record = await get_link_record(username, storage)
 
     if link_record is None:
         return error_response("notFound", "User link record not found", "No link record was found for this user",
@@ -300,20 +291,8 @@ async def create_work(
                 }
             )
 
-    url = orcid_api_url(f"{orcid_id}/works")
-    header = {
-        "Accept": "application/vnd.orcid+json",
-        "Content-Type": "application/vnd.orcid+json",
-        "Authorization": f"Bearer {token}",
-    }
-    # TODO: propagate everywhere. Or, perhaps better,
-    # wrap this common use case into a function or class.
-    timeout = get_config(["kbase", "defaults", "serviceRequestTimeout"]) / 1000
     try:
-        response = httpx.post(url,
-                              timeout=timeout,
-                              headers=header,
-                              content=json.dumps({"bulk": [{"work": work_record}]}))
+        response = await orcid_api(token).create_work(orcid_id, work_record)
     except httpx.HTTPError as ex:
         raise HTTPException(400, {
             "code": "foo",
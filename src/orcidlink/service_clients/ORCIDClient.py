@@ -1,11 +1,22 @@
+import asyncio
 import json
+import logging
+import time
 from json import JSONDecodeError
+from typing import Awaitable, List, Optional
 
 import httpx
-from orcidlink.lib.config import get_config
+from orcidlink.lib.config import get_config, get_config_default
+from orcidlink.lib.http_clients import get_http_client
 from orcidlink.lib.responses import ErrorException, ErrorResponse
+from orcidlink.lib.ttl_cache import TTLCache
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
+
+# In seconds.
+DEFAULT_TIMEOUT = 60
+
 
 class AuthorizeParams(BaseModel):
     client_id: str
@@ -20,6 +31,153 @@ def orcid_api_url(path):
     return f"{get_config(['orcid', 'apiBaseURL'])}/{path}"
 
 
+def http2_available() -> bool:
+    # HTTP/2 support in httpx requires the optional "h2" package.
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_orcid_http_client() -> httpx.AsyncClient:
+    """
+    The client shared by all ORCID API calls, which pools and keeps alive connections to
+    the ORCID API; as it is used for the one host, its limits are in effect per-host.
+
+    HTTP/2, which multiplexes concurrent requests over one connection, is used if
+    enabled in the config and supported by the installed httpx.
+    """
+    http2 = get_config_default(["orcid", "apiClient", "http2"], False)
+    if http2 and not http2_available():
+        logger.warning("HTTP/2 is enabled for the ORCID API, but the 'h2' package is not installed; using HTTP/1.1")
+        http2 = False
+    return get_http_client(
+        "orcid",
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=get_config_default(["orcid", "apiClient", "maxConnections"], 100),
+            max_keepalive_connections=get_config_default(["orcid", "apiClient", "maxKeepaliveConnections"], 20),
+            keepalive_expiry=get_config_default(["orcid", "apiClient", "keepaliveExpiry"], 5000) / 1000
+        )
+    )
+
+
+#
+# Successful responses to ORCID API GETs, keyed by url, and so per user (ORCID id); see
+# get_response_cache().
+#
+response_cache = None
+
+# How long, in seconds, a cached response is served without revalidation, unless
+# configured. The cache, and its invalidation by changes made through the service, is
+# per worker process, so with several workers a change made through one may be seen by
+# the others only after this long. With 0, every use is revalidated, which saves a
+# full response only where ORCID provides an ETag or Last-Modified header.
+DEFAULT_RESPONSE_FRESH_FOR = 10
+
+# The total size, in bytes, of the response bodies cached, unless configured.
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+
+class CachedResponse:
+    """
+    A response cached for the access token with which it was fetched. It is served as is
+    until "fresh_until" (a time.monotonic() time); thereafter it is revalidated with
+    ORCID, if ORCID provided an ETag or Last-Modified header for it, or else refetched.
+    """
+
+    def __init__(self, access_token: str, response: httpx.Response, fresh_until: float):
+        self.access_token = access_token
+        self.response = response
+        self.fresh_until = fresh_until
+
+    def size(self) -> int:
+        return len(self.response.content)
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        etag = self.response.headers.get("etag")
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        last_modified = self.response.headers.get("last-modified")
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+
+def get_response_cache() -> Optional[TTLCache]:
+    """
+    Returns the process-wide cache of ORCID API responses, or None if it is disabled, as
+    it is unless "orcid.apiClient.responseCache.maxSize" is configured. That is the
+    number of responses; the cache is also bounded by the total size of their bodies,
+    "orcid.apiClient.responseCache.maxBytes", as a user's record or works may be
+    hundreds of KB.
+    """
+    global response_cache
+    if response_cache is None:
+        max_size = get_config_default(["orcid", "apiClient", "responseCache", "maxSize"], 0)
+        if max_size <= 0:
+            return None
+        response_cache = TTLCache(
+            max_size=max_size,
+            lifetime=get_config_default(["orcid", "apiClient", "responseCache", "lifetime"], 600),
+            max_bytes=get_config_default(["orcid", "apiClient", "responseCache", "maxBytes"],
+                                         DEFAULT_RESPONSE_CACHE_MAX_BYTES),
+            size_of=CachedResponse.size
+        )
+    return response_cache
+
+
+def get_response_cache_stats() -> Optional[dict]:
+    """
+    The ORCID API response cache hit/miss counters, for monitoring; None if the cache has
+    not been used by this process.
+    """
+    if response_cache is None:
+        return None
+    return response_cache.stats()
+
+
+async def fetch_concurrently(*requests: Awaitable) -> List:
+    """
+    Awaits the requests (e.g. calls of ORCIDAPIClient methods) concurrently, so that the
+    time taken is that of the slowest rather than the sum of them all, returning their
+    results in order.
+
+    All requests are completed even if some fail. A single failure is raised as is;
+    several are raised together as an ErrorException with the error for each.
+    """
+    results = await asyncio.gather(*requests, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if len(errors) == 0:
+        return results
+
+    for error in errors:
+        # E.g. cancellation; not a failure of the request.
+        if not isinstance(error, Exception):
+            raise error
+
+    if len(errors) == 1:
+        raise errors[0]
+
+    error_data = []
+    for error in errors:
+        if isinstance(error, ErrorException):
+            error_data.append(error.error.dict(exclude_unset=True))
+        else:
+            error_data.append({"exception": str(error)})
+    raise ErrorException(
+        error=ErrorResponse(
+            code="upstreamError",
+            title="Error",
+            message="Errors fetching data from ORCID api",
+            data={"errors": error_data}
+        ),
+        status_code=400
+    )
+
+
 class ORCIDClientBase:
     def __init__(self, url: str = None, access_token: str = None):
         if url is None:
@@ -70,10 +228,79 @@ class ORCIDClientBase:
 
 
 class ORCIDAPIClient(ORCIDClientBase):
+    """
+    A client of the ORCID API on behalf of the user whose access token it holds.
+
+    Instances are cheap; requests are all made with the shared ORCID API client (see
+    get_orcid_http_client), so that connections are reused across users and requests.
+    """
+
+    def __init__(self, url: str = None, access_token: str = None, timeout: float = DEFAULT_TIMEOUT):
+        super().__init__(url=url, access_token=access_token)
+        self.timeout = timeout
+
+    async def get(self, orcid_id: str, path: str) -> httpx.Response:
+        """
+        GETs the path within the user's ORCID record.
+
+        If the response cache is enabled, successful responses are cached, and served to
+        later calls with the same access token; once no longer fresh they are revalidated
+        with ORCID where possible (see CachedResponse). Methods which change the record
+        remove the responses they affect from the cache.
+
+        A lookup is counted as a cache hit only if the cached response is served, either
+        while fresh or once ORCID confirms it is unchanged.
+        """
+        url = self.url(f"{orcid_id}/{path}")
+        headers = self.header()
+        cache = get_response_cache()
+        cached = None
+        if cache is not None:
+            cached = cache.get(url, count_miss=False, count_hit=False)
+            # Responses depend on the token's scopes, so are not shared between tokens.
+            if cached is not None and cached.access_token != self.access_token:
+                cached = None
+            if cached is not None:
+                if time.monotonic() < cached.fresh_until:
+                    cache.count(hit=True)
+                    return cached.response
+                headers.update(cached.conditional_headers())
+
+        response = await get_orcid_http_client().get(url, headers=headers, timeout=self.timeout)
+
+        if cache is None:
+            return response
+        revalidated = response.status_code == 304 and cached is not None
+        cache.count(hit=revalidated)
+        if revalidated:
+            response = cached.response
+        elif response.status_code != 200:
+            return response
+        fresh_for = get_config_default(["orcid", "apiClient", "responseCache", "freshFor"],
+                                       DEFAULT_RESPONSE_FRESH_FOR)
+        cached = CachedResponse(self.access_token, response, time.monotonic() + fresh_for)
+        if fresh_for <= 0 and len(cached.conditional_headers()) == 0:
+            # Never fresh, and can't be revalidated; of no use.
+            cache.delete(url)
+        else:
+            cache.set(url, cached)
+        return response
+
+    def invalidate(self, orcid_id: str, *paths: str):
+        """
+        Removes the responses for the given paths within the user's ORCID record from the
+        response cache.
+        """
+        cache = get_response_cache()
+        if cache is None:
+            return
+        for path in paths:
+            cache.delete(self.url(f"{orcid_id}/{path}"))
+
     #
     # Profile
     # 
-    def get_profile(self, orcid_id: str):
+    async def get_profile(self, orcid_id: str):
         """
         Get the ORCID profile for the user associated with the orcid_id.
 
@@ -82,11 +309,11 @@ class ORCIDAPIClient(ORCIDClientBase):
         Thus access to the profile should be through the get_json function, 
         which can readily dig into the resulting dict.
         """
-        response = httpx.get(self.url(f"{orcid_id}/record"), headers=self.header())
+        response = await self.get(orcid_id, "record")
         return json.loads(response.text)
 
-    def get_email(self, orcid_id: str):
-        response = httpx.get(self.url(f"{orcid_id}/email"), headers=self.header())
+    async def get_email(self, orcid_id: str):
+        response = await self.get(orcid_id, "email")
         return json.loads(response.text)
 
     #
@@ -94,35 +321,65 @@ class ORCIDAPIClient(ORCIDClientBase):
     #
 
     # TODO: do we want to type the raw works record?
-    def get_works(self, orcid_id: str):
+    async def get_works(self, orcid_id: str):
         # TODO: catch errors here
-        response = httpx.get(self.url(f"{orcid_id}/works"), headers=self.header())
+        response = await self.get(orcid_id, "works")
 
         if response.status_code != 200:
             raise self.make_exception(response, source="get_works")
 
         return json.loads(response.text)
 
-    def get_work(self, orcid_id: str, put_code: str):
+    async def get_work(self, orcid_id: str, put_code: str):
         # TODO: catch errors here
-        url = self.url(f"{orcid_id}/works/{put_code}")
-        response = httpx.get(url, headers=self.header())
+        response = await self.get(orcid_id, f"works/{put_code}")
 
         if response.status_code != 200:
             raise self.make_exception(response, source="get_works")
 
         return json.loads(response.text)
 
-    def save_work(self, orcid_id: str, put_code: str, work_record: dict):
-        response = httpx.put(self.url(f"{orcid_id}/work/{put_code}"),
-                             headers=self.header(),
-                             content=json.dumps(work_record))
+    #
+    # Changes to works also change the record, which includes a summary of them.
+    # The cached responses are invalidated even if the request fails, as ORCID may
+    # nonetheless have made the change.
+    #
+
+    async def save_work(self, orcid_id: str, put_code: str, work_record: dict):
+        try:
+            response = await get_orcid_http_client().put(self.url(f"{orcid_id}/work/{put_code}"),
+                                                         headers=self.header(),
+                                                         content=json.dumps(work_record),
+                                                         timeout=self.timeout)
+        finally:
+            self.invalidate(orcid_id, "record", "works", f"works/{put_code}")
 
         if response.status_code != 200:
             raise self.make_exception(response, source="save_work")
 
         return json.loads(response.text)
 
+    async def create_work(self, orcid_id: str, work_record: dict) -> httpx.Response:
+        """
+        Adds the work record to the user's ORCID account, returning the response for
+        the caller to interpret; errors making the request are raised as httpx.HTTPError.
+        """
+        try:
+            return await get_orcid_http_client().post(self.url(f"{orcid_id}/works"),
+                                                      headers=self.header(),
+                                                      content=json.dumps({"bulk": [{"work": work_record}]}),
+                                                      timeout=self.timeout)
+        finally:
+            self.invalidate(orcid_id, "record", "works")
+
+    async def delete_work(self, orcid_id: str, put_code: str) -> httpx.Response:
+        try:
+            return await get_orcid_http_client().delete(self.url(f"{orcid_id}/work/{put_code}"),
+                                                        headers=self.header(),
+                                                        timeout=self.timeout)
+        finally:
+            self.invalidate(orcid_id, "record", "works", f"works/{put_code}")
+
 
 class ORCIDOAuthClient(ORCIDClientBase):
     #
@@ -155,7 +412,8 @@ def orcid_api(token: str) -> ORCIDAPIClient:
     """
     return ORCIDAPIClient(
         url=get_config(['orcid', 'apiBaseURL']),
-        access_token=token
+        access_token=token,
+        timeout=get_config(["kbase", "defaults", "serviceRequestTimeout"]) / 1000
     )
 
 
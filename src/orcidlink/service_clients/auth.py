@@ -1,12 +1,45 @@
-from orcidlink.lib.config import get_config
+import time
+
+from fastapi import Request
+from orcidlink.lib.config import get_config, get_config_default
 from orcidlink.service_clients import authclient2
 
 
-def get_username(kbase_auth_token: str) -> str:
-    auth = authclient2.KBaseAuth(
+def get_auth() -> authclient2.KBaseAuth:
+    return authclient2.KBaseAuth(
         auth_url=get_config(["kbase", "services", "Auth2", "url"]),
         cache_lifetime=get_config(["kbase", "services", "Auth2", "tokenCacheLifetime"]) / 1000,
-        cache_max_size=get_config(["kbase", "services", "Auth2", "tokenCacheMaxSize"])
+        cache_max_size=get_config(["kbase", "services", "Auth2", "tokenCacheMaxSize"]),
+        timeout=get_config(["kbase", "defaults", "serviceRequestTimeout"]) / 1000,
+        invalid_token_cache_lifetime=get_config_default(
+            ["kbase", "services", "Auth2", "invalidTokenCacheLifetime"], 10000) / 1000,
+        invalid_token_cache_max_size=get_config_default(
+            ["kbase", "services", "Auth2", "invalidTokenCacheMaxSize"], 1000),
+        shared_cache_path=get_config_default(["kbase", "services", "Auth2", "sharedTokenCachePath"], None)
     )
 
-    return auth.get_username(kbase_auth_token)
+
+def get_username(kbase_auth_token: str) -> str:
+    return get_auth().get_username(kbase_auth_token)
+
+
+async def get_username_async(kbase_auth_token: str) -> str:
+    return await get_auth().get_username_async(kbase_auth_token)
+
+
+async def get_request_token_info(request: Request, kbase_auth_token: str) -> authclient2.TokenInfo:
+    """
+    The token info for the request's KBase auth token, which is validated only once per
+    request; the result is kept on the request state ("token_info"), along with the time
+    taken, in seconds, to obtain it ("auth_duration").
+    """
+    token_info = getattr(request.state, "token_info", None)
+    if token_info is not None:
+        return token_info
+    start = time.perf_counter()
+    try:
+        token_info = await get_auth().get_token_info_async(kbase_auth_token)
+    finally:
+        request.state.auth_duration = time.perf_counter() - start
+    request.state.token_info = token_info
+    return token_info
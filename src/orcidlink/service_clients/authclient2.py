@@ -3,14 +3,44 @@ A basic KBase auth client for the Python server.
 The SDK version has been modified to integrate with this codebase, such as
 using httpx, pydantic models.
 """
+import asyncio
 import json
+import threading
+import time
+from concurrent.futures import Future
 
 import httpx
-from cache3 import SafeCache
+from orcidlink.lib.http_clients import get_http_client
+from orcidlink.lib.shared_cache import SharedCache
+from orcidlink.lib.ttl_cache import TTLCache
 from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 
+# Token info is cached for as long as the auth service allows ("cachefor") and the
+# token remains valid ("expires"), up to the configured cache lifetime.
 global_cache = None
 
+# Optionally, beneath the in-process cache, a cache shared by the worker processes
+# on the host, so that they warm each other's caches.
+global_shared_cache = None
+
+# Tokens found to be invalid are remembered for a short time, so that a client
+# retrying with an expired token does not cause a request to the auth service each
+# time.
+global_invalid_token_cache = None
+
+# In seconds.
+DEFAULT_TIMEOUT = 60
+
+#
+# Token lookups in progress, keyed by auth url and token (and, for async lookups,
+# event loop), so that concurrent cache misses for the same token, as when the UI
+# makes several calls at once, share a single request to the auth service.
+#
+token_lookups = {}
+token_lookups_lock = threading.Lock()
+async_token_lookups = {}
+
 
 class TokenInfo(BaseModel):
     type: str = Field(...)
@@ -31,9 +61,22 @@ class KBaseAuth(object):
     def __init__(self,
                  auth_url: str = None,
                  cache_max_size: int = None,
-                 cache_lifetime: int = None):
+                 cache_lifetime: int = None,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 invalid_token_cache_max_size: int = 1000,
+                 invalid_token_cache_lifetime: float = 10,
+                 shared_cache_path: str = None):
         """
         Constructor
+
+        The timeout, in seconds, applies to each request to the auth service.
+
+        Invalid tokens are cached for "invalid_token_cache_lifetime" seconds; a max size
+        of 0 disables this.
+
+        If "shared_cache_path" is provided, token info is also cached in an SQLite
+        database at that path, relative to the module directory, shared with the other
+        worker processes on the host; see SharedCache.
         """
         if auth_url is None:
             raise TypeError("missing required named argument 'auth_url'")
@@ -45,33 +88,154 @@ class KBaseAuth(object):
             raise TypeError("missing required named argument 'cache_lifetime'")
 
         self.auth_url = auth_url
+        self.timeout = timeout
+        self.cache_lifetime = cache_lifetime
 
         global global_cache
 
         if global_cache is None:
-            global_cache = SafeCache(max_size=cache_max_size, timeout=cache_lifetime)
+            global_cache = TTLCache(max_size=cache_max_size, lifetime=cache_lifetime)
 
         self.cache = global_cache
 
-    def get_token_info(self, token: str) -> TokenInfo:
+        global global_invalid_token_cache
+
+        if global_invalid_token_cache is None:
+            global_invalid_token_cache = TTLCache(max_size=invalid_token_cache_max_size,
+                                                  lifetime=invalid_token_cache_lifetime)
+
+        self.invalid_token_cache = global_invalid_token_cache
+
+        global global_shared_cache
+
+        if global_shared_cache is None and shared_cache_path is not None:
+            global_shared_cache = SharedCache(path=shared_cache_path, max_size=cache_max_size)
+
+        self.shared_cache = global_shared_cache if shared_cache_path is not None else None
+
+    def get_cached_token_info(self, token: str) -> TokenInfo | None:
         token_info = self.cache.get(token)
+        if token_info is not None or self.shared_cache is None:
+            return token_info
+        return self.get_shared_token_info(token)
+
+    async def get_cached_token_info_async(self, token: str) -> TokenInfo | None:
+        """
+        As get_cached_token_info, but with the shared cache, a database, read in a
+        worker thread rather than on the event loop.
+        """
+        token_info = self.cache.get(token)
+        if token_info is not None or self.shared_cache is None:
+            return token_info
+        return await run_in_threadpool(self.get_shared_token_info, token)
+
+    def get_shared_token_info(self, token: str) -> TokenInfo | None:
+        entry = self.shared_cache.get(token)
+        if entry is None:
+            return None
+        value, lifetime = entry
+        token_info = TokenInfo.parse_obj(value)
+        self.cache.set(token, token_info, min(lifetime, self.token_info_lifetime(token_info)))
+        return token_info
+
+    def get_token_info(self, token: str) -> TokenInfo:
+        token_info = self.get_cached_token_info(token)
+        if token_info is not None:
+            return token_info
+        self.ensure_not_invalid(token)
+
+        key = (self.auth_url, token)
+        with token_lookups_lock:
+            lookup = token_lookups.get(key)
+            in_progress = lookup is not None
+            if not in_progress:
+                lookup = Future()
+                token_lookups[key] = lookup
+        if in_progress:
+            return lookup.result()
+
+        try:
+            token_info = self.fetch_token_info(token)
+            lookup.set_result(token_info)
+            return token_info
+        except BaseException as ex:
+            lookup.set_exception(ex)
+            raise
+        finally:
+            with token_lookups_lock:
+                del token_lookups[key]
+
+    def fetch_token_info(self, token: str) -> TokenInfo:
+        response = httpx.get(self.auth_url, headers={"authorization": token}, timeout=self.timeout)
+        token_info = self.cache_token_info_response(token, response)
+        self.share_token_info(token, token_info)
+        return token_info
+
+    async def get_token_info_async(self, token: str) -> TokenInfo:
+        """
+        As get_token_info, but without blocking the event loop; the request is made
+        with the shared "auth" client, which keeps connections to the auth service
+        alive between requests.
+        """
+        token_info = await self.get_cached_token_info_async(token)
         if token_info is not None:
             return token_info
+        self.ensure_not_invalid(token)
+
+        key = (asyncio.get_running_loop(), self.auth_url, token)
+        lookup = async_token_lookups.get(key)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self.fetch_token_info_async(token))
+            async_token_lookups[key] = lookup
+            lookup.add_done_callback(lambda _: async_token_lookups.pop(key, None))
+        # A caller which is cancelled does not cancel the lookup for the others.
+        return await asyncio.shield(lookup)
+
+    async def fetch_token_info_async(self, token: str) -> TokenInfo:
+        client = get_http_client("auth")
+        response = await client.get(self.auth_url, headers={"authorization": token}, timeout=self.timeout)
+        token_info = self.cache_token_info_response(token, response)
+        if self.shared_cache is not None:
+            await run_in_threadpool(self.share_token_info, token, token_info)
+        return token_info
+
+    def ensure_not_invalid(self, token: str):
+        # Nearly every token checked is valid, so the misses are not counted; the hits
+        # are the lookups saved.
+        if self.invalid_token_cache.get(token, count_miss=False) is not None:
+            raise KBaseAuthInvalidToken('Invalid token')
+
+    def cache_token_info_response(self, token: str, response: httpx.Response) -> TokenInfo:
+        try:
+            token_info = self.parse_token_info_response(response)
+        except KBaseAuthInvalidToken:
+            self.invalid_token_cache.set(token, True)
+            raise
+        lifetime = self.token_info_lifetime(token_info)
+        if lifetime > 0:
+            self.cache.set(token, token_info, lifetime)
+        return token_info
+
+    def share_token_info(self, token: str, token_info: TokenInfo):
+        """
+        Caches the token info in the shared cache, if enabled, for the other worker
+        processes.
+        """
+        lifetime = self.token_info_lifetime(token_info)
+        if lifetime > 0 and self.shared_cache is not None:
+            self.shared_cache.set(token, token_info.dict(), lifetime)
+
+    def token_info_lifetime(self, token_info: TokenInfo) -> float:
+        """
+        How long, in seconds, the token info may be cached.
+        """
+        return min(self.cache_lifetime,
+                   token_info.cachefor / 1000,
+                   token_info.expires / 1000 - time.time())
 
-        # TODO: timeout needs to be configurable
+    @staticmethod
+    def parse_token_info_response(response: httpx.Response) -> TokenInfo:
         try:
-            response = httpx.get(self.auth_url, headers={"authorization": token}, timeout=10000)
-            # except httpx.HTTPStatusError:
-            #     # Note that here we are raising the default exception for the
-            #     # httpx library in the case that a deep internal server error
-            #     # is thrown without an actual json response. In other words, the
-            #     # error is not a JSON-RPC error thrown by the auth2 service itself,
-            #     # but some truly internal server error.
-            #     # Note that ALL errors returned by stock KBase JSON-RPC 1.1 servers
-            #     # are 500.
-            #     response.raise_for_status()
-            #
-            # try:
             json_response = response.json()
         except json.JSONDecodeError as ex:
             # Note that here we are raising the default exception for the
@@ -92,13 +256,47 @@ class KBaseAuth(object):
             else:
                 raise KBaseAuthException(json_response['error']['message'])
 
-        token_info = TokenInfo.parse_obj(json_response)
-        self.cache.set(token, token_info)
-        return token_info
+        return TokenInfo.parse_obj(json_response)
 
     def get_username(self, token: str) -> str:
         return self.get_token_info(token).user
 
+    async def get_username_async(self, token: str) -> str:
+        return (await self.get_token_info_async(token)).user
+
+
+def get_token_cache_stats() -> dict | None:
+    """
+    The token info cache hit/miss counters, for monitoring; None if the cache has not
+    been used by this process.
+    """
+    if global_cache is None:
+        return None
+    return global_cache.stats()
+
+
+def get_shared_token_cache_stats() -> dict | None:
+    """
+    The shared token info cache's size and this process's hit/miss counters, for
+    monitoring; None if the shared cache is not enabled, or not yet used. Counting
+    the entries queries the database, so this should not be called on the event
+    loop.
+    """
+    if global_shared_cache is None:
+        return None
+    return global_shared_cache.stats()
+
+
+def get_invalid_token_cache_stats() -> dict | None:
+    """
+    The invalid token cache hit/miss counters, for monitoring; None if the cache has
+    not been used by this process. The hits are requests with a token already known
+    to be invalid; checks of other tokens are not counted as misses.
+    """
+    if global_invalid_token_cache is None:
+        return None
+    return global_invalid_token_cache.stats()
+
 
 class KBaseAuthException(Exception):
     pass
@@ -77,6 +77,13 @@ def test_get_config_not_found(my_config_file):
         config.get_config(['foo'])
 
 
+def test_get_config_default(my_config_file):
+    config = Config(os.path.join(module_dir(), "config/config.yaml"))
+    assert config.get_config_default(['env', 'IS_DYNAMIC_SERVICE'], 'no') == 'yes'
+    assert config.get_config_default(['storage', 'backend'], 'file') == 'file'
+    assert config.get_config_default(['foo']) is None
+
+
 def test_get_service_url_from_config(my_config_file2):
     config = Config(os.path.join(module_dir(), "config/config.yaml"))
     assert config.get_service_url() == 'https://ci.kbase.us/services/ORCIDLink'
@@ -0,0 +1,476 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from orcidlink.lib import db
+from orcidlink.lib.db import FileStorage
+
+
+@pytest.fixture
+def my_data_dir(fs):
+    # Indexes are cached per process; each test has a fresh filesystem.
+    db.index_cache.clear()
+    db.index_sorted_entries.clear()
+    db.index_writers.clear()
+    yield fs
+    db.index_cache.clear()
+    db.index_sorted_entries.clear()
+    db.index_writers.clear()
+
+
+EXAMPLE_RECORD_1 = {
+    "foo": "bar"
+}
+
+
+def test_index_is_resident(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+
+    first = storage.get_collection_index("things")
+    second = storage.get_collection_index("things")
+    assert first is second
+    assert first["entities"]["foo"]["id"] == 1
+
+
+def test_index_reloaded_after_external_change(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_1
+
+    # Simulate another process rewriting the index behind our back.
+    index_path = storage.get_index_file_path("things")
+    with open(index_path, "r") as fin:
+        index = json.load(fin)
+    index["entities"]["bar"] = index["entities"].pop("foo")
+    with open(index_path, "w") as fout:
+        json.dump(index, fout)
+
+    assert storage.get("things", "foo") is None
+    assert storage.get("things", "bar") == EXAMPLE_RECORD_1
+
+
+def test_index_cache_tracks_deleted_file(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_1
+
+    os.remove(storage.get_index_file_path("things"))
+
+    assert storage.get("things", "foo") is None
+    assert storage.get_collection_index("things") == {"last_id": 0, "entities": {}}
+
+
+#
+# Codecs
+#
+
+def test_compact_codec(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    compact_storage = FileStorage(codecs={"other-things": "compact-json"})
+    compact_storage.create("other-things", "foo", EXAMPLE_RECORD_1)
+
+    assert compact_storage.get("other-things", "foo") == EXAMPLE_RECORD_1
+    with open(compact_storage.get_entity_file_paths("other-things", 1)[0]) as fin:
+        assert fin.read() == '{"foo":"bar"}'
+    assert os.path.getsize(compact_storage.get_entity_file_paths("other-things", 1)[0]) < \
+           os.path.getsize(storage.get_entity_file_paths("things", 1)[0])
+
+
+def test_unknown_codec(my_data_dir):
+    storage = FileStorage(codecs={"things": "foo"})
+    with pytest.raises(ValueError):
+        storage.create("things", "foo", EXAMPLE_RECORD_1)
+
+
+def test_convert_codec(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    storage.create("things", "bar", {"bar": "baz"})
+    # As written before codecs were recorded in the index.
+    del storage.get_collection_index("things")["entities"]["foo"]["codec"]
+    storage.save_collection_index("things", storage.get_collection_index("things"))
+    original_text = open(storage.get_entity_file_paths("things", 1)[0]).read()
+
+    # Reading doesn't rewrite the entity.
+    compact_storage = FileStorage(codecs={"things": "compact-json"})
+    assert compact_storage.get("things", "foo") == EXAMPLE_RECORD_1
+    with open(storage.get_entity_file_paths("things", 1)[0]) as fin:
+        assert fin.read() == original_text
+
+    # Saving does.
+    compact_storage.save("things", "bar", {"bar": "baz"})
+    assert compact_storage.get_collection_index("things")["entities"]["bar"]["codec"] == "compact-json"
+
+    assert compact_storage.convert_codec("things") == 1
+    with open(storage.get_entity_file_paths("things", 1)[0]) as fin:
+        assert fin.read() == '{"foo":"bar"}'
+    assert compact_storage.get_collection_index("things")["entities"]["foo"]["codec"] == "compact-json"
+    assert compact_storage.get("things", "foo") == EXAMPLE_RECORD_1
+    assert compact_storage.convert_codec("things") == 0
+
+
+def test_iterate_pages(my_data_dir):
+    storage = FileStorage()
+    for index in range(25):
+        storage.create("things", f"thing{index}", {"index": index})
+
+    page = list(storage.iterate("things", limit=10, batch_size=3))
+    assert [name for _, name, _ in page] == [f"thing{index}" for index in range(10)]
+    assert [value["index"] for _, _, value in page] == list(range(10))
+
+    last_id = page[-1][0]
+    rest = list(storage.iterate("things", after_id=last_id, batch_size=4))
+    assert [value["index"] for _, _, value in rest] == list(range(10, 25))
+
+    assert storage.list("things") == [{"index": index} for index in range(25)]
+
+    # An id between entities, or past the last, starts after it.
+    assert list(storage.iterate("things", after_id=1000)) == []
+
+
+def test_iterate_sorted_entries_kept_until_index_changes(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    entries = storage.get_sorted_index_entries("things")
+    assert entries == [(1, "foo")]
+    assert storage.get_sorted_index_entries("things") is entries
+
+    storage.create("things", "bar", EXAMPLE_RECORD_1)
+    assert storage.get_sorted_index_entries("things") == [(1, "foo"), (2, "bar")]
+    storage.delete("things", "foo")
+    assert [name for _, name, _ in storage.iterate("things")] == ["bar"]
+
+
+def test_iterate_skips_missing_entities(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    storage.create("things", "bar", EXAMPLE_RECORD_1)
+    os.remove(storage.get_entity_file_paths("things", 1)[0])
+
+    assert [name for _, name, _ in storage.iterate("things")] == ["bar"]
+
+
+def test_sharded_layout(my_data_dir):
+    storage = FileStorage(layout="sharded")
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+
+    file_path = storage.get_entity_file_paths("things", 1)[0]
+    assert file_path.exists()
+    assert file_path.parent.parent.parent.name == "things"
+    assert not os.path.exists(storage.get_entity_file_paths("things", 1)[1])
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_1
+
+    storage.delete("things", "foo")
+    assert not file_path.exists()
+    assert storage.get("things", "foo") is None
+
+
+def test_unknown_layout(my_data_dir):
+    with pytest.raises(ValueError, match="Unknown storage layout: foo"):
+        FileStorage(layout="foo")
+
+
+def test_layout_fallback_and_migration(my_data_dir):
+    flat_storage = FileStorage()
+    flat_storage.create("things", "foo", EXAMPLE_RECORD_1)
+    flat_storage.create("things", "bar", EXAMPLE_RECORD_1)
+    flat_storage.create("things", "baz", EXAMPLE_RECORD_1)
+    flat_path = flat_storage.get_entity_file_paths("things", 1)[0]
+
+    storage = FileStorage(layout="sharded")
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_1
+
+    # Written entities move to the storage's layout.
+    storage.update("things", "foo", {"foo": "baz"})
+    assert not flat_path.exists()
+    assert storage.get_entity_file_paths("things", 1)[0].exists()
+    assert storage.get("things", "foo") == {"foo": "baz"}
+
+    assert storage.migrate_layout("things") == 2
+    assert storage.migrate_layout("things") == 0
+    assert [name for _, name, _ in storage.iterate("things")] == ["foo", "bar", "baz"]
+    assert len(list(Path(storage.root_path, "things").glob("*.json"))) == 1
+
+
+def test_migration_keeps_newer_file(my_data_dir, monkeypatch):
+    flat_storage = FileStorage()
+    flat_storage.create("things", "foo", EXAMPLE_RECORD_1)
+    flat_path = flat_storage.get_entity_file_paths("things", 1)[0]
+
+    storage = FileStorage(layout="sharded")
+
+    # A writer which found the file in the old layout saves the entity, while the
+    # migration moves the old file to the new layout.
+    original_write_file = db.write_file
+
+    def write_file(*args, **kwargs):
+        monkeypatch.setattr(db, "write_file", original_write_file)
+        assert storage.migrate_layout("things") == 1
+        original_write_file(*args, **kwargs)
+
+    monkeypatch.setattr(db, "write_file", write_file)
+    storage.save("things", "foo", {"foo": "baz"})
+    assert not flat_path.exists()
+    assert storage.get("things", "foo") == {"foo": "baz"}
+
+    # A stale file in the old layout does not replace a newer one in the new layout.
+    db.write_file(flat_path, json.dumps(EXAMPLE_RECORD_1))
+    assert storage.migrate_layout("things") == 1
+    assert not flat_path.exists()
+    assert storage.get("things", "foo") == {"foo": "baz"}
+
+
+def test_read_finds_file_moved_meanwhile(my_data_dir, monkeypatch):
+    flat_storage = FileStorage()
+    flat_storage.create("things", "foo", EXAMPLE_RECORD_1)
+    flat_path = flat_storage.get_entity_file_paths("things", 1)[0]
+
+    storage = FileStorage(layout="sharded")
+
+    # The file is moved after the reader has looked for it at its new path, and before
+    # it looks at the old one.
+    original_get_entity_file_paths = storage.get_entity_file_paths
+
+    def get_entity_file_paths(collection, entity_id):
+        paths = original_get_entity_file_paths(collection, entity_id)
+        if flat_path.exists():
+            def moving_paths():
+                yield paths[0]
+                monkeypatch.setattr(storage, "get_entity_file_paths", original_get_entity_file_paths)
+                assert storage.migrate_layout("things") == 1
+                yield from paths[1:]
+
+            return moving_paths()
+        return paths
+
+    monkeypatch.setattr(storage, "get_entity_file_paths", get_entity_file_paths)
+    assert storage.get_collection_entity_by_id("things", 1) == EXAMPLE_RECORD_1
+    assert not flat_path.exists()
+
+
+def test_save_requires_existing(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "bar", EXAMPLE_RECORD_1)
+    with pytest.raises(Exception, match="File does not exist"):
+        storage.save("things", "foo", EXAMPLE_RECORD_1)
+    with pytest.raises(Exception, match="File does not exist"):
+        storage.update("things", "foo", EXAMPLE_RECORD_1)
+    assert storage.get("things", "foo") is None
+    assert not any(name.startswith("None") for name in os.listdir(Path(storage.root_path, "things")))
+
+
+def test_save_many(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    storage.save_many("things", [("foo", {"foo": "baz"}), ("bar", EXAMPLE_RECORD_1)])
+
+    assert storage.get("things", "foo") == {"foo": "baz"}
+    assert storage.get("things", "bar") == EXAMPLE_RECORD_1
+    index = storage.get_collection_index("things")
+    assert index['last_id'] == 2
+    assert [event['event'] for event in index['entities']['foo']['events']] == ['created', 'updated']
+
+
+#
+# Atomic writes and group commit
+#
+
+def test_writes_leave_no_temporary_files(my_data_dir):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    storage.save("things", "foo", {"foo": "baz"})
+    storage.delete("things", "foo")
+    storage.create("things", "bar", EXAMPLE_RECORD_1)
+
+    assert sorted(os.listdir(Path(storage.root_path, "things"))) == ["2.json", "index.json", "index.lock"]
+
+
+def test_failed_index_write_leaves_index_intact(my_data_dir, monkeypatch):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    index_path = storage.get_index_file_path("things")
+    with open(index_path) as fin:
+        index_text = fin.read()
+
+    replace = os.replace
+
+    def fail_index_replace(source, destination):
+        if destination == index_path:
+            raise OSError("disk full")
+        replace(source, destination)
+
+    monkeypatch.setattr(db.os, "replace", fail_index_replace)
+    with pytest.raises(OSError):
+        storage.create("things", "bar", EXAMPLE_RECORD_1)
+    monkeypatch.undo()
+
+    # The entity was written before the index entry referring to it.
+    with open(index_path) as fin:
+        assert fin.read() == index_text
+    assert storage.get_entity_file_paths("things", 2)[0].exists()
+    assert not any(name.endswith(".tmp") for name in os.listdir(Path(storage.root_path, "things")))
+
+
+def test_failed_index_write_not_cached(my_data_dir, monkeypatch):
+    storage = FileStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+
+    index_path = storage.get_index_file_path("things")
+    write_temp_file = db.write_temp_file
+
+    def fail_write_temp_file(file_path, text, durable):
+        if file_path == index_path:
+            raise OSError("disk full")
+        return write_temp_file(file_path, text, durable)
+
+    monkeypatch.setattr(db, "write_temp_file", fail_write_temp_file)
+    with pytest.raises(OSError):
+        storage.delete("things", "foo")
+    with pytest.raises(OSError):
+        storage.create("things", "bar", EXAMPLE_RECORD_1)
+    monkeypatch.undo()
+
+    # The index this process sees is the one on disk, without the failed changes.
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_1
+    assert storage.get("things", "bar") is None
+    assert list(storage.get_collection_index("things")["entities"].keys()) == ["foo"]
+
+
+def test_group_commit(my_data_dir, monkeypatch):
+    storage = FileStorage(group_commit_window=0.01)
+    index_writes = []
+    write_collection_index = storage.write_collection_index
+
+    def counting_write_collection_index(collection, changes):
+        index_writes.append(len(changes))
+        write_collection_index(collection, changes)
+
+    monkeypatch.setattr(storage, "write_collection_index", counting_write_collection_index)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda index: storage.create("things", f"thing{index}", {"index": index}),
+                          range(40)))
+
+    assert len(index_writes) < 40
+    assert sum(index_writes) == 40
+    db.index_cache.clear()
+    index = FileStorage().get_collection_index("things")
+    assert index["last_id"] == 40
+    assert sorted(entry["id"] for entry in index["entities"].values()) == list(range(1, 41))
+    assert sorted(value["index"] for value in FileStorage().list("things")) == list(range(40))
+
+
+#
+# Sharing a data directory between processes
+#
+
+def create_things(directory, worker, count, group_commit_window):
+    # A forked process starts with its parent's caches.
+    db.index_cache.clear()
+    db.index_writers.clear()
+    storage = FileStorage(directory=directory, durable=False, group_commit_window=group_commit_window)
+    for index in range(count):
+        name = f"thing-{worker}-{index}"
+        storage.create("things", name, {"name": name})
+        if index % 5 == 0:
+            storage.save("things", name, {"name": name, "saved": True})
+
+
+@pytest.mark.parametrize("group_commit_window", [0, 0.002])
+def test_processes_share_storage(tmp_path, group_commit_window):
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=create_things, args=(str(tmp_path), worker, 25, group_commit_window))
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    db.index_cache.clear()
+    storage = FileStorage(directory=str(tmp_path))
+    index = storage.get_collection_index("things")
+    names = [f"thing-{worker}-{index}" for worker in range(4) for index in range(25)]
+    assert sorted(index["entities"].keys()) == sorted(names)
+    ids = [entry["id"] for entry in index["entities"].values()]
+    assert len(set(ids)) == len(names)
+    assert index["last_id"] >= max(ids)
+    for name in names:
+        assert storage.get("things", name)["name"] == name
+
+
+#
+# Checking and rebuilding indexes
+#
+
+def test_check_collection(my_data_dir):
+    storage = FileStorage(layout="sharded")
+    for index in range(5):
+        storage.create("linking-sessions", f"session{index}", {"session_id": f"session{index}"})
+    storage.create("users", "foo", EXAMPLE_RECORD_1)
+    storage.create("users", "bar", EXAMPLE_RECORD_1)
+
+    assert storage.check_collection("linking-sessions") == {
+        "entities": 5, "files": 5, "dangling": {}, "orphans": [], "recovered": {}, "corrupt": False
+    }
+
+    # An entry whose file is missing, and files without entries.
+    os.remove(storage.get_entity_file_paths("linking-sessions", 2)[0])
+    storage.delete_collection_index_entry("linking-sessions", "session3")
+    storage.delete_collection_index_entry("users", "bar")
+
+    report = storage.check_collection("linking-sessions")
+    assert report["dangling"] == {"session1": 2}
+    assert report["orphans"] == [4]
+    assert report["recovered"] == {"session3": 4}
+    report = storage.check_collection("users")
+    assert report["orphans"] == [2]
+    assert report["recovered"] == {}
+
+    storage.check_collection("linking-sessions", rebuild=True)
+    db.index_cache.clear()
+    report = storage.check_collection("linking-sessions")
+    assert (report["dangling"], report["orphans"]) == ({}, [])
+    assert storage.get("linking-sessions", "session3") == {"session_id": "session3"}
+    assert storage.get("linking-sessions", "session1") is None
+    assert storage.get_collection_index("linking-sessions")["last_id"] == 5
+
+
+def test_check_collection_corrupt_index(my_data_dir):
+    storage = FileStorage()
+    storage.create("linking-sessions", "session1", {"session_id": "session1"})
+    with open(storage.get_index_file_path("linking-sessions"), "w") as fout:
+        fout.write('{"last_id": 1, "ent')
+
+    report = storage.check_collection("linking-sessions", rebuild=True)
+    assert report["corrupt"]
+    assert report["recovered"] == {"session1": 1}
+    assert os.path.exists(storage.get_index_file_path("linking-sessions") + ".corrupt")
+    assert storage.get("linking-sessions", "session1") == {"session_id": "session1"}
+
+
+def test_check_collection_corrupt_index_unrecoverable(my_data_dir):
+    storage = FileStorage()
+    # Link records do not record their username.
+    storage.create("users", "foo", {"foo": "bar"})
+    index_path = storage.get_index_file_path("users")
+    with open(index_path, "w") as fout:
+        fout.write('{"last_id": 1, "ent')
+
+    with pytest.raises(db.UnrecoverableIndexError):
+        storage.check_collection("users", rebuild=True)
+    # Left as it was, for the operator to repair.
+    assert not os.path.exists(index_path + ".corrupt")
+    with open(index_path) as fin:
+        assert fin.read() == '{"last_id": 1, "ent'
+
+    report = storage.check_collection("users")
+    assert report["corrupt"]
+    assert report["orphans"] == [1]
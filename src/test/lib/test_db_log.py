@@ -0,0 +1,147 @@
+import os
+
+import pytest
+from orcidlink.lib import db_log
+from orcidlink.lib.db_log import LogStorage
+
+
+@pytest.fixture
+def my_data_dir(fs):
+    db_log.collection_logs.clear()
+    yield fs
+    db_log.collection_logs.clear()
+
+
+EXAMPLE_RECORD_1 = {
+    "foo": "bar"
+}
+
+EXAMPLE_RECORD_2 = {
+    "foo": "baz"
+}
+
+
+def test_create_get(my_data_dir):
+    storage = LogStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_1
+    assert storage.get("things", "bar") is None
+
+    with pytest.raises(Exception, match="Entity already exists"):
+        storage.create("things", "foo", EXAMPLE_RECORD_2)
+
+
+def test_save_update(my_data_dir):
+    storage = LogStorage()
+    storage.save("things", "foo", EXAMPLE_RECORD_1)
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_1
+
+    storage.update("things", "foo", EXAMPLE_RECORD_2)
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_2
+
+    with pytest.raises(Exception, match="Entity does not exist"):
+        storage.update("things", "bar", EXAMPLE_RECORD_2)
+
+
+def test_delete_list(my_data_dir):
+    storage = LogStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    storage.create("things", "bar", EXAMPLE_RECORD_2)
+    assert storage.list("things") == [EXAMPLE_RECORD_1, EXAMPLE_RECORD_2]
+
+    storage.delete("things", "foo")
+    # idempotent
+    storage.delete("things", "foo")
+    assert storage.get("things", "foo") is None
+    assert storage.list("things") == [EXAMPLE_RECORD_2]
+
+
+def test_reload_from_disk(my_data_dir):
+    storage = LogStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    storage.update("things", "foo", EXAMPLE_RECORD_2)
+    storage.create("things", "bar", EXAMPLE_RECORD_1)
+    storage.delete("things", "bar")
+
+    # As if in a freshly started process.
+    db_log.collection_logs.clear()
+    storage = LogStorage()
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_2
+    assert storage.get("things", "bar") is None
+
+
+def test_sees_appends_from_another_process(my_data_dir):
+    storage = LogStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+
+    other_log = db_log.CollectionLog(storage.get_collection_log("things").path)
+    other_log.append({"op": "put", "name": "bar", "value": EXAMPLE_RECORD_2})
+
+    assert storage.get("things", "bar") == EXAMPLE_RECORD_2
+
+
+def test_torn_record_is_skipped(my_data_dir):
+    storage = LogStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    path = storage.get_collection_log("things").path
+    with open(path, "ab") as log_file:
+        log_file.write(b'{"op":"put","name":"torn","val')
+
+    storage.create("things", "bar", EXAMPLE_RECORD_2)
+    assert storage.get("things", "bar") == EXAMPLE_RECORD_2
+
+    db_log.collection_logs.clear()
+    storage = LogStorage()
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_1
+    assert storage.get("things", "bar") == EXAMPLE_RECORD_2
+    assert storage.get("things", "torn") is None
+
+
+def test_compact(my_data_dir):
+    storage = LogStorage()
+    for index in range(100):
+        storage.save("things", "foo", {"index": index})
+    storage.create("things", "bar", EXAMPLE_RECORD_1)
+    path = storage.get_collection_log("things").path
+    size_before = os.path.getsize(path)
+
+    storage.compact("things")
+
+    assert os.path.getsize(path) < size_before
+    assert storage.get("things", "foo") == {"index": 99}
+    assert storage.get("things", "bar") == EXAMPLE_RECORD_1
+
+    db_log.collection_logs.clear()
+    storage = LogStorage()
+    assert storage.get("things", "foo") == {"index": 99}
+
+
+def test_compacts_automatically(my_data_dir, monkeypatch):
+    monkeypatch.setattr(db_log, "COMPACTION_MIN_DEAD_BYTES", 100)
+    storage = LogStorage()
+    for index in range(100):
+        storage.save("things", "foo", {"index": index})
+
+    # Uncompacted, the log would hold all 100 records.
+    assert os.path.getsize(storage.get_collection_log("things").path) < 1000
+    assert storage.get("things", "foo") == {"index": 99}
+
+
+def test_iterate(my_data_dir):
+    storage = LogStorage()
+    for name in ["c", "a", "b"]:
+        storage.create("things", name, {"name": name})
+
+    page = list(storage.iterate("things", limit=2))
+    assert [name for _, name, _ in page] == ["a", "b"]
+
+    rest = list(storage.iterate("things", after_id=page[-1][0]))
+    assert [value for _, _, value in rest] == [{"name": "c"}]
+
+
+def test_save_many(my_data_dir):
+    storage = LogStorage()
+    storage.create("things", "foo", EXAMPLE_RECORD_1)
+    storage.save_many("things", [("foo", EXAMPLE_RECORD_2), ("bar", EXAMPLE_RECORD_1)])
+    assert storage.get("things", "foo") == EXAMPLE_RECORD_2
+    assert storage.get("things", "bar") == EXAMPLE_RECORD_1
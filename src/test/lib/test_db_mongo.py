@@ -0,0 +1,239 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+from orcidlink.lib import db_mongo
+from orcidlink.lib.db_mongo import MongoStorage, expiration_date
+from pymongo.errors import DuplicateKeyError
+
+EXAMPLE_LINK_RECORD_1 = {
+    "created_at": 1,
+    "expires_at": 2,
+    "orcid_auth": {
+        "access_token": "foo"
+    }
+}
+
+EXAMPLE_LINKING_SESSION_RECORD_1 = {
+    "session_id": "foo",
+    "username": "bar",
+    "created_at": 123,
+    "expires_at": 456
+}
+
+
+#
+# An in-memory stand-in for the parts of a MongoDB collection which MongoStorage uses.
+#
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, field, direction):
+        self.documents = sorted(self.documents, key=lambda document: document[field], reverse=direction < 0)
+        return self
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = []
+        self.indexes = []
+
+    def create_index(self, keys, **options):
+        self.indexes.append((keys, options))
+
+    def unique_fields(self):
+        return [keys[0][0] for keys, options in self.indexes if options.get("unique")]
+
+    @staticmethod
+    def matches(document, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict):
+                if not document[field] > condition["$gt"]:
+                    return False
+            elif document.get(field) != condition:
+                return False
+        return True
+
+    @staticmethod
+    def project(document, projection):
+        if projection is None:
+            return dict(document)
+        fields = [field for field, included in projection.items() if included]
+        if projection.get("_id", True):
+            fields.append("_id")
+        return {field: document[field] for field in fields if field in document}
+
+    def find_one(self, query, projection=None):
+        for document in self.documents:
+            if self.matches(document, query):
+                return self.project(document, projection)
+        return None
+
+    def find(self, query, projection=None):
+        return FakeCursor([self.project(document, projection)
+                           for document in self.documents if self.matches(document, query)])
+
+    def insert_one(self, document):
+        for field in self.unique_fields():
+            if any(existing.get(field) == document.get(field) for existing in self.documents):
+                raise DuplicateKeyError("duplicate key")
+        self.documents.append(dict(document, _id=ObjectId()))
+
+    def replace_one(self, query, document, upsert=False):
+        for index, existing in enumerate(self.documents):
+            if self.matches(existing, query):
+                self.documents[index] = dict(document, _id=existing["_id"])
+                return FakeUpdateResult(1)
+        if upsert:
+            self.insert_one(document)
+        return FakeUpdateResult(0)
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            self.replace_one(request._filter, request._doc, upsert=request._upsert)
+
+    def delete_one(self, query):
+        self.documents = [document for document in self.documents if not self.matches(document, query)]
+
+
+class FakeUpdateResult:
+    def __init__(self, matched_count):
+        self.matched_count = matched_count
+
+
+class FakeMongoClient:
+    def __init__(self):
+        self.databases = {}
+
+    def __getitem__(self, database):
+        return self.databases.setdefault(database, FakeDatabase())
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, collection):
+        return self.collections.setdefault(collection, FakeCollection())
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    client = FakeMongoClient()
+    monkeypatch.setattr(db_mongo, "get_mongo_client", lambda url, **options: client)
+    monkeypatch.setattr(db_mongo, "indexed_databases", set())
+    yield MongoStorage(url="mongodb://localhost:27017", database="orcidlink")
+
+
+def test_MongoStorage_constructor_parameter_errors():
+    with pytest.raises(TypeError, match='the "url" named parameter is required'):
+        MongoStorage()
+
+    with pytest.raises(TypeError, match='the "database" named parameter is required'):
+        MongoStorage(url="mongodb://localhost:27017")
+
+
+def test_expiration_date():
+    assert expiration_date({}) is None
+    assert expiration_date({"expires_at": 1000}) == datetime.datetime(1970, 1, 1, 0, 0, 1,
+                                                                       tzinfo=datetime.timezone.utc)
+
+
+def test_collection_key():
+    assert MongoStorage.collection_key("users") == "username"
+    assert MongoStorage.collection_key("linking-sessions") == "session_id"
+    with pytest.raises(ValueError):
+        MongoStorage.collection_key("foo")
+
+
+def test_indexes_ensured_by_first_operation(storage):
+    # Creating the storage does no i/o.
+    assert storage.db["users"].indexes == []
+
+    storage.get("users", "foo")
+    assert storage.db["users"].indexes == [([("username", 1)], {"unique": True})]
+    assert ([("expire_at", 1)], {"expireAfterSeconds": 0}) in storage.db["linking-sessions"].indexes
+
+    # Only once per database.
+    storage.get("users", "foo")
+    assert len(storage.db["users"].indexes) == 1
+
+
+def test_create_get(storage):
+    storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+    assert storage.get("users", "foo") == EXAMPLE_LINK_RECORD_1
+    assert storage.get("users", "bar") is None
+
+    with pytest.raises(Exception, match="Entity already exists"):
+        storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+
+
+def test_save_update(storage):
+    storage.save("linking-sessions", "foo", EXAMPLE_LINKING_SESSION_RECORD_1)
+    assert storage.get("linking-sessions", "foo") == EXAMPLE_LINKING_SESSION_RECORD_1
+
+    updated = dict(EXAMPLE_LINKING_SESSION_RECORD_1, skip_prompt="yes")
+    storage.save("linking-sessions", "foo", updated)
+    assert storage.get("linking-sessions", "foo") == updated
+
+    updated = dict(EXAMPLE_LINKING_SESSION_RECORD_1, skip_prompt="no")
+    storage.update("linking-sessions", "foo", updated)
+    assert storage.get("linking-sessions", "foo") == updated
+
+    with pytest.raises(Exception, match="Entity does not exist"):
+        storage.update("linking-sessions", "bar", updated)
+
+
+def test_expire_at(storage):
+    storage.create("linking-sessions", "foo", EXAMPLE_LINKING_SESSION_RECORD_1)
+    document = storage.db["linking-sessions"].find_one({"session_id": "foo"})
+    assert document["expire_at"] == expiration_date(EXAMPLE_LINKING_SESSION_RECORD_1)
+
+    # Only linking sessions expire.
+    storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+    assert "expire_at" not in storage.db["users"].find_one({"username": "foo"})
+
+
+def test_delete_list(storage):
+    storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+    storage.create("users", "bar", EXAMPLE_LINK_RECORD_1)
+    assert len(storage.list("users")) == 2
+
+    storage.delete("users", "foo")
+    # idempotent
+    storage.delete("users", "foo")
+    assert storage.get("users", "foo") is None
+    assert len(storage.list("users")) == 1
+
+
+def test_iterate(storage):
+    for index in range(7):
+        storage.create("users", f"user{index}", {"index": index})
+
+    page = list(storage.iterate("users", limit=5))
+    assert [name for _, name, _ in page] == [f"user{index}" for index in range(5)]
+
+    rest = list(storage.iterate("users", after_id=page[-1][0]))
+    assert [value["index"] for _, _, value in rest] == [5, 6]
+
+
+def test_save_many(storage):
+    storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+    storage.save_many("users", [("foo", {"expires_at": 3}), ("bar", EXAMPLE_LINK_RECORD_1)])
+    assert storage.get("users", "foo") == {"expires_at": 3}
+    assert storage.get("users", "bar") == EXAMPLE_LINK_RECORD_1
+    storage.save_many("users", [])
+
+
+def test_unknown_collection(storage):
+    with pytest.raises(ValueError):
+        storage.get("foo", "bar")
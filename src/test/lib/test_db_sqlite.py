@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+from orcidlink.lib.db_sqlite import SQLiteStorage
+
+EXAMPLE_LINK_RECORD_1 = {
+    "created_at": 1,
+    "expires_at": 2,
+    "orcid_auth": {
+        "access_token": "foo"
+    }
+}
+
+EXAMPLE_LINKING_SESSION_RECORD_1 = {
+    "session_id": "foo",
+    "username": "bar",
+    "created_at": 123,
+    "expires_at": 456
+}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    yield SQLiteStorage(path=str(tmp_path / "test.sqlite3"))
+
+
+def test_create_get(storage):
+    storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+    assert storage.get("users", "foo") == EXAMPLE_LINK_RECORD_1
+    assert storage.get("users", "bar") is None
+
+    with pytest.raises(Exception, match="Entity already exists"):
+        storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+
+
+def test_save_update(storage):
+    storage.save("linking-sessions", "foo", EXAMPLE_LINKING_SESSION_RECORD_1)
+    assert storage.get("linking-sessions", "foo") == EXAMPLE_LINKING_SESSION_RECORD_1
+
+    updated = dict(EXAMPLE_LINKING_SESSION_RECORD_1, skip_prompt="yes")
+    storage.save("linking-sessions", "foo", updated)
+    assert storage.get("linking-sessions", "foo") == updated
+
+    updated = dict(EXAMPLE_LINKING_SESSION_RECORD_1, skip_prompt="no")
+    storage.update("linking-sessions", "foo", updated)
+    assert storage.get("linking-sessions", "foo") == updated
+
+    with pytest.raises(Exception, match="Entity does not exist"):
+        storage.update("linking-sessions", "bar", updated)
+
+
+def test_delete_list(storage):
+    storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+    storage.create("users", "bar", EXAMPLE_LINK_RECORD_1)
+    assert len(storage.list("users")) == 2
+
+    storage.delete("users", "foo")
+    # idempotent
+    storage.delete("users", "foo")
+    assert storage.get("users", "foo") is None
+    assert len(storage.list("users")) == 1
+
+
+def test_iterate(storage):
+    for index in range(7):
+        storage.create("users", f"user{index}", {"index": index})
+
+    page = list(storage.iterate("users", limit=5, batch_size=2))
+    assert [name for _, name, _ in page] == [f"user{index}" for index in range(5)]
+
+    rest = list(storage.iterate("users", after_id=page[-1][0], batch_size=2))
+    assert [value["index"] for _, _, value in rest] == [5, 6]
+
+
+def test_save_many(storage):
+    storage.create("users", "foo", EXAMPLE_LINK_RECORD_1)
+    storage.save_many("users", [("foo", {"expires_at": 3}), ("bar", EXAMPLE_LINK_RECORD_1)])
+    assert storage.get("users", "foo") == {"expires_at": 3}
+    assert storage.get("users", "bar") == EXAMPLE_LINK_RECORD_1
+
+
+def test_unknown_collection(storage):
+    with pytest.raises(ValueError):
+        storage.get("foo", "bar")
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / "test.sqlite3")
+    errors = []
+
+    def writer(index):
+        try:
+            storage = SQLiteStorage(path=path, pool_size=2)
+            for count in range(20):
+                storage.save("users", f"user{index}-{count}", EXAMPLE_LINK_RECORD_1)
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=writer, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(SQLiteStorage(path=path).list("users")) == 80
@@ -0,0 +1,43 @@
+from orcidlink.lib.expiry_queue import ExpiryQueue
+
+
+def test_pop_expired_in_order():
+    queue = ExpiryQueue()
+    queue.add("c", 30)
+    queue.add("a", 10)
+    queue.add("b", 20)
+    queue.add("d", 40)
+
+    assert queue.pop_expired(now=5, limit=10) == []
+    assert queue.pop_expired(now=30, limit=2) == ["a", "b"]
+    assert queue.pop_expired(now=30, limit=2) == ["c"]
+    assert len(queue) == 1
+
+
+def test_is_expired():
+    queue = ExpiryQueue()
+    queue.add("a", 10)
+    assert queue.is_expired("a", 10)
+    assert not queue.is_expired("a", 9)
+    assert not queue.is_expired("b", 100)
+
+
+def test_remove_and_readd():
+    queue = ExpiryQueue()
+    queue.add("a", 10)
+    queue.add("b", 10)
+    queue.remove("a")
+    queue.add("b", 50)
+
+    assert queue.pop_expired(now=20, limit=10) == []
+    assert queue.pop_expired(now=50, limit=10) == ["b"]
+    assert len(queue) == 0
+
+
+def test_prune_stale_entries():
+    queue = ExpiryQueue()
+    for expires_at in range(1000):
+        queue.add("a", expires_at)
+    assert len(queue) == 1
+    assert len(queue.heap) < 200
+    assert queue.pop_expired(now=1000, limit=10) == ["a"]
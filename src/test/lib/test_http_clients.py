@@ -0,0 +1,29 @@
+import asyncio
+
+from orcidlink.lib import http_clients
+from orcidlink.lib.http_clients import close_http_clients, get_http_client
+
+
+def test_get_http_client():
+    async def get_clients():
+        first = get_http_client("foo", timeout=1)
+        second = get_http_client("foo")
+        other = get_http_client("bar")
+        assert first is second
+        assert other is not first
+        assert first.timeout.read == 1
+        await close_http_clients()
+        assert first.is_closed
+        assert other.is_closed
+        return first
+
+    first = asyncio.run(get_clients())
+    assert http_clients.http_clients == {}
+
+    # A client is not shared with another event loop.
+    async def get_client():
+        client = get_http_client("foo")
+        await close_http_clients()
+        return client
+
+    assert asyncio.run(get_client()) is not first
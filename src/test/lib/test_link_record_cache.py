@@ -0,0 +1,62 @@
+import time
+
+from orcidlink.lib.link_record_cache import LinkRecordCache
+from orcidlink.model_types import LinkRecord
+
+EXAMPLE_LINK_RECORD_1 = LinkRecord.parse_obj({
+    "created_at": 1,
+    "expires_at": 2,
+    "orcid_auth": {
+        "access_token": "foo",
+        "token_type": "bar",
+        "refresh_token": "baz",
+        "expires_in": 3,
+        "scope": "boo",
+        "name": "abc",
+        "orcid": "def",
+        "id_token": "xyz"
+    }
+})
+
+
+def test_get_set():
+    cache = LinkRecordCache(max_size=10, lifetime=60)
+    assert cache.get("foo") is None
+    cache.set("foo", EXAMPLE_LINK_RECORD_1, cache.generation)
+    assert cache.get("foo") is EXAMPLE_LINK_RECORD_1
+    assert cache.stats() == {"size": 1, "max_size": 10, "hits": 1, "misses": 1}
+
+
+def test_evicts_least_recently_used():
+    cache = LinkRecordCache(max_size=2, lifetime=60)
+    cache.set("foo", EXAMPLE_LINK_RECORD_1, cache.generation)
+    cache.set("bar", EXAMPLE_LINK_RECORD_1, cache.generation)
+    cache.get("foo")
+    cache.set("baz", EXAMPLE_LINK_RECORD_1, cache.generation)
+    assert cache.get("bar") is None
+    assert cache.get("foo") is not None
+    assert cache.get("baz") is not None
+    assert cache.stats()["size"] == 2
+
+
+def test_expires():
+    cache = LinkRecordCache(max_size=10, lifetime=0.01)
+    cache.set("foo", EXAMPLE_LINK_RECORD_1, cache.generation)
+    time.sleep(0.02)
+    assert cache.get("foo") is None
+
+
+def test_invalidate():
+    cache = LinkRecordCache(max_size=10, lifetime=60)
+    cache.set("foo", EXAMPLE_LINK_RECORD_1, cache.generation)
+    cache.invalidate("foo")
+    assert cache.get("foo") is None
+
+
+def test_set_after_invalidate_ignored():
+    cache = LinkRecordCache(max_size=10, lifetime=60)
+    generation = cache.generation
+    # A write invalidated the record while it was being read.
+    cache.invalidate("foo")
+    cache.set("foo", EXAMPLE_LINK_RECORD_1, generation)
+    assert cache.get("foo") is None
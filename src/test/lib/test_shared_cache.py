@@ -0,0 +1,51 @@
+import sqlite3
+import time
+
+from orcidlink.lib import shared_cache
+from orcidlink.lib.shared_cache import SharedCache
+
+
+def test_get_set(tmp_path):
+    cache = SharedCache(path=str(tmp_path / "cache.sqlite3"), max_size=10)
+    assert cache.get("foo") is None
+    cache.set("foo", {"bar": 1}, 60)
+    value, lifetime = cache.get("foo")
+    assert value == {"bar": 1}
+    assert 59 < lifetime <= 60
+    assert cache.stats() == {"size": 1, "max_size": 10, "hits": 1, "misses": 1}
+
+    # Shared with other instances, e.g. in other processes.
+    other_cache = SharedCache(path=str(tmp_path / "cache.sqlite3"), max_size=10)
+    assert other_cache.get("foo")[0] == {"bar": 1}
+
+
+def test_keys_are_hashed(tmp_path):
+    cache = SharedCache(path=str(tmp_path / "cache.sqlite3"), max_size=10)
+    cache.set("secret-token", {"bar": 1}, 60)
+    keys = [row[0] for row in sqlite3.connect(cache.path).execute("SELECT key FROM cache")]
+    assert keys == [SharedCache.hash_key("secret-token")]
+
+
+def test_expires(tmp_path):
+    cache = SharedCache(path=str(tmp_path / "cache.sqlite3"), max_size=10)
+    cache.set("foo", 1, 0.05)
+    time.sleep(0.1)
+    assert cache.get("foo") is None
+
+
+def test_purge(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_cache, "PURGE_INTERVAL", 5)
+    cache = SharedCache(path=str(tmp_path / "cache.sqlite3"), max_size=3)
+    cache.set("expired", 0, -1)
+    for index in range(4):
+        cache.set(f"key{index}", index, 60 + index)
+    assert cache.stats()["size"] == 3
+    assert cache.get("key0") is None
+    assert cache.get("key3")[0] == 3
+
+
+def test_errors_are_misses(tmp_path):
+    cache = SharedCache(path=str(tmp_path / "not-a-directory" / "cache.sqlite3"), max_size=3)
+    (tmp_path / "not-a-directory").write_text("")
+    cache.set("foo", 1, 60)
+    assert cache.get("foo") is None
@@ -0,0 +1,139 @@
+import io
+import json
+
+import pytest
+from orcidlink.lib import db, storage_admin, storage_model
+from orcidlink.lib.db import FileStorage
+from orcidlink.lib.storage_model import StorageModel
+
+
+@pytest.fixture
+def my_data_dir(fs):
+    fake_config = """
+kbase:
+  services:
+    Auth2:
+      url: http://127.0.0.1:9999/services/auth/api/V2/token
+      tokenCacheLifetime: 300000
+      tokenCacheMaxSize: 20000
+    ServiceWizard:
+      url: http://127.0.0.1:9999/services/service_wizard
+  uiOrigin: https://ci.kbase.us
+  defaults:
+    serviceRequestTimeout: 60000
+orcid:
+  oauthBaseURL: https://sandbox.orcid.org/oauth
+  baseURL: https://sandbox.orcid.org
+  apiBaseURL: https://api.sandbox.orcid.org/v3.0
+env:
+  CLIENT_ID: 'REDACTED-CLIENT-ID'
+  CLIENT_SECRET: 'REDACTED-CLIENT-SECRET'
+  IS_DYNAMIC_SERVICE: 'yes'
+    """
+    fs.create_file("/kb/module/config/config.yaml", contents=fake_config)
+    storage_model.link_record_cache = None
+    db.index_cache.clear()
+    yield fs
+
+
+EXAMPLE_LINK_RECORD_1 = {
+    "created_at": 1,
+    "expires_at": 2,
+    "orcid_auth": {
+        "access_token": "foo",
+        "token_type": "bar",
+        "refresh_token": "baz",
+        "expires_in": 3,
+        "scope": "boo",
+        "name": "abc",
+        "orcid": "def",
+        "id_token": "xyz"
+    }
+}
+
+
+def test_migrate_layout(my_data_dir, capsys):
+    flat_storage = FileStorage()
+    flat_storage.create("users", "foo", {"foo": "bar"})
+    flat_storage.create("linking-sessions", "bar", {"bar": "baz"})
+
+    assert storage_admin.main(["migrate-layout", "--layout", "sharded"]) == 0
+    assert "users: moved 1 entity files" in capsys.readouterr().out
+
+    storage = FileStorage(layout="sharded")
+    assert storage.get_entity_file_paths("users", 1)[0].exists()
+    assert not flat_storage.get_entity_file_paths("users", 1)[0].exists()
+    assert storage.get("linking-sessions", "bar") == {"bar": "baz"}
+
+    assert storage_admin.main(["migrate-layout", "--layout", "flat", "users"]) == 0
+    assert flat_storage.get_entity_file_paths("users", 1)[0].exists()
+
+
+def test_convert_codec(my_data_dir, capsys):
+    storage = FileStorage()
+    storage.create("users", "foo", {"foo": "bar"})
+    storage.create("linking-sessions", "bar", {"bar": "baz"})
+
+    assert storage_admin.main(["convert-codec", "--codec", "compact-json", "users"]) == 0
+    assert "users: rewrote 1 entity files" in capsys.readouterr().out
+
+    with open(storage.get_entity_file_paths("users", 1)[0]) as fin:
+        assert fin.read() == '{"foo":"bar"}'
+    with open(storage.get_entity_file_paths("linking-sessions", 1)[0]) as fin:
+        assert fin.read() != '{"bar":"baz"}'
+
+
+def test_check_index(my_data_dir, capsys):
+    storage = FileStorage()
+    storage.create("users", "foo", {"foo": "bar"})
+    storage.create("linking-sessions", "bar", {"session_id": "bar"})
+    assert storage_admin.main(["check-index"]) == 0
+
+    storage.delete_collection_index_entry("linking-sessions", "bar")
+    capsys.readouterr()
+    assert storage_admin.main(["check-index", "linking-sessions"]) == 1
+    assert "recoverable: bar (id 1)" in capsys.readouterr().out
+
+    assert storage_admin.main(["check-index", "--rebuild", "linking-sessions"]) == 0
+    assert storage.get("linking-sessions", "bar") == {"session_id": "bar"}
+    assert storage_admin.main(["check-index"]) == 0
+
+    storage.delete_collection_index_entry("users", "foo")
+    assert storage_admin.main(["check-index", "--rebuild", "users"]) == 1
+    assert "orphaned: id 1" in capsys.readouterr().out
+
+    with open(storage.get_index_file_path("users"), "w") as fout:
+        fout.write("{")
+    assert storage_admin.main(["check-index", "--rebuild", "users"]) == 1
+    assert "users: The index of \"users\" can not be read" in capsys.readouterr().out
+
+
+def test_export_import_user_records(my_data_dir):
+    model = StorageModel(db=FileStorage())
+    for index in range(5):
+        model.create_user_record(f"user{index}", EXAMPLE_LINK_RECORD_1)
+
+    output = io.StringIO()
+    assert storage_admin.export_user_records(model, output) == 5
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 5
+    assert json.loads(lines[0]) == {"username": "user0", "record": EXAMPLE_LINK_RECORD_1}
+
+    other_model = StorageModel(db=FileStorage(directory="work/other-data"))
+    assert storage_admin.import_user_records(other_model, io.StringIO(output.getvalue()), batch_size=2) == 5
+    assert [username for _, username, _ in other_model.iterate_user_records()] == \
+           [f"user{index}" for index in range(5)]
+    assert other_model.get_user_record("user4").orcid_auth.access_token == "foo"
+
+
+def test_import_invalid_record(my_data_dir):
+    model = StorageModel(db=FileStorage())
+    lines = [
+        json.dumps({"username": "foo", "record": EXAMPLE_LINK_RECORD_1}),
+        "",
+        json.dumps({"username": "bar", "record": {"created_at": 1}})
+    ]
+    with pytest.raises(ValueError, match="Invalid link record on line 3"):
+        storage_admin.import_user_records(model, io.StringIO("\n".join(lines)), batch_size=1)
+    assert model.get_user_record("foo") is not None
+    assert model.get_user_record("bar") is None
@@ -1,17 +1,53 @@
+import asyncio
 import copy
 
 import pytest
-from orcidlink.lib.storage_model import StorageModel
+from orcidlink.lib import linking_session_sweeper, storage_model
+from orcidlink.lib.db import FileStorage
+from orcidlink.lib.link_record_cache import LinkRecordCache
+from orcidlink.lib.storage_model import AsyncStorageModel, RequestStorageModel, StorageModel, linking_session_expiry
 
 
 @pytest.fixture
 def my_data_dir(fs):
+    fake_config = """
+kbase:
+  services:
+    Auth2:
+      url: http://127.0.0.1:9999/services/auth/api/V2/token
+      tokenCacheLifetime: 300000
+      tokenCacheMaxSize: 20000
+    ServiceWizard:
+      url: http://127.0.0.1:9999/services/service_wizard
+  uiOrigin: https://ci.kbase.us
+  defaults:
+    serviceRequestTimeout: 60000
+orcid:
+  oauthBaseURL: https://sandbox.orcid.org/oauth
+  baseURL: https://sandbox.orcid.org
+  apiBaseURL: https://api.sandbox.orcid.org/v3.0
+env:
+  CLIENT_ID: 'REDACTED-CLIENT-ID'
+  CLIENT_SECRET: 'REDACTED-CLIENT-SECRET'
+  IS_DYNAMIC_SERVICE: 'yes'
+    """
+    fs.create_file("/kb/module/config/config.yaml", contents=fake_config)
+    linking_session_expiry.clear()
+    storage_model.link_record_cache = None
     yield fs
+    storage_model.link_record_cache = None
 
 
-def test_constructor():
+def test_constructor(my_data_dir):
     fs = StorageModel()
     assert fs is not None
+    assert isinstance(fs.db, FileStorage)
+
+
+def test_constructor_with_storage():
+    storage = FileStorage()
+    sm = StorageModel(db=storage)
+    assert sm.db is storage
 
 
 #
@@ -70,6 +106,54 @@ def test_remove_user_record(my_data_dir):
     assert record is None
 
 
+def test_iterate_user_records(my_data_dir):
+    sm = StorageModel()
+    for username in ["foo", "bar", "baz"]:
+        sm.create_user_record(username, EXAMPLE_LINK_RECORD_1)
+
+    page = list(sm.iterate_user_records(limit=2))
+    assert [username for _, username, _ in page] == ["foo", "bar"]
+    assert page[0][2].orcid_auth.access_token == "foo"
+
+    rest = list(sm.iterate_user_records(after_id=page[-1][0]))
+    assert [username for _, username, _ in rest] == ["baz"]
+
+
+class CountingFileStorage(FileStorage):
+    def __init__(self):
+        super().__init__()
+        self.gets = 0
+
+    def get(self, collection, name):
+        self.gets += 1
+        return super().get(collection, name)
+
+
+def test_link_record_cache(my_data_dir):
+    storage_model.link_record_cache = LinkRecordCache(max_size=10, lifetime=60)
+    db = CountingFileStorage()
+    sm = StorageModel(db=db)
+    sm.create_user_record("foo", EXAMPLE_LINK_RECORD_1)
+
+    record = sm.get_user_record("foo")
+    assert sm.get_user_record("foo") is record
+    assert db.gets == 1
+    assert storage_model.get_link_record_cache_stats()["hits"] == 1
+
+    updated_record = copy.deepcopy(EXAMPLE_LINK_RECORD_1)
+    updated_record["orcid_auth"]["access_token"] = "bar"
+    sm.save_user_record("foo", updated_record)
+    assert sm.get_user_record("foo").orcid_auth.access_token == "bar"
+
+    sm.remove_user_record("foo")
+    assert sm.get_user_record("foo") is None
+
+
+def test_link_record_cache_disabled_by_default(my_data_dir):
+    assert StorageModel().link_record_cache is None
+    assert storage_model.get_link_record_cache_stats() is None
+
+
 #
 # LInking session records
 #
@@ -78,6 +162,13 @@ EXAMPLE_LINKING_SESSION_RECORD_1 = {
     "session_id": "foo",
     "username": "bar",
     "created_at": 123,
+    "expires_at": 2301082134532
+}
+
+EXPIRED_LINKING_SESSION_RECORD_1 = {
+    "session_id": "baz",
+    "username": "bar",
+    "created_at": 123,
     "expires_at": 456
 }
 
@@ -116,3 +207,170 @@ def test_remove_linking_record(my_data_dir):
 
     record = sm.get_linking_session("foo")
     assert record is None
+
+
+def test_expired_linking_session_rejected(my_data_dir):
+    sm = StorageModel()
+    sm.create_linking_session("baz", EXPIRED_LINKING_SESSION_RECORD_1)
+    assert sm.get_linking_session("baz") is None
+
+    # The record is still stored, until swept.
+    assert sm.db.get("linking-sessions", "baz") is not None
+
+
+def test_expired_linking_session_from_storage_rejected(my_data_dir):
+    # As if created by another process.
+    sm = StorageModel()
+    sm.db.create("linking-sessions", "baz", EXPIRED_LINKING_SESSION_RECORD_1)
+    assert sm.get_linking_session("baz") is None
+
+
+def test_delete_expired_linking_sessions(my_data_dir):
+    sm = StorageModel()
+    sm.create_linking_session("foo", EXAMPLE_LINKING_SESSION_RECORD_1)
+    for index in range(5):
+        session_id = f"expired{index}"
+        sm.db.create("linking-sessions", session_id,
+                     dict(EXPIRED_LINKING_SESSION_RECORD_1, session_id=session_id))
+
+    sm.load_linking_session_expiry()
+    assert sm.delete_expired_linking_sessions(3) == 3
+    assert sm.delete_expired_linking_sessions(3) == 2
+    assert sm.delete_expired_linking_sessions(3) == 0
+
+    assert [record["session_id"] for record in sm.db.list("linking-sessions")] == ["foo"]
+
+
+def test_sweeper_retries_setting_up_storage(my_data_dir, monkeypatch):
+    sm = StorageModel()
+    sm.db.create("linking-sessions", "expired", dict(EXPIRED_LINKING_SESSION_RECORD_1, session_id="expired"))
+
+    # Setting up the storage, and then loading from it, fail at first, as if the
+    # storage were not yet available.
+    models = []
+    loads = []
+
+    def create_model():
+        models.append(True)
+        if len(models) == 1:
+            raise Exception("storage not available")
+        return StorageModel()
+
+    original_load = StorageModel.load_linking_session_expiry
+
+    def load_linking_session_expiry(self):
+        loads.append(True)
+        if len(loads) == 1:
+            raise Exception("storage not available")
+        original_load(self)
+
+    monkeypatch.setattr(linking_session_sweeper, "StorageModel", create_model)
+    monkeypatch.setattr(StorageModel, "load_linking_session_expiry", load_linking_session_expiry)
+
+    async def run():
+        task = asyncio.create_task(linking_session_sweeper.sweep_linking_sessions(interval=0, batch_size=10))
+        try:
+            for _ in range(100):
+                if sm.db.get("linking-sessions", "expired") is None:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(run())
+    assert len(models) == 2
+    assert len(loads) == 2
+    assert sm.db.get("linking-sessions", "expired") is None
+
+
+#
+# Async storage model
+#
+
+def test_async_user_record(my_data_dir):
+    async def run():
+        sm = AsyncStorageModel()
+        await sm.create_user_record("foo", EXAMPLE_LINK_RECORD_1)
+        record = await sm.get_user_record("foo")
+        assert record is not None
+        assert record.orcid_auth.access_token == "foo"
+
+        await sm.remove_user_record("foo")
+        assert await sm.get_user_record("foo") is None
+
+    asyncio.run(run())
+
+
+def test_async_linking_session(my_data_dir):
+    async def run():
+        sm = AsyncStorageModel()
+        await sm.create_linking_session("foo", EXAMPLE_LINKING_SESSION_RECORD_1)
+        record = await sm.get_linking_session("foo")
+        assert record["session_id"] == "foo"
+
+        updated_record = copy.deepcopy(EXAMPLE_LINKING_SESSION_RECORD_1)
+        updated_record["session_id"] = "fee"
+        await sm.update_linking_session("foo", updated_record)
+        record = await sm.get_linking_session("foo")
+        assert record["session_id"] == "fee"
+
+        await sm.delete_linking_session("foo")
+        assert await sm.get_linking_session("foo") is None
+
+    asyncio.run(run())
+
+
+def test_async_iterate_user_records(my_data_dir):
+    async def run():
+        sm = AsyncStorageModel()
+        for username in ["foo", "bar", "baz"]:
+            await sm.create_user_record(username, EXAMPLE_LINK_RECORD_1)
+
+        usernames = [username async for _, username, _ in sm.iterate_user_records(batch_size=2)]
+        assert usernames == ["foo", "bar", "baz"]
+
+    asyncio.run(run())
+
+
+#
+# Request storage model
+#
+
+def test_request_storage_memoizes_reads(my_data_dir):
+    async def run():
+        db = CountingFileStorage()
+        StorageModel(db=db).create_user_record("foo", EXAMPLE_LINK_RECORD_1)
+        storage = RequestStorageModel(AsyncStorageModel(StorageModel(db=db)))
+
+        first = await storage.get_user_record("foo")
+        second = await storage.get_user_record("foo")
+        assert first is second
+        assert await storage.get_user_record("bar") is None
+        assert await storage.get_user_record("bar") is None
+        assert db.gets == 2
+
+    asyncio.run(run())
+
+
+def test_request_storage_defers_writes(my_data_dir):
+    async def run():
+        sm = StorageModel()
+        storage = RequestStorageModel(AsyncStorageModel(sm))
+
+        await storage.create_linking_session("foo", EXAMPLE_LINKING_SESSION_RECORD_1)
+        await storage.create_user_record("foo", EXAMPLE_LINK_RECORD_1)
+        await storage.delete_linking_session("foo")
+
+        # Reads see the request's own writes, before they are committed.
+        assert await storage.get_linking_session("foo") is None
+        assert (await storage.get_user_record("foo")).orcid_auth.access_token == "foo"
+        assert sm.get_user_record("foo") is None
+
+        await storage.commit()
+        assert sm.get_user_record("foo") is not None
+        assert sm.get_linking_session("foo") is None
+        assert storage.pending_writes == []
+
+    asyncio.run(run())
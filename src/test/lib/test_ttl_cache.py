@@ -0,0 +1,78 @@
+import time
+
+from orcidlink.lib.ttl_cache import TTLCache
+
+
+def test_get_set():
+    cache = TTLCache(max_size=10, lifetime=60)
+    assert cache.get("foo") is None
+    cache.set("foo", "bar")
+    assert cache.get("foo") == "bar"
+    assert cache.stats() == {"size": 1, "max_size": 10, "hits": 1, "misses": 1}
+
+    cache.delete("foo")
+    assert cache.get("foo") is None
+
+    # A lookup expected to miss may not be counted.
+    assert cache.get("foo", count_miss=False) is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, lifetime=60)
+    cache.set("foo", 1)
+    cache.set("bar", 2)
+    assert cache.get("foo") == 1
+    cache.set("baz", 3)
+    assert cache.get("bar") is None
+    assert cache.get("foo") == 1
+    assert cache.get("baz") == 3
+
+
+def test_expires():
+    cache = TTLCache(max_size=10, lifetime=0.05)
+    cache.set("foo", 1)
+    cache.set("bar", 2, lifetime=60)
+    time.sleep(0.1)
+    assert cache.get("foo") is None
+    assert cache.get("bar") == 2
+    assert cache.stats()["size"] == 1
+
+
+def test_disabled():
+    cache = TTLCache(max_size=0, lifetime=60)
+    cache.set("foo", 1)
+    assert cache.get("foo") is None
+
+
+def test_max_bytes():
+    cache = TTLCache(max_size=10, lifetime=60, max_bytes=10, size_of=len)
+    cache.set("foo", "abcd")
+    cache.set("bar", "efgh")
+    assert cache.get("foo") == "abcd"
+    # Evicts the least recently used until within the budget.
+    cache.set("baz", "ijkl")
+    assert cache.get("bar") is None
+    assert cache.stats()["bytes"] == 8
+
+    # Replacing an entry replaces its size.
+    cache.set("foo", "a")
+    assert cache.stats()["bytes"] == 5
+
+    # Too large to cache at all.
+    cache.set("boo", "abcdefghijk")
+    assert cache.get("boo") is None
+    assert cache.stats()["bytes"] == 5
+
+    cache.delete("foo")
+    assert cache.stats()["bytes"] == 4
+    assert cache.stats()["max_bytes"] == 10
+
+
+def test_counted_by_caller():
+    cache = TTLCache(max_size=10, lifetime=60)
+    cache.set("foo", 1)
+    assert cache.get("foo", count_hit=False) == 1
+    cache.count(hit=False)
+    assert cache.stats()["hits"] == 0
+    assert cache.stats()["misses"] == 1
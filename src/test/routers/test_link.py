@@ -94,6 +94,11 @@ def test_get_link(fake_fs):
         response = client.get("/link",
                               headers={"Authorization": "foo"})
         assert response.status_code == 200
+        assert response.headers["server-timing"].startswith("auth;dur=")
+
+        response = client.get("/link")
+        assert response.status_code == 401
+        assert response.json()["code"] == "missingToken"
 
         response = client.get("/link",
                               headers={"Authorization": "foox"})
@@ -73,7 +73,9 @@ env:
     """
     fs.create_file("/kb/module/work/data/users/9.json", contents=fake_link_record)
 
-    fs.add_real_directory("/kb/module/src/test/data")
+    # Read up front, as the mock ORCID server reads test data from concurrent requests, and
+    # lazily loading files into the fake filesystem is not thread-safe.
+    fs.add_real_directory("/kb/module/src/test/data", lazy_read=False)
     yield fs
 
 
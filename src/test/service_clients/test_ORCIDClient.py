@@ -1,11 +1,16 @@
+import asyncio
 import json
 
+import httpx
 import pytest
 from orcidlink.lib import utils
-from orcidlink.lib.config import ensure_config
-from orcidlink.lib.responses import ErrorException
-from orcidlink.service_clients.ORCIDClient import ORCIDAPIClient, ORCIDOAuthClient, orcid_api, orcid_api_url, \
-    orcid_oauth
+from orcidlink.lib.config import ensure_config, set_config
+from orcidlink.lib.http_clients import close_http_clients
+from orcidlink.lib.responses import ErrorException, ErrorResponse
+from orcidlink.lib.ttl_cache import TTLCache
+from orcidlink.service_clients import ORCIDClient
+from orcidlink.service_clients.ORCIDClient import ORCIDAPIClient, ORCIDOAuthClient, fetch_concurrently, \
+    get_orcid_http_client, get_response_cache, get_response_cache_stats, orcid_api, orcid_api_url, orcid_oauth
 from test.mocks.mock_contexts import mock_orcid_api_service, mock_orcid_api_service_with_errors, \
     mock_orcid_oauth_service, \
     mock_orcid_oauth_service2, no_stderr
@@ -38,6 +43,11 @@ orcid:
   oauthBaseURL: https://sandbox.orcid.org/oauth
   baseURL: https://sandbox.orcid.org
   apiBaseURL: https://api.sandbox.orcid.org/v3.0
+  apiClient:
+    maxConnections: 100
+    http2: false
+    responseCache:
+      maxSize: 0
 env:
   CLIENT_ID: 'REDACTED-CLIENT-ID'
   CLIENT_SECRET: 'REDACTED-CLIENT-SECRET'
@@ -65,6 +75,38 @@ def test_orcid_api():
     assert value.access_token == "token"
 
 
+def test_get_orcid_http_client(test_filesystem, monkeypatch):
+    ensure_config(reload=True)
+
+    async def get_clients():
+        first = get_orcid_http_client()
+        second = get_orcid_http_client()
+        await close_http_clients()
+        return first, second
+
+    # Shared by all ORCID API clients.
+    first, second = asyncio.run(get_clients())
+    assert first is second
+
+    options = {}
+    monkeypatch.setattr(ORCIDClient, "get_http_client", lambda name, **client_options: options.update(client_options))
+    set_config(["orcid", "apiClient", "maxConnections"], 10)
+    get_orcid_http_client()
+    assert options["http2"] is False
+    assert options["limits"].max_connections == 10
+
+    # HTTP/2 is used only if the "h2" package is installed.
+    set_config(["orcid", "apiClient", "http2"], True)
+    monkeypatch.setattr(ORCIDClient, "http2_available", lambda: False)
+    get_orcid_http_client()
+    assert options["http2"] is False
+    monkeypatch.setattr(ORCIDClient, "http2_available", lambda: True)
+    get_orcid_http_client()
+    assert options["http2"] is True
+
+    ensure_config(reload=True)
+
+
 def test_orcid_oauth():
     value = orcid_oauth("token")
     assert isinstance(value, ORCIDOAuthClient)
@@ -241,7 +283,7 @@ def test_ORCIDAPI_get_profile():
                 url=url,
                 access_token="access_token"
             )
-            profile = client.get_profile(orcid_id)
+            profile = asyncio.run(client.get_profile(orcid_id))
             assert isinstance(profile, dict)
             assert profile['orcid-identifier']['path'] == orcid_id
 
@@ -254,7 +296,7 @@ def test_ORCIDAPI_get_email():
                 url=url,
                 access_token="access_token"
             )
-            email = client.get_email(orcid_id)
+            email = asyncio.run(client.get_email(orcid_id))
             assert isinstance(email, dict)
             assert email['email'][0]['email'] == "eaptest40@mailinator.com"
 
@@ -267,7 +309,7 @@ def test_ORCIDAPI_get_works():
                 url=url,
                 access_token="access_token"
             )
-            works = client.get_works(orcid_id)
+            works = asyncio.run(client.get_works(orcid_id))
             assert isinstance(works, dict)
             assert works['group'][0]['work-summary'][0]['put-code'] == 1487805
 
@@ -281,7 +323,7 @@ def test_ORCIDAPI_get_works_error():
                 access_token="access_token"
             )
             with pytest.raises(ErrorException, match="Error fetching data from ORCID Auth api") as ex:
-                client.get_works(orcid_id)
+                asyncio.run(client.get_works(orcid_id))
 
 
 def test_ORCIDAPI_save_work():
@@ -304,7 +346,7 @@ def test_ORCIDAPI_save_work():
             put_code = 1526002
             work_update = load_test_data(f"work_{str(put_code)}")
             # don't change anything for now
-            result = client.save_work(orcid_id, put_code, work_update)
+            result = asyncio.run(client.save_work(orcid_id, put_code, work_update))
             assert isinstance(result, dict)
             assert result['put-code'] == put_code
 
@@ -329,5 +371,217 @@ def test_ORCIDAPI_save_work_error():
                 put_code = 1526002
                 work_update = load_test_data(f"work_{str(put_code)}")
                 # don't change anything for now
-                client.save_work(orcid_id, put_code, work_update)
+                asyncio.run(client.save_work(orcid_id, put_code, work_update))
             assert ex.value.error.data['originalResponseJSON']['response-code'] == 400
+
+
+#
+# Concurrent requests
+#
+
+def test_fetch_concurrently():
+    started = []
+
+    async def fetch(value, error=None):
+        started.append(value)
+        await asyncio.sleep(0.01)
+        # Both requests are underway before either completes.
+        assert len(started) == 2
+        if error is not None:
+            raise error
+        return value
+
+    assert asyncio.run(fetch_concurrently(fetch("foo"), fetch("bar"))) == ["foo", "bar"]
+
+    # A single error is raised as is.
+    started.clear()
+    with pytest.raises(ValueError, match="baz"):
+        asyncio.run(fetch_concurrently(fetch("foo"), fetch("bar", ValueError("baz"))))
+
+    # Several are raised together.
+    started.clear()
+    upstream_error = ErrorException(ErrorResponse(code="upstreamError", title="Error", message="Oops"),
+                                    status_code=400)
+    with pytest.raises(ErrorException, match="Errors fetching data from ORCID api") as ex:
+        asyncio.run(fetch_concurrently(fetch("foo", upstream_error), fetch("bar", ValueError("baz"))))
+    assert ex.value.status_code == 400
+    assert ex.value.error.data["errors"] == [
+        {"code": "upstreamError", "title": "Error", "message": "Oops"},
+        {"exception": "baz"}
+    ]
+
+
+#
+# Response cache
+#
+
+class FakeORCIDHTTPClient:
+    """
+    Stands in for the shared ORCID API client, recording requests, and responding with
+    the given responses in turn.
+    """
+
+    def __init__(self, *responses: httpx.Response):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def get(self, url, headers=None, timeout=None):
+        self.requests.append(("GET", url, headers))
+        return self.responses.pop(0)
+
+    async def put(self, url, headers=None, content=None, timeout=None):
+        self.requests.append(("PUT", url, headers))
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    cache = TTLCache(max_size=10, lifetime=60)
+    monkeypatch.setattr(ORCIDClient, "response_cache", cache)
+    # As if configured with "freshFor".
+    monkeypatch.setattr(ORCIDClient, "DEFAULT_RESPONSE_FRESH_FOR", 30)
+    yield cache
+
+
+def use_fake_http_client(monkeypatch, *responses: httpx.Response) -> FakeORCIDHTTPClient:
+    http_client = FakeORCIDHTTPClient(*responses)
+    monkeypatch.setattr(ORCIDClient, "get_orcid_http_client", lambda: http_client)
+    return http_client
+
+
+def test_ORCIDAPI_response_cache(response_cache, monkeypatch):
+    orcid_id = "0000-0003-4997-3076"
+    http_client = use_fake_http_client(
+        monkeypatch,
+        httpx.Response(200, json={"works": 1}, headers={"ETag": "v1"}),
+        httpx.Response(304),
+        httpx.Response(200, json={"works": 2}, headers={"ETag": "v2"}),
+        httpx.Response(200, json={"works": 3}),
+    )
+    client = ORCIDAPIClient(url="url", access_token="access_token")
+
+    # Fetched, then served from the cache while fresh.
+    assert asyncio.run(client.get_works(orcid_id)) == {"works": 1}
+    assert asyncio.run(client.get_works(orcid_id)) == {"works": 1}
+    assert len(http_client.requests) == 1
+
+    # Revalidated once stale; unchanged.
+    response_cache.get(f"url/{orcid_id}/works").fresh_until = 0
+    assert asyncio.run(client.get_works(orcid_id)) == {"works": 1}
+    assert http_client.requests[1][2]["If-None-Match"] == "v1"
+    assert asyncio.run(client.get_works(orcid_id)) == {"works": 1}
+    assert len(http_client.requests) == 2
+
+    # Revalidated once stale; changed.
+    response_cache.get(f"url/{orcid_id}/works").fresh_until = 0
+    assert asyncio.run(client.get_works(orcid_id)) == {"works": 2}
+    assert len(http_client.requests) == 3
+
+    # Not shared with another token.
+    other_client = ORCIDAPIClient(url="url", access_token="other_access_token")
+    assert asyncio.run(other_client.get_works(orcid_id)) == {"works": 3}
+    assert "If-None-Match" not in http_client.requests[3][2]
+
+
+def test_ORCIDAPI_response_cache_never_fresh(response_cache, monkeypatch):
+    monkeypatch.setattr(ORCIDClient, "DEFAULT_RESPONSE_FRESH_FOR", 0)
+    orcid_id = "0000-0003-4997-3076"
+    http_client = use_fake_http_client(
+        monkeypatch,
+        httpx.Response(200, json={"works": 1}, headers={"ETag": "v1"}),
+        httpx.Response(304),
+        httpx.Response(200, json={"email": 1}),
+    )
+    client = ORCIDAPIClient(url="url", access_token="access_token")
+
+    # Revalidated on every use; only a confirmed response counts as a hit.
+    assert asyncio.run(client.get_works(orcid_id)) == {"works": 1}
+    assert response_cache.stats()["hits"] == 0
+    assert asyncio.run(client.get_works(orcid_id)) == {"works": 1}
+    assert http_client.requests[1][2]["If-None-Match"] == "v1"
+    assert response_cache.stats()["hits"] == 1
+
+    # A response which can't be revalidated is of no use, so is not cached.
+    assert asyncio.run(client.get_email(orcid_id)) == {"email": 1}
+    assert response_cache.get(f"url/{orcid_id}/email") is None
+
+
+def test_ORCIDAPI_response_cache_hits(response_cache, monkeypatch):
+    orcid_id = "0000-0003-4997-3076"
+    use_fake_http_client(
+        monkeypatch,
+        httpx.Response(200, json={"works": 1}, headers={"ETag": "v1"}),
+        httpx.Response(200, json={"works": 2}, headers={"ETag": "v2"}),
+        httpx.Response(200, json={"works": 3}, headers={"ETag": "v3"}),
+    )
+    client = ORCIDAPIClient(url="url", access_token="access_token")
+    asyncio.run(client.get_works(orcid_id))
+    # Served while fresh.
+    asyncio.run(client.get_works(orcid_id))
+    # Stale, and changed.
+    response_cache.get(f"url/{orcid_id}/works", count_hit=False).fresh_until = 0
+    asyncio.run(client.get_works(orcid_id))
+    # Cached for another token.
+    asyncio.run(ORCIDAPIClient(url="url", access_token="other_access_token").get_works(orcid_id))
+    assert response_cache.stats()["hits"] == 1
+    assert response_cache.stats()["misses"] == 3
+
+
+def test_ORCIDAPI_response_cache_errors_not_cached(response_cache, monkeypatch):
+    orcid_id = "0000-0003-4997-3076"
+    http_client = use_fake_http_client(
+        monkeypatch,
+        httpx.Response(400, json={"error": "oops"}),
+        httpx.Response(200, json={"works": 1}),
+    )
+    client = ORCIDAPIClient(url="url", access_token="access_token")
+    with pytest.raises(ErrorException):
+        asyncio.run(client.get_works(orcid_id))
+    assert asyncio.run(client.get_works(orcid_id)) == {"works": 1}
+    assert len(http_client.requests) == 2
+
+
+def test_ORCIDAPI_response_cache_invalidated(response_cache, monkeypatch):
+    orcid_id = "0000-0003-4997-3076"
+    put_code = 1526002
+    http_client = use_fake_http_client(
+        monkeypatch,
+        httpx.Response(200, json={"record": 1}),
+        httpx.Response(200, json={"email": 1}),
+        httpx.Response(200, json={"bulk": 1}),
+        httpx.Response(200, json={"put-code": put_code}),
+        httpx.Response(200, json={"record": 2}),
+        httpx.Response(200, json={"bulk": 2}),
+    )
+    client = ORCIDAPIClient(url="url", access_token="access_token")
+
+    async def fetch_all():
+        return await fetch_concurrently(client.get_profile(orcid_id),
+                                        client.get_email(orcid_id),
+                                        client.get_work(orcid_id, put_code))
+
+    assert asyncio.run(fetch_all()) == [{"record": 1}, {"email": 1}, {"bulk": 1}]
+    asyncio.run(client.save_work(orcid_id, put_code, {"put-code": put_code}))
+
+    # The record and the work are refetched; the email is unaffected.
+    assert asyncio.run(fetch_all()) == [{"record": 2}, {"email": 1}, {"bulk": 2}]
+    assert len(http_client.requests) == 6
+
+
+def test_get_response_cache(test_filesystem, monkeypatch):
+    ensure_config(reload=True)
+    monkeypatch.setattr(ORCIDClient, "response_cache", None)
+
+    # Disabled unless configured.
+    assert get_response_cache() is None
+    assert get_response_cache_stats() is None
+
+    set_config(["orcid", "apiClient", "responseCache", "maxSize"], 5)
+    cache = get_response_cache()
+    assert cache.max_size == 5
+    assert cache.lifetime == 600
+    assert get_response_cache() is cache
+    assert get_response_cache_stats()["max_size"] == 5
+    assert get_response_cache_stats()["max_bytes"] == ORCIDClient.DEFAULT_RESPONSE_CACHE_MAX_BYTES
+
+    ensure_config(reload=True)
@@ -1,8 +1,10 @@
+import asyncio
 import json
 
 import pytest
+from fastapi import Request
 from orcidlink.lib import utils
-from orcidlink.service_clients import auth
+from orcidlink.service_clients import auth, authclient2
 from test.mocks.mock_contexts import mock_auth_service, no_stderr
 from test.mocks.mock_server import MockService
 
@@ -96,3 +98,34 @@ def test_auth_get_username(my_config_file):
     with no_stderr():
         with mock_auth_service():
             assert auth.get_username("foo") == "foo"
+
+
+def test_auth_get_username_async(my_config_file):
+    with no_stderr():
+        with mock_auth_service():
+            assert asyncio.run(auth.get_username_async("foo")) == "foo"
+
+
+def test_get_request_token_info(my_config_file, monkeypatch):
+    calls = []
+
+    async def get_token_info_async(self, token):
+        calls.append(token)
+        return await original_get_token_info_async(self, token)
+
+    original_get_token_info_async = authclient2.KBaseAuth.get_token_info_async
+    monkeypatch.setattr(authclient2.KBaseAuth, "get_token_info_async", get_token_info_async)
+
+    async def get_twice(request):
+        return [await auth.get_request_token_info(request, "foo"),
+                await auth.get_request_token_info(request, "foo")]
+
+    request = Request({"type": "http"})
+    with no_stderr():
+        with mock_auth_service():
+            first, second = asyncio.run(get_twice(request))
+    assert first.user == "foo"
+    assert second is first
+    assert calls == ["foo"]
+    assert request.state.token_info is first
+    assert request.state.auth_duration >= 0
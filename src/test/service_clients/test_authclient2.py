@@ -1,6 +1,10 @@
+import asyncio
 import contextlib
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import httpx
 import pytest
 from orcidlink.lib import utils
 from orcidlink.service_clients import authclient2
@@ -200,3 +204,181 @@ def test_KBaseAuth_get_username():
 
         username = client.get_username("foo")
         assert username == "foo"
+
+
+def test_KBaseAuth_get_token_info_async():
+    with mock_services() as url:
+        client = authclient2.KBaseAuth(
+            auth_url=url,
+            cache_max_size=3,
+            cache_lifetime=3
+        )
+        client.cache.clear()
+
+        async def get_token_infos():
+            return [await client.get_token_info_async("foo"), await client.get_username_async("foo")]
+
+        token_info, username = asyncio.run(get_token_infos())
+        assert isinstance(token_info, TokenInfo)
+        assert token_info.user == "foo"
+        assert username == "foo"
+
+
+def test_KBaseAuth_get_token_info_async_errors():
+    with mock_services() as url:
+        client = authclient2.KBaseAuth(
+            auth_url=url,
+            cache_max_size=3,
+            cache_lifetime=3
+        )
+        client.cache.clear()
+
+        with pytest.raises(authclient2.KBaseAuthInvalidToken):
+            asyncio.run(client.get_token_info_async("x"))
+        with pytest.raises(authclient2.KBaseAuthException):
+            asyncio.run(client.get_token_info_async("internal_server_error"))
+
+
+def make_token_info(user: str) -> TokenInfo:
+    return TokenInfo.parse_obj({**GET_TOKEN_FOO, "user": user})
+
+
+def test_KBaseAuth_concurrent_lookups_share_request(monkeypatch):
+    client = authclient2.KBaseAuth(
+        auth_url="http://foo/services/auth/api/V2/token",
+        cache_max_size=3,
+        cache_lifetime=3
+    )
+    client.cache.clear()
+    fetches = []
+
+    def fetch_token_info(token):
+        fetches.append(token)
+        time.sleep(0.1)
+        if token == "bad":
+            raise authclient2.KBaseAuthInvalidToken("Invalid token")
+        return make_token_info(token)
+
+    monkeypatch.setattr(client, "fetch_token_info", fetch_token_info)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        usernames = list(executor.map(client.get_username, ["foo"] * 8))
+    assert usernames == ["foo"] * 8
+    assert fetches == ["foo"]
+
+    def get_username(token):
+        try:
+            return client.get_username(token)
+        except authclient2.KBaseAuthInvalidToken:
+            return None
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(get_username, ["bad"] * 4)) == [None] * 4
+    assert fetches == ["foo", "bad"]
+    assert authclient2.token_lookups == {}
+
+
+def test_KBaseAuth_concurrent_async_lookups_share_request(monkeypatch):
+    client = authclient2.KBaseAuth(
+        auth_url="http://foo/services/auth/api/V2/token",
+        cache_max_size=3,
+        cache_lifetime=3
+    )
+    client.cache.clear()
+    fetches = []
+
+    async def fetch_token_info_async(token):
+        fetches.append(token)
+        await asyncio.sleep(0.1)
+        return make_token_info(token)
+
+    monkeypatch.setattr(client, "fetch_token_info_async", fetch_token_info_async)
+
+    async def get_usernames():
+        return await asyncio.gather(*[client.get_username_async(token) for token in ["foo", "bar", "foo", "foo"]])
+
+    assert asyncio.run(get_usernames()) == ["foo", "bar", "foo", "foo"]
+    assert fetches == ["foo", "bar"]
+    assert authclient2.async_token_lookups == {}
+
+
+def test_KBaseAuth_caches_invalid_tokens():
+    with mock_services() as url:
+        client = authclient2.KBaseAuth(
+            auth_url=url,
+            cache_max_size=3,
+            cache_lifetime=3
+        )
+        client.invalid_token_cache.clear()
+
+        with pytest.raises(authclient2.KBaseAuthInvalidToken):
+            client.get_token_info("x")
+        # Other errors are not cached.
+        with pytest.raises(authclient2.KBaseAuthException):
+            client.get_token_info("exception")
+        assert client.invalid_token_cache.stats()["size"] == 1
+
+    # With the auth service gone, the token is still known to be invalid.
+    with pytest.raises(authclient2.KBaseAuthInvalidToken):
+        client.get_token_info("x")
+    with pytest.raises(authclient2.KBaseAuthInvalidToken):
+        asyncio.run(client.get_token_info_async("x"))
+    assert authclient2.get_invalid_token_cache_stats()["hits"] == 2
+    assert authclient2.get_invalid_token_cache_stats()["misses"] == 0
+
+
+def test_KBaseAuth_token_info_lifetime():
+    client = authclient2.KBaseAuth(
+        auth_url="http://foo/services/auth/api/V2/token",
+        cache_max_size=3,
+        cache_lifetime=600
+    )
+    client.cache.clear()
+    now = int(time.time() * 1000)
+
+    def token_info_response(cachefor, expires):
+        return httpx.Response(200, json={**GET_TOKEN_FOO, "cachefor": cachefor, "expires": expires})
+
+    # Limited by the auth service's "cachefor"
+    client.cache_token_info_response("foo", token_info_response(300000, now + 3600000))
+    assert 299 < client.cache.entries["foo"][0] - time.monotonic() <= 300
+
+    # by the token's expiry
+    client.cache_token_info_response("bar", token_info_response(300000, now + 60000))
+    assert 59 < client.cache.entries["bar"][0] - time.monotonic() <= 60
+
+    # and by the configured lifetime.
+    client.cache_token_info_response("baz", token_info_response(3600000, now + 3600000))
+    assert 599 < client.cache.entries["baz"][0] - time.monotonic() <= 600
+
+    # Expired tokens are not cached at all.
+    client.cache_token_info_response("boo", token_info_response(300000, now - 1000))
+    assert client.cache.get("boo") is None
+
+
+def test_KBaseAuth_shared_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(authclient2, "global_shared_cache", None)
+    client = authclient2.KBaseAuth(
+        auth_url="http://foo/services/auth/api/V2/token",
+        cache_max_size=3,
+        cache_lifetime=600,
+        shared_cache_path=str(tmp_path / "token-cache.sqlite3")
+    )
+    client.cache.clear()
+    now = int(time.time() * 1000)
+    token_info = client.cache_token_info_response("foo", httpx.Response(200, json={**GET_TOKEN_FOO, "expires": now + 3600000}))
+    client.share_token_info("foo", token_info)
+
+    # As if in another worker process, with a cold in-process cache.
+    client.cache.clear()
+    token_info = client.get_token_info("foo")
+    assert token_info.user == "foo"
+    assert client.cache.get("foo") == token_info
+    assert authclient2.get_shared_token_cache_stats()["hits"] == 1
+
+    # The shared cache is also read, in a worker thread, by the async client.
+    client.cache.clear()
+    token_info = asyncio.run(client.get_token_info_async("foo"))
+    assert token_info.user == "foo"
+    assert client.cache.get("foo") == token_info
+    assert authclient2.get_shared_token_cache_stats()["hits"] == 2